@@ -0,0 +1,273 @@
+"""Allocate vlans, bundles, ASNs and prefixes to new service orders
+
+Resource service defaults marked with "allocate" are filled from the
+ResourcePool of the field validator for the node, or for the site of the
+node. A pool keeps a bitmap of the values it handed out. Values that
+orders were given by hand are skipped as well, found through the
+resource usage of conflict detection. Pools are locked with
+SELECT ... FOR UPDATE until the order is committed, so concurrent orders
+only wait for each other when they allocate from the same pool.
+"""
+
+import ipaddress
+
+from django.db import transaction
+
+from configuration.conflicts import (
+    IPV6_SHIFT,
+    USAGE_VALIDATORS,
+    exact_range,
+    overlap_query,
+)
+from configuration.constants import MAX_POOL_UNITS
+from configuration.models import (
+    Node,
+    ResourceAllocation,
+    ResourcePool,
+    ResourceUsage,
+)
+from configuration.validators import ViconfValidators
+
+
+class ViconfAllocationError(Exception):
+    pass
+
+
+PREFIX_VERSIONS = {'cidrv4': 4, 'cidrv6': 6}
+
+
+def pool_network(pool):
+    return ipaddress.ip_network(pool.prefix)
+
+
+def pool_size(pool):
+    """ The number of values in a pool """
+    if pool.validator in PREFIX_VERSIONS:
+        return 2 ** (pool.prefix_length - pool_network(pool).prefixlen)
+    return pool.last - pool.first + 1
+
+
+def check_pool(pool):
+    """ Raise ViconfAllocationError if a pool is not well formed """
+    if pool.validator in PREFIX_VERSIONS:
+        try:
+            network = pool_network(pool)
+        except (TypeError, ValueError):
+            raise ViconfAllocationError(f"Invalid prefix {pool.prefix}")
+        if network.version != PREFIX_VERSIONS[pool.validator]:
+            raise ViconfAllocationError(
+                f"{pool.prefix} is not a {pool.validator} prefix"
+            )
+        if (pool.prefix_length is None or
+                not network.prefixlen <= pool.prefix_length
+                <= network.max_prefixlen):
+            raise ViconfAllocationError(
+                f"Prefix length must be between {network.prefixlen} and "
+                f"{network.max_prefixlen}"
+            )
+    elif pool.validator in ('vlan', 'bundle', 'asn'):
+        spec = ViconfValidators.VALIDATORS[pool.validator]
+        if (pool.first is None or pool.last is None or
+                not spec['start'] <= pool.first <= pool.last < spec['end']):
+            raise ViconfAllocationError(
+                f"A {pool.validator} pool must be within {spec['start']} "
+                f"and {spec['end'] - 1}"
+            )
+    else:
+        raise ViconfAllocationError(f"Can't allocate {pool.validator}")
+
+    if pool.node_id is None and not pool.site:
+        raise ViconfAllocationError("A pool needs a node or a site")
+    if pool_size(pool) > MAX_POOL_UNITS:
+        raise ViconfAllocationError(
+            f"A pool can hold at most {MAX_POOL_UNITS} values"
+        )
+
+
+def unit_value(pool, unit):
+    """ The value of the unit-th entry of a pool """
+    if pool.validator in PREFIX_VERSIONS:
+        network = pool_network(pool)
+        step = 2 ** (network.max_prefixlen - pool.prefix_length)
+        address = network.network_address + unit * step
+        return f"{address}/{pool.prefix_length}"
+    return str(pool.first + unit)
+
+
+def allocated_count(pool):
+    return bin(int.from_bytes(pool.bitmap, 'little')).count('1')
+
+
+def pool_hostnames(pool):
+    if pool.node_id is not None:
+        return [pool.node_id]
+    return list(
+        Node.objects.filter(site=pool.site).values_list('hostname', flat=True)
+    )
+
+
+def used_units(pool, reserved=()):
+    """Return a bitmask of the units of a pool holding values that
+    orders on its nodes already use, or that the unsaved usages in
+    reserved hold"""
+    if pool.validator in PREFIX_VERSIONS:
+        network = pool_network(pool)
+        base = int(network.network_address)
+        high = int(network.broadcast_address)
+        step = 2 ** (network.max_prefixlen - pool.prefix_length)
+    else:
+        base, high, step = pool.first, pool.last, 1
+
+    hostnames = pool_hostnames(pool)
+    kind = USAGE_VALIDATORS[pool.validator]
+    shift = IPV6_SHIFT if kind == 'ipv6' else 0
+    stored = ResourceUsage.objects.filter(
+        overlap_query(kind, base >> shift, high >> shift, node__in=hostnames),
+        order__deleted=False,
+    ).only('kind', 'value', 'start', 'end')
+    used = [exact_range(usage) for usage in stored]
+    used += [
+        exact_range(usage) for usage in reserved
+        if usage.node in hostnames and usage.kind == kind
+    ]
+
+    mask = 0
+    for start, end in used:
+        if start > high or end < base:
+            continue
+        first_unit = (max(start, base) - base) // step
+        last_unit = (min(end, high) - base) // step
+        mask |= ((1 << (last_unit - first_unit + 1)) - 1) << first_unit
+
+    return mask
+
+
+def take_unit(pool, reserved=()):
+    """Mark the lowest free unit of a locked pool as allocated, in
+    memory, and return it"""
+    size = pool_size(pool)
+    allocated = int.from_bytes(pool.bitmap, 'little')
+    free = ~(allocated | used_units(pool, reserved)) & ((1 << size) - 1)
+    if not free:
+        raise ViconfAllocationError(
+            f"No free {pool.validator} left in pool {pool.pk}"
+        )
+
+    unit = (free & -free).bit_length() - 1
+    allocated |= 1 << unit
+    pool.bitmap = allocated.to_bytes((size + 7) // 8, 'little')
+
+    return unit
+
+
+def find_pool(validator, node):
+    """ The pool of a node for a validator, or else the one of its site """
+    pools = ResourcePool.objects.filter(validator=validator).order_by('pk')
+    pool = pools.filter(node=node).first()
+    if pool is None:
+        pool = pools.filter(node__isnull=True, site=node.site).first()
+
+    return pool
+
+
+def allocation_requests(service, template_fields):
+    """Return (node, field, validator) for the fields of a prefetched
+    service marked for allocation and left empty in template fields"""
+    requests = {}
+    for rs in service.resource_services.all():
+        fields = [
+            field for field, default in rs.defaults.items()
+            if default.get('allocate')
+        ]
+        if not fields:
+            continue
+        if rs.node is not None:
+            node = rs.node.hostname
+        elif template_fields:
+            node = list(template_fields.keys())[0]
+        else:
+            continue
+
+        validators = {}
+        for template in rs.resource_templates.all():
+            for field, validator in template.fields.items():
+                validators.setdefault(field, validator)
+
+        for field in fields:
+            if template_fields.get(node, {}).get(field) not in (None, ''):
+                continue
+            validator = validators.get(field)
+            if validator not in dict(ResourcePool.VALIDATORS):
+                raise ViconfAllocationError(
+                    f"{field} is a {validator} and can't be allocated"
+                )
+            requests.setdefault((node, field), validator)
+
+    return [
+        (node, field, validator)
+        for (node, field), validator in requests.items()
+    ]
+
+
+def allocate_order_fields(service, template_fields, reserved=()):
+    """Fill the empty fields marked for allocation of a new order, in
+    place, returning the unsaved ResourceAllocations. reserved holds
+    the unsaved usages of orders created along with this one.
+
+    Call this in a transaction. The pools allocated from stay locked
+    until it ends, and their bitmaps are saved here.
+    """
+    requests = allocation_requests(service, template_fields)
+    if not requests:
+        return []
+
+    nodes = Node.objects.in_bulk({node for node, _, _ in requests})
+    pool_ids = {}
+    for node, field, validator in requests:
+        if node not in nodes:
+            raise ViconfAllocationError(f"Unknown node {node}")
+        pool = find_pool(validator, nodes[node])
+        if pool is None:
+            raise ViconfAllocationError(f"No {validator} pool for {node}")
+        pool_ids[(node, field)] = pool.pk
+
+    # Lock in primary key order, so concurrent orders can't deadlock
+    pools = ResourcePool.objects.select_for_update().filter(
+        pk__in=set(pool_ids.values())
+    ).order_by('pk').in_bulk()
+
+    allocations = []
+    for node, field, validator in requests:
+        pool = pools[pool_ids[(node, field)]]
+        unit = take_unit(pool, reserved)
+        template_fields.setdefault(node, {})[field] = unit_value(pool, unit)
+        allocations.append(ResourceAllocation(
+            pool=pool, node=node, field=field, unit=unit
+        ))
+
+    for pool in pools.values():
+        pool.save(update_fields=['bitmap', 'modified'])
+
+    return allocations
+
+
+@transaction.atomic
+def release_order_allocations(service_order):
+    """ Give the values allocated to a service order back to their pools """
+    allocations = list(service_order.allocations.all())
+    if not allocations:
+        return
+
+    pools = ResourcePool.objects.select_for_update().filter(
+        pk__in={allocation.pool_id for allocation in allocations}
+    ).order_by('pk').in_bulk()
+    for pool in pools.values():
+        allocated = int.from_bytes(pool.bitmap, 'little')
+        for allocation in allocations:
+            if allocation.pool_id == pool.pk:
+                allocated &= ~(1 << allocation.unit)
+        pool.bitmap = allocated.to_bytes(len(pool.bitmap), 'little')
+        pool.save(update_fields=['bitmap', 'modified'])
+    ResourceAllocation.objects.filter(
+        pk__in=[allocation.pk for allocation in allocations]
+    ).delete()
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ConfigurationConfig(AppConfig):
     name = 'configuration'
+
+    def ready(self):
+        from configuration import signals  # noqa: F401
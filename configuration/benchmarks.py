@@ -0,0 +1,303 @@
+"""Benchmarks for the render, validate and schema hot paths
+
+The benchmarks build synthetic templates, services and orders in the
+current database, so run them through the bench management command,
+which uses a throwaway test database.
+"""
+
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from configuration.helpers import (
+    config_cache,
+    generate_service_schema,
+    prefetch_services,
+)
+from configuration.models import (
+    Group,
+    Node,
+    ResourceService,
+    ResourceTemplate,
+    Service,
+    ServiceOrder,
+)
+from configuration.mustache import CompiledTemplate, ViconfMustache
+from configuration.validators import ViconfValidators
+
+SIZES = {
+    'template_lines': [10, 100, 1000, 5000],
+    'merge_templates': [5, 20, 50, 200],
+    'resource_services': [1, 10, 100],
+    'order_fields': [10, 100, 1000],
+    'order_rows': [100, 1000, 10000],
+}
+
+QUICK_SIZES = {
+    'template_lines': [10, 100],
+    'merge_templates': [5],
+    'resource_services': [1, 10],
+    'order_fields': [10, 100],
+    'order_rows': [100, 1000],
+}
+
+
+def synthetic_template(lines, fields=1):
+    """A template of about the given number of lines, rounded up to
+    whole blocks, using the fields field0 to field<fields - 1>"""
+    block = [
+        "interface {{ field%(index)d }}.%(unit)d",
+        " description {{ customer }} {{ reference }}",
+        "{{#field%(index)d}}",
+        " encapsulation dot1q {{ field%(index)d }}",
+        "{{/field%(index)d}}",
+        "{{! comment }}",
+    ]
+    out = []
+    unit = 0
+    while len(out) < lines:
+        for line in block:
+            out.append(line % {'index': unit % fields, 'unit': unit})
+        unit += 1
+    return "\n".join(out)
+
+
+def measure(func, repeat, setup=None):
+    """Run func repeat times, returning latencies and query counts.
+    setup runs untimed before every run."""
+    latencies = []
+    queries = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+        queries.append(len(context.captured_queries))
+
+    return latencies, queries
+
+
+def summarize(name, params, latencies, queries):
+    ordered = sorted(latencies)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    total = sum(latencies)
+    return {
+        'name': name,
+        'params': params,
+        'runs': len(latencies),
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': percentile(0.50) * 1000,
+        'p95_ms': percentile(0.95) * 1000,
+        'p99_ms': percentile(0.99) * 1000,
+        'throughput_per_s': len(latencies) / total if total else None,
+        'queries': max(queries),
+    }
+
+
+def bench_mustache(sizes, repeat):
+    params = {'customer': 'ACME', 'reference': 'REF-1', 'field0': '310'}
+    for lines in sizes['template_lines']:
+        template = synthetic_template(lines)
+        yield summarize(
+            'mustache_parse', {'lines': lines},
+            *measure(lambda: CompiledTemplate(template), repeat)
+        )
+        # The first call fills the template cache
+        ViconfMustache(template).compile(dict(params), {})
+        yield summarize(
+            'mustache_compile', {'lines': lines},
+            *measure(
+                lambda: ViconfMustache(template).compile(dict(params), {}),
+                repeat
+            )
+        )
+
+
+def bench_merge_templates(sizes, repeat):
+    for count in sizes['merge_templates']:
+        templates = [
+            "{{! maintemplate }}\nheader\n{{! subtemplates }}\nfooter"
+        ]
+        for index in range(count):
+            template = synthetic_template(50)
+            if index % 5 == 0:
+                template += "\n{{! subexclude }}"
+            templates.append(template)
+        yield summarize(
+            'merge_templates', {'templates': count + 1, 'lines': 50},
+            *measure(lambda: ViconfMustache(list(templates)), repeat)
+        )
+
+
+def bench_validate(sizes, repeat):
+    vival = ViconfValidators()
+    validators = ['string', 'vlan', 'ipv4', 'cidrv4', 'asn']
+    samples = {
+        'string': 'foo',
+        'vlan': '310',
+        'ipv4': '10.0.0.1',
+        'cidrv4': '10.0.0.0/30',
+        'asn': '65000',
+    }
+    for count in sizes['order_fields']:
+        fields = {
+            f"field{index}": validators[index % len(validators)]
+            for index in range(count)
+        }
+        values = {field: samples[validator]
+                  for field, validator in fields.items()}
+
+        def validate_each():
+            for field, validator in fields.items():
+                vival.validate(validator, values[field])
+
+        yield summarize(
+            'validate', {'fields': count},
+            *measure(validate_each, repeat)
+        )
+        yield summarize(
+            'validate_many', {'fields': count},
+            *measure(lambda: vival.validate_many(fields, values), repeat)
+        )
+
+    # Orders of an import share their fields, so whole columns of values
+    # are checked per validator rather than one value at a time
+    fields = {validator: validator for validator in validators}
+    for count in sizes['order_rows']:
+        rows = [dict(samples) for index in range(count)]
+
+        def validate_each_row():
+            for row in rows:
+                vival.validate_many(fields, row)
+
+        yield summarize(
+            'validate_many_rows', {'rows': count},
+            *measure(validate_each_row, repeat)
+        )
+        yield summarize(
+            'validate_rows', {'rows': count},
+            *measure(lambda: vival.validate_rows(fields, rows), repeat)
+        )
+
+
+def create_service(resource_services, fields):
+    """Create a service with the given number of resource services,
+    each with three templates, and an order filling fields fields"""
+    group, _ = Group.objects.get_or_create(name='bench')
+    node, _ = Node.objects.get_or_create(
+        hostname='bench.node',
+        defaults={'group': group, 'driver': 'none', 'site': 'bench'}
+    )
+    template_fields = {f"field{index}": "string" for index in range(fields)}
+    templates = []
+    for index in range(3):
+        templates.append(ResourceTemplate.objects.create(
+            name=f"bench {resource_services}x{fields} {index}",
+            up_contents=synthetic_template(max(fields, 10), fields),
+            down_contents=synthetic_template(10, fields),
+            fields=template_fields,
+            labels={field: field for field in template_fields},
+        ))
+
+    service = Service.objects.create(name=f"bench {resource_services}")
+    for index in range(resource_services):
+        rs = ResourceService.objects.create(
+            name=f"bench {index}",
+            node=node if index % 2 == 0 else None,
+            defaults={
+                field: {'default': 'x', 'configurable': True}
+                for field in template_fields
+            }
+        )
+        rs.resource_templates.add(*templates)
+        service.resource_services.add(rs)
+
+    order = ServiceOrder.objects.create(
+        reference=f"BENCH-{resource_services}-{fields}",
+        service=service,
+        template_fields={
+            node.hostname: {field: 'value' for field in template_fields}
+        }
+    )
+    return service, order
+
+
+def config_url(client, order):
+    url = reverse(
+        'configuration:service_config_view', kwargs={'pk': order.pk}
+    )
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f"Config view failed: {response.content}")
+    return url
+
+
+def bench_service(sizes, repeat):
+    user, _ = User.objects.get_or_create(username='bench')
+    client = APIClient()
+    client.force_authenticate(user=user)
+    fields = sizes['order_fields'][0]
+
+    for count in sizes['resource_services']:
+        service, order = create_service(count, fields)
+
+        def schema():
+            generate_service_schema(
+                prefetch_services(Service.objects.all()).get(pk=service.pk)
+            )
+
+        yield summarize(
+            'generate_service_schema', {'resource_services': count},
+            *measure(schema, repeat)
+        )
+
+        yield from bench_config_view(
+            client, order, {'resource_services': count, 'fields': fields},
+            repeat
+        )
+
+    for fields in sizes['order_fields'][1:]:
+        service, order = create_service(1, fields)
+        yield from bench_config_view(
+            client, order, {'resource_services': 1, 'fields': fields}, repeat
+        )
+
+
+def bench_config_view(client, order, params, repeat):
+    """Time the config view rendering, with the config cache cleared
+    before every request, and served from the config cache"""
+    url = config_url(client, order)
+    yield summarize(
+        'service_config_view', dict(params, cache='cold'),
+        *measure(lambda: client.get(url), repeat, setup=config_cache().clear)
+    )
+    yield summarize(
+        'service_config_view', dict(params, cache='warm'),
+        *measure(lambda: client.get(url), repeat)
+    )
+
+
+BENCHMARKS = [
+    bench_mustache,
+    bench_merge_templates,
+    bench_validate,
+    bench_service,
+]
+
+
+def run_benchmarks(sizes=SIZES, repeat=20):
+    """ Run every benchmark, returning a list of result dicts """
+    results = []
+    for benchmark in BENCHMARKS:
+        results.extend(benchmark(sizes, repeat))
+    return results
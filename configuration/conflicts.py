@@ -0,0 +1,272 @@
+"""Detect service orders using the same vlan, bundle or IPv4 space on
+the same node
+
+Every order keeps one ResourceUsage row per tracked field, holding the
+range of values it covers. Every range is a single value or an aligned
+IPv4 prefix, so a stored range overlapping a new one either starts
+inside it or is a wider prefix starting at one of at most 32 masked
+addresses. Checking new values is then a bounded scan plus a few point
+lookups on the (node, kind, start) index rather than a scan over all
+orders, and the audit is a single sorted sweep over the usage table.
+
+ASNs and IPv6 prefixes are stored as well, so allocation can skip the
+values orders were given by hand, but are not conflicts: orders often
+share a peer ASN. IPv6 ranges don't fit a bigint, so they are stored as
+the ranges of their top 63 bits, which match a superset of the
+overlapping prefixes, and exact_range gives the full range.
+"""
+
+import ipaddress
+
+from django.db.models import Q
+
+from configuration.helpers import generate_service_validators
+from configuration.models import Node, ResourceUsage
+
+# Validator name to the kind of resource it holds. IPv4 addresses and
+# prefixes share one kind, so an address inside another order's prefix
+# is a conflict as well.
+TRACKED_VALIDATORS = {
+    'vlan': 'vlan',
+    'bundle': 'bundle',
+    'ipv4': 'ipv4',
+    'cidrv4': 'ipv4',
+}
+CONFLICT_KINDS = set(TRACKED_VALIDATORS.values())
+
+# Validators whose values are stored, conflicting or not
+USAGE_VALIDATORS = {
+    **TRACKED_VALIDATORS,
+    'asn': 'asn',
+    'cidrv6': 'ipv6',
+}
+
+# The bits of an IPv6 address dropped from its stored range
+IPV6_SHIFT = 65
+
+# The bits of the stored ranges of the prefix kinds
+PREFIX_BITS = {
+    'ipv4': 32,
+    'ipv6': 128 - IPV6_SHIFT,
+}
+
+
+def value_range(validator, value):
+    """ Return the (start, end) range of a value, or None if invalid """
+    try:
+        if validator in ('vlan', 'bundle', 'asn'):
+            number = int(value)
+            return number, number
+        if validator == 'ipv4':
+            address = int(ipaddress.IPv4Address(str(value)))
+            return address, address
+        if validator == 'cidrv4':
+            network = ipaddress.IPv4Network(str(value), strict=False)
+            return (int(network.network_address),
+                    int(network.broadcast_address))
+        if validator == 'cidrv6':
+            network = ipaddress.IPv6Network(str(value), strict=False)
+            return (int(network.network_address) >> IPV6_SHIFT,
+                    int(network.broadcast_address) >> IPV6_SHIFT)
+    except ValueError:
+        return None
+    return None
+
+
+def exact_range(usage):
+    """ The range of values of a usage, with IPv6 prefixes in full """
+    if usage.kind == 'ipv6':
+        network = ipaddress.IPv6Network(usage.value, strict=False)
+        return int(network.network_address), int(network.broadcast_address)
+    return usage.start, usage.end
+
+
+def node_validators(validators, node):
+    """The field validators of a node: those of the resource services
+    without a node, overridden by those of the node itself"""
+    return {**validators.get("__NONODE__", {}), **validators.get(node, {})}
+
+
+def order_usages(template_fields, validators, order=None):
+    """Return unsaved ResourceUsage rows for the stored fields of an
+    order, given the output of generate_service_validators"""
+    usages = []
+    for node, values in (template_fields or {}).items():
+        fields = node_validators(validators, node)
+        for field, value in values.items():
+            validator = fields.get(field)
+            if validator not in USAGE_VALIDATORS or value in (None, ''):
+                continue
+            found = value_range(validator, value)
+            if found is None:
+                continue
+            usages.append(ResourceUsage(
+                order=order,
+                node=node,
+                kind=USAGE_VALIDATORS[validator],
+                field=field,
+                value=str(value),
+                start=found[0],
+                end=found[1],
+            ))
+
+    return usages
+
+
+def describe(usage, other):
+    return (
+        f"{usage.field} {usage.value} on {usage.node} overlaps "
+        f"{other.field} {other.value} of order {other.order.reference}"
+    )
+
+
+def containing_starts(kind, start):
+    """ The starts of the wider prefixes that can hold start """
+    if kind not in PREFIX_BITS:
+        return []
+    return sorted(
+        {start & ~((1 << bits) - 1)
+         for bits in range(1, PREFIX_BITS[kind] + 1)} - {start}
+    )
+
+
+def overlap_query(kind, start, end, **node):
+    """Match the usages of a kind overlapping start to end, with node
+    given as a node or node__in lookup. Both clauses are bounded on the
+    (node, kind, start) index."""
+    query = Q(kind=kind, start__gte=start, start__lte=end, **node)
+    starts = containing_starts(kind, start)
+    if starts:
+        query |= Q(kind=kind, start__in=starts, end__gte=start, **node)
+    return query
+
+
+def order_hostnames(service, template_fields):
+    """The nodes an order of a prefetched service touches: those of its
+    template fields and those of the service's resource services"""
+    return set(template_fields or {}) | {
+        rs.node_id for rs in service.resource_services.all()
+        if rs.node_id is not None
+    }
+
+
+def lock_nodes(hostnames):
+    """Lock the nodes until the transaction ends, so orders on the same
+    nodes are checked for conflicts and saved one at a time"""
+    list(Node.objects.select_for_update().filter(
+        hostname__in=list(hostnames)
+    ).order_by('hostname').values_list('hostname', flat=True))
+
+
+def overlapping_usages(usages, exclude_order=None, batch_size=500):
+    """Yield (usage, other) for the usages overlapping the stored usages
+    of other live orders, with the overlap queries OR'ed together in
+    batches. Only the kinds that conflict are checked."""
+    usages = [usage for usage in usages if usage.kind in CONFLICT_KINDS]
+    for offset in range(0, len(usages), batch_size):
+        batch = usages[offset:offset + batch_size]
+        query = Q()
+        for usage in batch:
+            query |= overlap_query(
+                usage.kind, usage.start, usage.end, node=usage.node
+            )
+        existing = ResourceUsage.objects.filter(query).filter(
+            order__deleted=False
+        ).select_related('order')
+        if exclude_order is not None:
+            existing = existing.exclude(order=exclude_order)
+
+        found = {}
+        for other in existing:
+            found.setdefault((other.node, other.kind), []).append(other)
+        for usage in batch:
+            for other in found.get((usage.node, usage.kind), []):
+                if other.start <= usage.end and other.end >= usage.start:
+                    yield usage, other
+
+
+def find_conflicts(usages, exclude_order=None):
+    """ Return messages for the usages taken by other live orders """
+    return [
+        describe(usage, other)
+        for usage, other in overlapping_usages(usages, exclude_order)
+    ]
+
+
+def find_batch_conflicts(usages_list):
+    """Return a dict of position to messages for usages of orders in
+    the same batch overlapping each other, checking each usage against
+    the earlier orders of the batch"""
+    report = {}
+    seen = {}
+    for position, usages in enumerate(usages_list):
+        usages = [usage for usage in usages if usage.kind in CONFLICT_KINDS]
+        for usage in usages:
+            for other_position, other in seen.get((usage.node, usage.kind), []):
+                if other.start <= usage.end and other.end >= usage.start:
+                    report.setdefault(position, []).append(
+                        f"{usage.field} {usage.value} on {usage.node} "
+                        f"overlaps {other.field} {other.value} of order "
+                        f"{other_position} in this batch"
+                    )
+        for usage in usages:
+            seen.setdefault((usage.node, usage.kind), []).append(
+                (position, usage)
+            )
+
+    return report
+
+
+def service_order_usages(service_order, validators=None):
+    """ Return the unsaved usages of a saved service order """
+    if service_order.deleted or service_order.service is None:
+        return []
+    if validators is None:
+        validators = generate_service_validators(service_order.service)
+    return order_usages(
+        service_order.template_fields, validators, order=service_order
+    )
+
+
+def sync_order_usages(service_order, validators=None):
+    """ Replace the stored usages of a service order """
+    ResourceUsage.objects.filter(order=service_order).delete()
+    ResourceUsage.objects.bulk_create(
+        service_order_usages(service_order, validators)
+    )
+
+
+def audit_conflicts():
+    """Return every overlap between the usages of different live
+    orders, sweeping the usages of each node and kind in start order"""
+    usages = ResourceUsage.objects.filter(
+        order__deleted=False,
+        kind__in=CONFLICT_KINDS,
+    ).select_related('order').order_by('node', 'kind', 'start', 'end')
+
+    conflicts = []
+    active = []
+    group = None
+    for usage in usages.iterator():
+        if (usage.node, usage.kind) != group:
+            group = (usage.node, usage.kind)
+            active = []
+        active = [other for other in active if other.end >= usage.start]
+        for other in active:
+            if other.order_id != usage.order_id:
+                conflicts.append({
+                    "node": usage.node,
+                    "kind": usage.kind,
+                    "orders": [
+                        {
+                            "id": item.order_id,
+                            "reference": item.order.reference,
+                            "field": item.field,
+                            "value": item.value,
+                        }
+                        for item in (other, usage)
+                    ],
+                })
+        active.append(usage)
+
+    return conflicts
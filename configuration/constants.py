@@ -17,3 +17,40 @@ FORM_TAGS = [
     'node_ipv4',
     'node_ipv6'
 ]
+
+# Number of parsed templates kept in the process wide template cache.
+TEMPLATE_CACHE_SIZE = 4096
+
+# Threads rendering templates for the async views, overridden by the
+# VICONF_RENDER_THREADS setting.
+RENDER_THREADS = 4
+
+# Worker processes rendering the nodes of large services in parallel,
+# overridden by the VICONF_RENDER_PROCESSES setting. None uses one per
+# CPU and 0 always renders in the request thread.
+RENDER_PROCESSES = None
+
+# Services with more resource services than this are rendered in the
+# process pool, overridden by the VICONF_PARALLEL_RENDER_THRESHOLD
+# setting.
+PARALLEL_RENDER_THRESHOLD = 8
+
+# Rows written per query by bulk updates.
+BULK_UPDATE_BATCH_SIZE = 500
+
+# Threads running background jobs, overridden by the VICONF_JOB_THREADS
+# setting, and how long finished job statuses are kept, in seconds.
+JOB_THREADS = 2
+JOB_STATUS_TIMEOUT = 24 * 60 * 60
+
+# Seconds a rendered service order config is cached. Edits change the
+# cache key, so this only bounds how long stale entries linger.
+CONFIG_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+# Largest number of values in a resource pool, which bounds the size of
+# its allocation bitmap to 128 KiB.
+MAX_POOL_UNITS = 2 ** 20
+
+# Client addresses that may read /metrics without a token, overridden by
+# the VICONF_METRICS_ALLOWED_IPS setting. Everyone else needs a JWT.
+METRICS_ALLOWED_IPS = ()
@@ -1,5 +1,39 @@
-from configuration.models import Service, ResourceService, ResourceTemplate
-from configuration.mustache import ViconfMustache
+from configuration.models import (
+    Node,
+    Service,
+    ServiceOrder,
+    ResourceService,
+    ResourceTemplate,
+)
+from configuration.constants import (
+    BULK_UPDATE_BATCH_SIZE,
+    CONFIG_CACHE_TIMEOUT,
+)
+from configuration.metrics import timed
+from configuration.mustache import (
+    ViconfMustache,
+    ViconfMustacheTagException,
+    content_hash,
+)
+from configuration.snapshots import record_snapshots
+from configuration.workers import (
+    parallel_render_threshold,
+    render_process_executor,
+    render_node,
+    render_node_jobs,
+    render_processes,
+    reset_render_process_executor,
+)
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+import json
+from configuration.validators import ViconfValidators, ViconfValidationError
 import re
 
 
@@ -18,7 +52,7 @@ def generate_service_schema(service):
         for template in rs.resource_templates.all():
             for field, validator in template.fields.items():
                 if field not in template_fields[key]:
-                    defaults = next((x for x in rs.defaults if x['field'] == field), None)
+                    defaults = rs.defaults.get(field)
                     if defaults is not None:
                         default_val = defaults['default']
                         configurable = defaults['configurable']
@@ -45,6 +79,268 @@ def generate_service_schema(service):
     return schema
 
 
+def query_service_schema_key(pk):
+    """Return the schema cache key of a service, or None if there is no
+    such service.
+
+    The key covers the modified timestamps of the service, its resource
+    services and their templates, read in a single query, so any edit
+    or relation change made by any process changes it.
+    """
+    rows = Service.objects.filter(pk=pk).values_list(
+        'modified',
+        'resource_services',
+        'resource_services__modified',
+        'resource_services__resource_templates',
+        'resource_services__resource_templates__modified',
+    )
+
+    dependencies = set()
+    for modified, rs, rs_modified, template, template_modified in rows:
+        dependencies.add(('service', pk, modified))
+        if rs is not None:
+            dependencies.add(('rs', rs, rs_modified))
+        if template is not None:
+            dependencies.add(('template', template, template_modified))
+
+    if not dependencies:
+        return None
+
+    return "viconf:service_schema:" + content_hash(
+        repr(sorted(repr(dependency) for dependency in dependencies))
+    )
+
+
+def get_cached_service_schema(key):
+    """ Return the cached schema and etag of a schema key, or None """
+    return config_cache().get(key)
+
+
+def cache_service_schema(service, key):
+    """ Generate the schema of a service and store it with its etag """
+    schema = generate_service_schema(service)
+    cached = {
+        'schema': schema,
+        'etag': content_hash(
+            json.dumps(schema, sort_keys=True, cls=DjangoJSONEncoder)
+        ),
+    }
+    config_cache().set(key, cached, timeout=CONFIG_CACHE_TIMEOUT)
+
+    return cached
+
+
+def reconcile_defaults(defaults, fields):
+    """Keep the defaults of the given fields and add a configurable
+    empty default for the fields without one"""
+    fields = list(fields)
+    field_set = set(fields)
+    kept = {
+        field: default for field, default in defaults.items()
+        if field in field_set
+    }
+    for field in fields:
+        if field not in kept:
+            kept[field] = {"configurable": True, "default": None}
+
+    return kept
+
+
+def apply_template_fieldset(template, fieldset):
+    """Set the validators and labels of a template from a list of
+    name, validator and label dicts, in memory only.
+
+    Returns a list of error messages, and leaves the template unchanged
+    if there are any.
+    """
+    vival = ViconfValidators()
+    errors = []
+    for field in fieldset:
+        if field['name'] not in template.fields:
+            errors.append(f"{field['name']} not in template")
+        elif field['validator'] not in vival.VALIDATORS:
+            errors.append(
+                f"{field['name']} has unknown validator {field['validator']}"
+            )
+    if errors:
+        return errors
+
+    for field in fieldset:
+        template.labels[field['name']] = field['label']
+        template.fields[field['name']] = field['validator']
+
+    return []
+
+
+def reconciled_defaults_sql(fields):
+    """reconcile_defaults in PostgreSQL: the stored defaults of the fields
+    over an empty default for each of them"""
+    empty = {field: {"configurable": True, "default": None} for field in fields}
+    return RawSQL(
+        "%s::jsonb || (SELECT COALESCE(jsonb_object_agg(key, value), "
+        "'{}'::jsonb) FROM jsonb_each(defaults) WHERE key = ANY(%s::text[]))",
+        (json.dumps(empty), fields)
+    )
+
+
+def update_template_resource_services(template_id,
+                                      batch_size=BULK_UPDATE_BATCH_SIZE):
+    """Reconcile the defaults of every resource service using a
+    template with the template fields.
+
+    On PostgreSQL a single UPDATE drops and adds the keys in the
+    database, only on the resource services missing a field or holding
+    a field the template lost. Other databases rewrite the changed
+    resource services with bulk_update. Either way modified is set
+    here, as neither runs auto_now, to change the schema and config
+    cache keys. Returns the number of updated resource services.
+    """
+    fields = list(
+        ResourceTemplate.objects.values_list('fields', flat=True).get(
+            pk=template_id
+        ).keys()
+    )
+    related = ResourceService.objects.filter(
+        resource_templates__id=template_id
+    )
+
+    if connections[related.db].vendor == 'postgresql':
+        return related.extra(
+            where=[
+                "NOT (defaults ?& %s::text[]) OR EXISTS (SELECT 1 FROM "
+                "jsonb_object_keys(defaults) AS key "
+                "WHERE NOT key = ANY(%s::text[]))"
+            ],
+            params=[fields, fields]
+        ).update(
+            defaults=reconciled_defaults_sql(fields),
+            modified=timezone.now()
+        )
+
+    with transaction.atomic():
+        now = timezone.now()
+        changed = []
+        for rs in related.only('id', 'defaults').iterator(
+                chunk_size=batch_size):
+            defaults = reconcile_defaults(rs.defaults, fields)
+            if defaults != rs.defaults:
+                rs.defaults = defaults
+                rs.modified = now
+                changed.append(rs)
+
+        ResourceService.objects.bulk_update(
+            changed, ['defaults', 'modified'], batch_size=batch_size
+        )
+
+    return len(changed)
+
+
+def generate_service_validators(service):
+    """ Map node (or __NONODE__) to a dict of field to validator name """
+    validators = {}
+    for rs in service.resource_services.all():
+        if rs.node is not None:
+            key = rs.node.hostname
+        else:
+            key = "__NONODE__"
+
+        node_validators = validators.setdefault(key, {})
+        for template in rs.resource_templates.all():
+            for field, validator in template.fields.items():
+                node_validators.setdefault(field, validator)
+
+    return validators
+
+
+def generate_required_fields(service):
+    """Map node (or __NONODE__) to the set of fields an order must fill:
+    the validated fields with no default, apart from those allocated
+    from a pool or not configurable"""
+    required = {}
+    for rs in service.resource_services.all():
+        if rs.node is not None:
+            key = rs.node.hostname
+        else:
+            key = "__NONODE__"
+
+        node_required = required.setdefault(key, set())
+        for template in rs.resource_templates.all():
+            for field, validator in template.fields.items():
+                default = rs.defaults.get(field, {})
+                if (validator != 'none' and
+                        default.get('default') in (None, '') and
+                        default.get('configurable', True) and
+                        not default.get('allocate')):
+                    node_required.add(field)
+
+    return required
+
+
+def generate_schema_validators(schema):
+    """ Map node (or __NONODE__) to a dict of field to validator name for
+    the configurable fields of a service schema """
+    return {
+        key: {field: spec['validator'] for field, spec in fields.items()}
+        for key, fields in schema['template_fields'].items()
+    }
+
+
+def validate_order_fields(orders, service_validators, service_required=None):
+    """Validate the template fields of a list of order dicts.
+
+    service_validators maps service id to the output of
+    generate_service_validators or generate_schema_validators, and
+    service_required optionally to the output of
+    generate_required_fields. Orders are grouped by service and node so
+    that each field is validated as a column over all orders in the
+    group. Returns a dict of order index to a list of error messages,
+    for failing orders only.
+    """
+    if service_required is None:
+        service_required = {}
+
+    report = {}
+    groups = {}
+    for index, order in enumerate(orders):
+        validators = service_validators.get(order.get('service'))
+        if validators is None:
+            report[index] = [f"Unknown service {order.get('service')}"]
+            continue
+        template_fields = dict(order.get('template_fields') or {})
+        # Nodes of the service the order leaves out have all fields missing
+        for key in service_required.get(order['service'], {}):
+            if key != "__NONODE__":
+                template_fields.setdefault(key, {})
+        first = next(iter(template_fields), None)
+        for node, values in template_fields.items():
+            if node in validators:
+                key = node
+            elif "__NONODE__" in validators:
+                key = "__NONODE__"
+            else:
+                report.setdefault(index, []).append(f"Unknown node {node}")
+                continue
+            # Resource services without a node render on the first node,
+            # so only that one has to fill their fields
+            checked = key != "__NONODE__" or node == first
+            group = groups.setdefault(
+                (order['service'], key, checked), ([], [])
+            )
+            group[0].append(index)
+            group[1].append(values)
+
+    vival = ViconfValidators()
+    for (service, key, checked), (indexes, rows) in groups.items():
+        fields = service_validators[service][key]
+        required = ()
+        if checked:
+            required = service_required.get(service, {}).get(key, ())
+        for row, errors in vival.validate_rows(fields, rows, required).items():
+            report.setdefault(indexes[row], []).extend(errors.values())
+
+    return dict(sorted(report.items()))
+
+
 def generate_quicktemplate_schema(template):
     """ Generate a schema for a template """
     template_fields = {}
@@ -56,8 +352,7 @@ def generate_quicktemplate_schema(template):
         }
 
     # Find additional built-in tags
-    vtemplate = ViconfMustache(template.up_contents)
-    for tag in vtemplate.parse_template_tags()['all_tags']:
+    for tag in template.get_tags()['up']['all_tags']:
         if tag not in template_fields:
             template_fields[tag] = {
                 'label': tag.capitalize(),
@@ -65,3 +360,432 @@ def generate_quicktemplate_schema(template):
             }
 
     return template_fields
+
+
+def prefetch_services(queryset):
+    """ Load services with their resource services, nodes and templates """
+    return queryset.prefetch_related(
+        'resource_services__node',
+        'resource_services__resource_templates',
+    )
+
+
+def prefetch_service_orders(queryset):
+    """ Load everything needed to render the orders in a fixed number of
+    queries """
+    return queryset.select_related('service').prefetch_related(
+        'service__resource_services__node',
+        'service__resource_services__resource_templates',
+    )
+
+
+def filter_orders_by_node(queryset, hostname):
+    """ Limit a ServiceOrder queryset to orders that touch a node """
+    return queryset.filter(
+        Q(service__resource_services__node=hostname) |
+        Q(template_fields__has_key=hostname)
+    ).distinct()
+
+
+def any_node_condition(vendor, column, field, values):
+    """Return the SQL and params matching rows whose template fields set
+    field to one of values on any node.
+
+    PostgreSQL tests a jsonpath with @?, answered by the GIN index on
+    template_fields. SQLite walks the nodes with json_each.
+    """
+    if vendor == 'postgresql':
+        path = "$.* ? ({})".format(" || ".join(
+            f"@.{json.dumps(field)} == {json.dumps(candidate)}"
+            for candidate in values
+        ))
+        return f"{column} @? %s::jsonpath", [path]
+
+    placeholders = ", ".join(["%s"] * len(values))
+    return (
+        f"EXISTS (SELECT 1 FROM json_each({column}) AS node "
+        f"WHERE json_extract(node.value, %s) IN ({placeholders}))",
+        [f"$.{json.dumps(field)}"] + values
+    )
+
+
+def search_orders(queryset, node=None, field=None, value=None):
+    """Limit a ServiceOrder queryset to orders with a node in their
+    template fields, or with a field set to a value, on the given node
+    or any node.
+
+    On PostgreSQL the lookups are JSONB key, containment and jsonpath
+    tests answered by the GIN index on template_fields. Other databases
+    compare the values at the key paths.
+    """
+    if field is None:
+        return queryset.filter(template_fields__has_key=node)
+
+    values = [value]
+    if value.isdigit():
+        # Numbers may have been stored as JSON numbers
+        values.append(int(value))
+
+    connection = connections[queryset.db]
+    if node is None:
+        column = "{}.{}".format(
+            connection.ops.quote_name(queryset.model._meta.db_table),
+            connection.ops.quote_name('template_fields')
+        )
+        sql, params = any_node_condition(
+            connection.vendor, column, field, values
+        )
+        return queryset.extra(where=[sql], params=params)
+
+    query = Q()
+    for candidate in values:
+        if connection.vendor == 'postgresql':
+            query |= Q(template_fields__contains={node: {field: candidate}})
+        else:
+            query |= Q(**{f"template_fields__{node}__{field}": candidate})
+
+    return queryset.filter(query)
+
+
+def fetch_order_nodes(service_orders):
+    """Fetch the nodes used by resource services without a node, which
+    render on the first node in the order template fields"""
+    hostnames = set()
+    for service_order in service_orders:
+        if service_order.service is None or not service_order.template_fields:
+            continue
+        for rs in service_order.service.resource_services.all():
+            if rs.node_id is None:
+                hostnames.add(list(service_order.template_fields.keys())[0])
+                break
+
+    if not hostnames:
+        return {}
+
+    return Node.objects.in_bulk(list(hostnames))
+
+
+def generate_service_config(service_order, nodes=None, templates=None):
+    """Render the up and down configuration of a service order
+
+    nodes is an optional dict of hostname to Node for resource
+    services without a node, and templates is an optional dict used to
+    share merged templates between orders of the same service.
+
+    Services with more resource services than the parallel render
+    threshold are rendered in the render process pool, which merges,
+    validates and renders the templates of each node.
+
+    Raises ViconfValidationError if a field does not validate.
+    """
+    service = service_order.service
+    service_params = {
+        "reference": service_order.reference,
+        "customer": service_order.customer,
+        "location": service_order.location,
+        "service": service.name
+    }
+    if templates is None:
+        templates = {}
+
+    jobs = []
+    for rs in service.resource_services.all():
+        defaults = {
+            field: default['default'] for field, default in rs.defaults.items()
+        }
+        if rs.node is None:
+            # The rs doesn't enforce node, so we pick the first node
+            hostname = list(service_order.template_fields.keys())[0]
+            if nodes is None:
+                nodeobj = Node.objects.get(hostname=hostname)
+            else:
+                nodeobj = nodes[hostname]
+            node = nodeobj.hostname
+        else:
+            nodeobj = rs.node
+            node = rs.node.hostname
+
+        params = {}
+        for template in rs.resource_templates.all():
+            for field in template.fields.keys():
+                if field not in params:
+                    params[field] = service_order.template_fields[node].get(
+                        field, defaults.get(field)
+                    )
+
+        params["node"] = node
+        params["node_ipv4"] = nodeobj.ipv4
+        params["node_ipv6"] = nodeobj.ipv6
+
+        jobs.append((node, rs, params))
+
+    executor = None
+    if len(jobs) > max(1, parallel_render_threshold()):
+        executor = render_process_executor()
+
+    rendered = None
+    if executor is not None:
+        try:
+            with timed('render'):
+                rendered = render_jobs_in_pool(executor, jobs, service_params)
+        except BrokenProcessPool:
+            reset_render_process_executor()
+
+    if rendered is None:
+        rendered = []
+        for _, rs, params in jobs:
+            rs_templates = rs.resource_templates.all()
+            if rs.id not in templates:
+                templates[rs.id] = (
+                    ViconfMustache([t.up_contents for t in rs_templates]),
+                    ViconfMustache([t.down_contents for t in rs_templates]),
+                )
+            rendered.append(render_node(
+                *templates[rs.id],
+                [t.fields for t in rs_templates],
+                params,
+                service_params
+            ))
+
+    # A later resource service on the same node replaces the config
+    config = {}
+    for (node, _, _), (service_up, service_down) in zip(jobs, rendered):
+        config[node] = {
+            "node": node,
+            "service_up": service_up,
+            "service_down": service_down,
+        }
+
+    return list(config.values())
+
+
+def template_key(template):
+    """ The key a template is sent to the render workers by """
+    return template.content_hash or content_hash(
+        template.up_contents + "\0" + template.down_contents
+    )
+
+
+def render_jobs_in_pool(executor, jobs, service_params):
+    """Render (node, resource service, params) jobs in a process pool,
+    in one chunk per worker.
+
+    Each chunk carries the texts of its templates, as the pool may run
+    it on any worker, and workers keep the templates they merged by key.
+    """
+    texts = {}
+    specs = []
+    for _, rs, params in jobs:
+        keys = []
+        for template in rs.resource_templates.all():
+            key = template_key(template)
+            texts[key] = (template.up_contents, template.down_contents)
+            keys.append(key)
+        specs.append((
+            tuple(keys),
+            [template.fields for template in rs.resource_templates.all()],
+            params,
+        ))
+
+    workers = render_processes()
+    chunks = [
+        list(range(offset, len(specs), workers))
+        for offset in range(min(workers, len(specs)))
+    ]
+    futures = []
+    for chunk in chunks:
+        chunk_specs = [specs[index] for index in chunk]
+        futures.append((chunk, executor.submit(
+            render_node_jobs,
+            chunk_specs,
+            service_params,
+            {key: texts[key] for keys, _, _ in chunk_specs for key in keys}
+        )))
+
+    rendered = [None] * len(jobs)
+    for chunk, future in futures:
+        for index, result in zip(chunk, future.result()):
+            rendered[index] = result
+
+    return rendered
+
+
+def config_cache():
+    """The cache for rendered configs and service schemas, chosen by
+    VICONF_CONFIG_CACHE"""
+    return caches[getattr(settings, 'VICONF_CONFIG_CACHE', 'default')]
+
+
+def config_cache_key(dependencies):
+    """ The cache key of a config rendered from the given dependencies """
+    return "viconf:config:" + content_hash(
+        repr(sorted(repr(dependency) for dependency in dependencies))
+    )
+
+
+def service_order_config_key(service_order, nodes):
+    """Return the config cache key of a prefetched service order, or
+    None if it can't be rendered.
+
+    The key covers the modified timestamps of the order, its service,
+    resource services and nodes and the content hashes and modified
+    timestamps of the templates, so any edit changes it.
+    """
+    service = service_order.service
+    if service is None:
+        return None
+
+    dependencies = {
+        ('order', service_order.pk, service_order.modified),
+        ('service', service.pk, service.modified),
+    }
+    for rs in service.resource_services.all():
+        dependencies.add(('rs', rs.pk, rs.modified))
+        if rs.node is not None:
+            node = rs.node
+        else:
+            try:
+                node = nodes[list(service_order.template_fields.keys())[0]]
+            except (IndexError, KeyError):
+                return None
+        dependencies.add(('node', node.pk, node.modified))
+        for template in rs.resource_templates.all():
+            dependencies.add((
+                'template',
+                template.pk,
+                template.content_hash,
+                template.modified
+            ))
+
+    return config_cache_key(dependencies)
+
+
+def query_service_order_config_key(pk):
+    """Return the config cache key of a service order like
+    service_order_config_key, with a single query in most cases"""
+    rows = ServiceOrder.objects.filter(pk=pk).values_list(
+        'modified',
+        'template_fields',
+        'service',
+        'service__modified',
+        'service__resource_services',
+        'service__resource_services__modified',
+        'service__resource_services__node',
+        'service__resource_services__node__modified',
+        'service__resource_services__resource_templates',
+        'service__resource_services__resource_templates__content_hash',
+        'service__resource_services__resource_templates__modified',
+    )
+
+    dependencies = set()
+    nodeless = False
+    template_fields = None
+    for (modified, template_fields, service, service_modified, rs,
+         rs_modified, node, node_modified, template, template_hash,
+         template_modified) in rows:
+        if service is None:
+            return None
+        dependencies.add(('order', pk, modified))
+        dependencies.add(('service', service, service_modified))
+        if rs is None:
+            continue
+        dependencies.add(('rs', rs, rs_modified))
+        if node is None:
+            nodeless = True
+        else:
+            dependencies.add(('node', node, node_modified))
+        if template is not None:
+            dependencies.add(
+                ('template', template, template_hash, template_modified)
+            )
+
+    if not dependencies:
+        return None
+
+    if nodeless:
+        if not template_fields:
+            return None
+        hostname = list(template_fields.keys())[0]
+        node_modified = Node.objects.filter(pk=hostname).values_list(
+            'modified', flat=True
+        ).first()
+        if node_modified is None:
+            return None
+        dependencies.add(('node', hostname, node_modified))
+
+    return config_cache_key(dependencies)
+
+
+def cached_service_config(service_order, nodes=None, templates=None,
+                          rendered=None):
+    """generate_service_config through the config cache.
+
+    A config is only cached once its snapshot is recorded. On a miss
+    that happens right away, or when rendered is a list, the order,
+    config and key are appended to it for store_rendered_configs.
+    """
+    key = service_order_config_key(service_order, nodes or {})
+    if key is not None:
+        config = config_cache().get(key)
+        if config is not None:
+            return config
+
+    config = generate_service_config(
+        service_order,
+        nodes=nodes,
+        templates=templates
+    )
+    if rendered is not None:
+        rendered.append((service_order, config, key))
+    else:
+        store_rendered_configs([(service_order, config, key)])
+
+    return config
+
+
+def store_rendered_configs(rendered):
+    """ Record snapshots of (order, config, key) and then cache them """
+    record_snapshots((order, config) for order, config, _ in rendered)
+    config_cache().set_many(
+        {key: config for _, config, key in rendered if key is not None},
+        timeout=CONFIG_CACHE_TIMEOUT
+    )
+
+
+def render_service_orders(service_orders, templates=None):
+    """Render a list of prefetched service orders, yielding a dict with
+    either the config or the error for each order.
+
+    The configs rendered are recorded as snapshots and cached once all
+    orders are done. A consumer that stops early, like a disconnected
+    stream, leaves them uncached, so they are rendered and recorded by
+    the next request.
+    """
+    nodes = fetch_order_nodes(service_orders)
+    if templates is None:
+        templates = {}
+    rendered = []
+
+    for service_order in service_orders:
+        result = {
+            "id": service_order.id,
+            "reference": service_order.reference,
+        }
+        if service_order.service is None:
+            result["error"] = "Service order has no service"
+            yield result
+            continue
+        try:
+            result["config"] = cached_service_config(
+                service_order,
+                nodes=nodes,
+                templates=templates,
+                rendered=rendered
+            )
+        except (ViconfValidationError, ViconfMustacheTagException) as e:
+            result["error"] = str(e)
+        except KeyError as e:
+            result["error"] = f"Unknown node {e}"
+        yield result
+
+    store_rendered_configs(rendered)
@@ -0,0 +1,80 @@
+"""Background jobs for slow bulk operations
+
+Jobs run in a thread pool of the web process once the submitting
+transaction commits, and their status is kept in the Django cache, so
+use a cache shared between processes when running several workers.
+Setting VICONF_JOBS_EAGER runs jobs at once in the submitting thread.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils import timezone
+
+from configuration.constants import JOB_STATUS_TIMEOUT
+from configuration.workers import job_executor
+
+
+def job_key(job_id):
+    return f"viconf:job:{job_id}"
+
+
+def get_job(job_id):
+    """ Return the status of a job, or None if it is unknown """
+    return cache.get(job_key(job_id))
+
+
+def save_job(job):
+    cache.set(job_key(job['id']), job, timeout=JOB_STATUS_TIMEOUT)
+
+
+def run_job(job, func, args):
+    job['status'] = 'running'
+    job['started'] = timezone.now().isoformat()
+    save_job(job)
+    try:
+        job['result'] = func(*args)
+        job['status'] = 'done'
+    except Exception as e:
+        job['error'] = str(e)
+        job['status'] = 'failed'
+    finally:
+        job['finished'] = timezone.now().isoformat()
+        save_job(job)
+
+
+def run_job_in_thread(job, func, args):
+    try:
+        run_job(job, func, args)
+    finally:
+        # Connections are per thread, close the ones this job opened
+        connections.close_all()
+
+
+def submit_job(kind, func, *args):
+    """Run func(*args) in the background after the current transaction
+    commits, returning the job status"""
+    job = {
+        'id': uuid.uuid4().hex,
+        'kind': kind,
+        'status': 'pending',
+        'created': timezone.now().isoformat(),
+        'started': None,
+        'finished': None,
+        'result': None,
+        'error': None,
+    }
+    save_job(job)
+
+    if getattr(settings, 'VICONF_JOBS_EAGER', False):
+        run_job(job, func, args)
+    else:
+        transaction.on_commit(
+            lambda: job_executor().submit(
+                run_job_in_thread, dict(job), func, args
+            )
+        )
+
+    return job
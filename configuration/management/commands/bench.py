@@ -0,0 +1,61 @@
+""" Run the benchmark suite against a throwaway test database """
+
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (
+    setup_test_environment,
+    teardown_test_environment,
+)
+from configuration.benchmarks import QUICK_SIZES, SIZES, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Benchmark template rendering, validation, schema generation "
+            "and the config view")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--quick',
+            action='store_true',
+            help="Only run the smaller sizes"
+        )
+        parser.add_argument(
+            '--output',
+            help="Write the results as JSON to this file"
+        )
+
+    def handle(self, *args, **options):
+        sizes = QUICK_SIZES if options['quick'] else SIZES
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmarks(sizes, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+        for result in results:
+            params = " ".join(
+                f"{key}={value}" for key, value in result['params'].items()
+            )
+            self.stdout.write(
+                f"{result['name']:<24} {params:<32} "
+                f"p50 {result['p50_ms']:9.3f} ms  "
+                f"p95 {result['p95_ms']:9.3f} ms  "
+                f"{result['throughput_per_s']:10.1f}/s  "
+                f"queries {result['queries']}"
+            )
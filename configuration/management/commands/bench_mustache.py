@@ -0,0 +1,67 @@
+""" Compare the native mustache renderer with pystache """
+
+import timeit
+
+from django.core.management.base import BaseCommand
+from configuration.mustache import CompiledTemplate
+
+
+def synthetic_template(lines):
+    """ A template resembling an interface config, of about lines lines """
+    block = (
+        "interface {{ interface }}.{{ unit }}\n"
+        " description {{ customer }} {{ reference }}\n"
+        "{{#vlan}}\n"
+        " encapsulation dot1q {{ vlan }}\n"
+        "{{/vlan}}\n"
+        "{{^vlan}}\n"
+        " encapsulation untagged\n"
+        "{{/vlan}}\n"
+        " {{! address family }}\n"
+        " ipv4 address {{ ipv4 }}\n"
+    )
+    return block * max(1, lines // 6)
+
+
+SYNTHETIC_PARAMS = {
+    'interface': 'Bundle-Ether10',
+    'unit': '310',
+    'customer': 'ACME <Corp>',
+    'reference': 'REF-1',
+    'vlan': '310',
+    'ipv4': '10.0.0.1/30',
+}
+
+
+class Command(BaseCommand):
+    help = "Time template rendering with the native renderer and pystache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=500)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        template = synthetic_template(options['lines'])
+        params = SYNTHETIC_PARAMS
+        repeat = options['repeat']
+
+        compiled = CompiledTemplate(template)
+        native = timeit.timeit(
+            lambda: compiled.render(params), number=repeat
+        ) / repeat
+        self.stdout.write(f"native render: {native * 1000:.3f} ms")
+
+        try:
+            import pystache
+        except ImportError:
+            self.stdout.write("pystache is not installed, skipping comparison")
+            return
+
+        if pystache.render(template, params) != compiled.render(params):
+            self.stderr.write("Output differs from pystache")
+
+        reference = timeit.timeit(
+            lambda: pystache.render(template, params), number=repeat
+        ) / repeat
+        self.stdout.write(f"pystache render: {reference * 1000:.3f} ms")
+        self.stdout.write(f"speedup: {reference / native:.1f}x")
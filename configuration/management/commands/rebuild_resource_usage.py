@@ -0,0 +1,53 @@
+""" Rebuild the per node resource usage used for conflict detection """
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from configuration.conflicts import service_order_usages
+from configuration.helpers import (
+    generate_service_validators,
+    prefetch_service_orders,
+)
+from configuration.models import ResourceUsage, ServiceOrder
+
+
+class Command(BaseCommand):
+    help = "Rebuild the resource usage of every live service order"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        validators = {}
+        pks = list(
+            ServiceOrder.objects.filter(deleted=False).order_by(
+                'pk'
+            ).values_list('pk', flat=True)
+        )
+
+        with transaction.atomic():
+            ResourceUsage.objects.all().delete()
+            # iterator() would skip the prefetching, so fetch in chunks
+            for offset in range(0, len(pks), batch_size):
+                orders = prefetch_service_orders(
+                    ServiceOrder.objects.filter(
+                        pk__in=pks[offset:offset + batch_size]
+                    )
+                )
+                usages = []
+                for order in orders:
+                    if order.service is None:
+                        continue
+                    if order.service_id not in validators:
+                        validators[order.service_id] = (
+                            generate_service_validators(order.service)
+                        )
+                    usages.extend(service_order_usages(
+                        order, validators[order.service_id]
+                    ))
+                ResourceUsage.objects.bulk_create(usages)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{ResourceUsage.objects.count()} resource usages"
+        ))
@@ -0,0 +1,89 @@
+""" Validate the template fields of service orders before importing them """
+
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from configuration.helpers import (
+    generate_required_fields,
+    generate_service_validators,
+    prefetch_services,
+    validate_order_fields,
+)
+from configuration.models import Service
+
+
+def load_orders(stream):
+    """Read a JSON array of orders, or one JSON order per line. A file
+    holding a single JSON object is one order."""
+    content = stream.read()
+    try:
+        orders = json.loads(content)
+    except ValueError:
+        try:
+            orders = [json.loads(line) for line in content.splitlines()
+                      if line.strip()]
+        except ValueError as e:
+            raise CommandError(f"Invalid JSON: {e}")
+    if isinstance(orders, dict):
+        orders = [orders]
+    if not isinstance(orders, list) or not all(
+            isinstance(order, dict) for order in orders):
+        raise CommandError("Expected a list of orders")
+
+    return orders
+
+
+class Command(BaseCommand):
+    help = "Validate a JSON or NDJSON file of service orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File with orders, - for stdin")
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help="Write the report as JSON"
+        )
+
+    def handle(self, *args, **options):
+        if options['path'] == '-':
+            orders = load_orders(sys.stdin)
+        else:
+            with open(options['path']) as stream:
+                orders = load_orders(stream)
+
+        service_ids = {order.get('service') for order in orders}
+        services = prefetch_services(
+            Service.objects.filter(pk__in=service_ids)
+        ).in_bulk()
+        report = validate_order_fields(
+            orders,
+            {
+                pk: generate_service_validators(service)
+                for pk, service in services.items()
+            },
+            {
+                pk: generate_required_fields(service)
+                for pk, service in services.items()
+            }
+        )
+
+        if options['json']:
+            self.stdout.write(json.dumps([
+                {
+                    "row": index,
+                    "reference": orders[index].get('reference'),
+                    "errors": errors,
+                }
+                for index, errors in report.items()
+            ]))
+        else:
+            for index, errors in report.items():
+                reference = orders[index].get('reference')
+                self.stdout.write(f"{index} {reference}: {', '.join(errors)}")
+
+        if report:
+            raise CommandError(
+                f"{len(report)} of {len(orders)} orders failed validation"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{len(orders)} orders valid"))
@@ -0,0 +1,164 @@
+"""Per request timing of the database, template and validation phases
+
+Code under measurement wraps itself in timed(phase). While a request
+is handled by ServerTimingMiddleware the durations are collected per
+request, sent back in a Server-Timing header and added to the process
+wide counters served in Prometheus text format at /metrics. Outside a
+request timed() does nothing but read the clock.
+"""
+
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.db import connections
+
+request_timings = ContextVar('request_timings', default=None)
+
+
+def record(phase, seconds, count=1):
+    """ Add a duration to the timings of the current request, if any """
+    timings = request_timings.get()
+    if timings is None:
+        return
+    entry = timings.get(phase)
+    if entry is None:
+        timings[phase] = [count, seconds]
+    else:
+        entry[0] += count
+        entry[1] += seconds
+
+
+@contextmanager
+def timed(phase):
+    """Time the enclosed block as the given phase, usable as a
+    decorator as well"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - start)
+
+
+def time_queries(execute, sql, params, many, context):
+    """ A connection execute wrapper timing every query """
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', time.perf_counter() - start)
+
+
+@contextmanager
+def timed_queries():
+    """Time the queries on every database connection of the current
+    thread within the enclosed block"""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(time_queries))
+        yield
+
+
+def server_timing(timings, total):
+    """ Format request timings as a Server-Timing header value """
+    entries = []
+    for phase, (count, seconds) in timings.items():
+        entry = f"{phase};dur={seconds * 1000:.3f}"
+        if phase == 'db':
+            entry += f';desc="{count} queries"'
+        entries.append(entry)
+    entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+
+class ViconfMetrics(object):
+    """ Process wide request and phase counters """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.phases = {}
+
+    def observe(self, view, method, status, total, timings):
+        with self._lock:
+            key = (view, method, str(status))
+            entry = self.requests.setdefault(key, [0, 0.0])
+            entry[0] += 1
+            entry[1] += total
+            for phase, (count, seconds) in timings.items():
+                entry = self.phases.setdefault((view, phase), [0, 0.0])
+                entry[0] += count
+                entry[1] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return (
+                {key: list(value) for key, value in self.requests.items()},
+                {key: list(value) for key, value in self.phases.items()},
+            )
+
+    def clear(self):
+        with self._lock:
+            self.requests.clear()
+            self.phases.clear()
+
+
+metrics = ViconfMetrics()
+
+
+def _labels(**labels):
+    escaped = (
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def render_prometheus(cache_stats):
+    """Render the counters and the template cache statistics in the
+    Prometheus text exposition format"""
+    requests, phases = metrics.snapshot()
+    lines = [
+        "# HELP viconf_requests_total Requests handled",
+        "# TYPE viconf_requests_total counter",
+    ]
+    for (view, method, status), (count, _) in sorted(requests.items()):
+        labels = _labels(view=view, method=method, status=status)
+        lines.append(f"viconf_requests_total{labels} {count}")
+
+    lines += [
+        "# HELP viconf_request_duration_seconds Time spent handling requests",
+        "# TYPE viconf_request_duration_seconds summary",
+    ]
+    for (view, method, status), (count, seconds) in sorted(requests.items()):
+        labels = _labels(view=view, method=method, status=status)
+        lines.append(f"viconf_request_duration_seconds_sum{labels} {seconds}")
+        lines.append(f"viconf_request_duration_seconds_count{labels} {count}")
+
+    lines += [
+        "# HELP viconf_phase_duration_seconds Time spent per phase, "
+        "count is the number of queries, parses, renders or validations",
+        "# TYPE viconf_phase_duration_seconds summary",
+    ]
+    for (view, phase), (count, seconds) in sorted(phases.items()):
+        labels = _labels(view=view, phase=phase)
+        lines.append(f"viconf_phase_duration_seconds_sum{labels} {seconds}")
+        lines.append(f"viconf_phase_duration_seconds_count{labels} {count}")
+
+    for name in ('hits', 'misses', 'evictions'):
+        lines += [
+            f"# HELP viconf_template_cache_{name}_total Template cache {name}",
+            f"# TYPE viconf_template_cache_{name}_total counter",
+            f"viconf_template_cache_{name}_total {cache_stats[name]}",
+        ]
+    lines += [
+        "# HELP viconf_template_cache_size Compiled templates in the cache",
+        "# TYPE viconf_template_cache_size gauge",
+        f"viconf_template_cache_size {cache_stats['size']}",
+    ]
+
+    return "\n".join(lines) + "\n"
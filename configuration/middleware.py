@@ -0,0 +1,68 @@
+""" Middleware timing requests for the Server-Timing header and /metrics """
+
+import asyncio
+import time
+
+from configuration.metrics import (
+    metrics,
+    request_timings,
+    server_timing,
+    timed_queries,
+)
+
+
+class ServerTimingMiddleware(object):
+    """Collect query, template and validation timings per request,
+    report them in a Server-Timing header and add them to the
+    metrics"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Mark the middleware as async so Django does not run async
+            # views in a thread of their own
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        timings = {}
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            with timed_queries():
+                response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+
+        return self.finish(request, response, timings, start)
+
+    async def __acall__(self, request):
+        # Async views time their queries where they run, in the thread
+        # holding the database connection
+        timings = {}
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+
+        return self.finish(request, response, timings, start)
+
+    def finish(self, request, response, timings, start):
+        total = time.perf_counter() - start
+        response['Server-Timing'] = server_timing(timings, total)
+        match = request.resolver_match
+        metrics.observe(
+            match.view_name if match else 'unresolved',
+            request.method,
+            response.status_code,
+            total,
+            timings
+        )
+
+        return response
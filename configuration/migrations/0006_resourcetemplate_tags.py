@@ -0,0 +1,117 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:04
+
+import hashlib
+import re
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+# The tag parsing below is frozen here, so later changes to the renderer
+# don't change what this migration stores.
+FORM_TAGS = [
+    'customer',
+    'location',
+    'reference',
+    'node_ipv4',
+    'node_ipv6'
+]
+
+LIST_TAG_RE = re.compile(r'\{\{\s*#([^}]+\s*)\}\}')
+
+TAG_TEMPLATE = r"""
+    %(otag)s \s*
+    (?:
+      (?P<change>=) \s* (?P<delims>.+?)   \s* = |
+      (?P<raw>{)    \s* (?P<raw_name>.+?) \s* } |
+      (?P<tag>[!>&/#^]?)  \s* (?P<tag_key>[\s\S]+?)
+    )
+    \s* %(ctag)s
+"""
+
+
+def tag_re(delimiters):
+    return re.compile(TAG_TEMPLATE % {
+        'otag': re.escape(delimiters[0]),
+        'ctag': re.escape(delimiters[1]),
+    }, re.VERBOSE)
+
+
+def template_keys(template):
+    """The variable and section keys outside of any section. Unclosed
+    sections run to the end and stray end tags are skipped."""
+    keys = set()
+    sections = []
+    pattern = tag_re(('{{', '}}'))
+    position = 0
+    while True:
+        match = pattern.search(template, position)
+        if match is None:
+            return keys
+        position = match.end()
+
+        if match.group('change') is not None:
+            pattern = tag_re(tuple(match.group('delims').split()))
+            continue
+        if match.group('raw') is not None:
+            tag_type, tag_key = '&', match.group('raw_name')
+        else:
+            tag_type, tag_key = match.group('tag'), match.group('tag_key')
+
+        if tag_type in ('#', '^'):
+            if not sections:
+                keys.add(tag_key)
+            sections.append(tag_key)
+        elif tag_type == '/':
+            if tag_key in sections:
+                del sections[len(sections) - 1 - sections[::-1].index(tag_key):]
+        elif tag_type in ('', '&') and not sections:
+            keys.add(tag_key)
+
+
+def template_tags(up_contents, down_contents):
+    tags = {}
+    for direction, contents in (('up', up_contents),
+                                ('down', down_contents)):
+        keys = template_keys(contents)
+        tags[direction] = {
+            'all_tags': sorted(keys),
+            'user_tags': sorted(keys - set(FORM_TAGS)),
+            'form_tags': sorted(keys & set(FORM_TAGS)),
+            'list_tags': LIST_TAG_RE.findall(contents),
+        }
+
+    return tags
+
+
+def parse_tags(apps, schema_editor):
+    ResourceTemplate = apps.get_model('configuration', 'ResourceTemplate')
+    for template in ResourceTemplate.objects.all():
+        template.tags = template_tags(
+            template.up_contents,
+            template.down_contents
+        )
+        template.content_hash = hashlib.sha256((
+            template.up_contents + "\0" + template.down_contents
+        ).encode('utf-8')).hexdigest()
+        template.save(update_fields=['tags', 'content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuration', '0005_remove_serviceorder_speed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='resourcetemplate',
+            name='content_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='resourcetemplate',
+            name='tags',
+            field=django.contrib.postgres.fields.jsonb.JSONField(null=True),
+        ),
+        migrations.RunPython(parse_tags, migrations.RunPython.noop),
+    ]
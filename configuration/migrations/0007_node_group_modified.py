@@ -0,0 +1,26 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuration', '0006_resourcetemplate_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:20
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class AddIndexConcurrentlyOnPostgres(AddIndexConcurrently):
+    """Build the index without blocking writes to the table. GIN
+    indexes only exist on PostgreSQL, so other databases skip it."""
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('configuration', '0007_node_group_modified'),
+    ]
+
+    operations = [
+        AddIndexConcurrentlyOnPostgres(
+            model_name='serviceorder',
+            index=django.contrib.postgres.indexes.GinIndex(condition=models.Q(deleted=False), fields=['template_fields'], name='serviceorder_fields_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(condition=models.Q(deleted=False), fields=['service', 'id'], name='serviceorder_live_service_idx'),
+        ),
+    ]
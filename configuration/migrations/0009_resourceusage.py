@@ -0,0 +1,31 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuration', '0008_serviceorder_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node', models.CharField(max_length=255)),
+                ('kind', models.CharField(max_length=16)),
+                ('field', models.CharField(max_length=255)),
+                ('value', models.CharField(max_length=255)),
+                ('start', models.BigIntegerField()),
+                ('end', models.BigIntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resource_usages', to='configuration.serviceorder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='resourceusage',
+            index=models.Index(fields=['node', 'kind', 'start'], name='resourceusage_lookup_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuration', '0009_resourceusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourcePool',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('validator', models.CharField(choices=[('vlan', 'VLAN'), ('bundle', 'Bundle'), ('asn', 'AS number'), ('cidrv4', 'IPv4 prefix'), ('cidrv6', 'IPv6 prefix')], max_length=16)),
+                ('site', models.CharField(blank=True, max_length=255, null=True)),
+                ('first', models.BigIntegerField(blank=True, null=True)),
+                ('last', models.BigIntegerField(blank=True, null=True)),
+                ('prefix', models.CharField(blank=True, max_length=64, null=True)),
+                ('prefix_length', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('bitmap', models.BinaryField(default=bytes)),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('node', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='configuration.node')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ResourceAllocation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('node', models.CharField(max_length=255)),
+                ('field', models.CharField(max_length=255)),
+                ('unit', models.BigIntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='configuration.serviceorder')),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='configuration.resourcepool')),
+            ],
+        ),
+    ]
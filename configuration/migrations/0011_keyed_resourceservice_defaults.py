@@ -0,0 +1,44 @@
+from django.db import migrations
+
+
+def key_defaults(apps, schema_editor):
+    """ Store the defaults of every resource service keyed by field """
+    ResourceService = apps.get_model('configuration', 'ResourceService')
+    changed = []
+    for rs in ResourceService.objects.only('id', 'defaults').iterator():
+        if isinstance(rs.defaults, dict):
+            continue
+        rs.defaults = {
+            default['field']: {
+                key: value for key, value in default.items()
+                if key != 'field'
+            }
+            for default in rs.defaults or []
+        }
+        changed.append(rs)
+    ResourceService.objects.bulk_update(changed, ['defaults'], batch_size=500)
+
+
+def list_defaults(apps, schema_editor):
+    """ Store the defaults of every resource service as a list again """
+    ResourceService = apps.get_model('configuration', 'ResourceService')
+    changed = []
+    for rs in ResourceService.objects.only('id', 'defaults').iterator():
+        if not isinstance(rs.defaults, dict):
+            continue
+        rs.defaults = [
+            {'field': field, **value} for field, value in rs.defaults.items()
+        ]
+        changed.append(rs)
+    ResourceService.objects.bulk_update(changed, ['defaults'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuration', '0010_resource_pools'),
+    ]
+
+    operations = [
+        migrations.RunPython(key_defaults, list_defaults),
+    ]
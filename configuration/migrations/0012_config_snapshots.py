@@ -0,0 +1,38 @@
+# Generated by Django 3.1.13 on 2026-10-18 10:29
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuration', '0011_keyed_resourceservice_defaults'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ConfigSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.CharField(max_length=255)),
+                ('digest', models.CharField(max_length=64)),
+                ('entries', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='snapshots', to='configuration.serviceorder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='configsnapshot',
+            index=models.Index(fields=['order', '-id'], name='configsnapshot_order_idx'),
+        ),
+    ]
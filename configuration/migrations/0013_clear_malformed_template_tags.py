@@ -0,0 +1,73 @@
+# Generated by Django 3.1.13 on 2026-10-18 11:02
+
+import re
+
+from django.db import migrations
+
+# Frozen copy of the section checks of the in-project renderer, which
+# refuses unclosed sections and mismatched end tags
+TAG_TEMPLATE = r"""
+    %(otag)s \s*
+    (?:
+      (?P<change>=) \s* (?P<delims>.+?)   \s* = |
+      (?P<raw>{)    \s* (?P<raw_name>.+?) \s* } |
+      (?P<tag>[!>&/#^]?)  \s* (?P<tag_key>[\s\S]+?)
+    )
+    \s* %(ctag)s
+"""
+
+
+def tag_re(delimiters):
+    return re.compile(TAG_TEMPLATE % {
+        'otag': re.escape(delimiters[0]),
+        'ctag': re.escape(delimiters[1]),
+    }, re.VERBOSE)
+
+
+def sections_balance(template):
+    sections = []
+    pattern = tag_re(('{{', '}}'))
+    position = 0
+    while True:
+        match = pattern.search(template, position)
+        if match is None:
+            return not sections
+        position = match.end()
+
+        if match.group('change') is not None:
+            pattern = tag_re(tuple(match.group('delims').split()))
+        elif match.group('tag') in ('#', '^'):
+            sections.append(match.group('tag_key'))
+        elif match.group('tag') == '/':
+            if not sections or sections.pop() != match.group('tag_key'):
+                return False
+
+
+def clear_malformed_tags(apps, schema_editor):
+    """Templates stored before sections were checked may not parse. Clear
+    their tags, so they are parsed again on first read and reported as
+    template errors rather than served with the tags 0006 guessed."""
+    ResourceTemplate = apps.get_model('configuration', 'ResourceTemplate')
+    malformed = [
+        template.pk
+        for template in ResourceTemplate.objects.only(
+            'up_contents', 'down_contents'
+        )
+        if not (sections_balance(template.up_contents) and
+                sections_balance(template.down_contents))
+    ]
+    ResourceTemplate.objects.filter(pk__in=malformed).update(
+        tags=None,
+        content_hash=None
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuration', '0012_config_snapshots'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_malformed_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.1.13 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuration', '0013_clear_malformed_template_tags'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='group',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='node',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='resourceservice',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='resourcetemplate',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='service',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='serviceorder',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
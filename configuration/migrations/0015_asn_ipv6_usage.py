@@ -0,0 +1,83 @@
+# Generated by Django 3.1.13 on 2026-10-18 11:40
+
+import ipaddress
+
+from django.db import migrations
+
+# Frozen copy of the ASN and IPv6 usage ranges of conflicts.py
+IPV6_SHIFT = 65
+KINDS = {'asn': 'asn', 'cidrv6': 'ipv6'}
+
+
+def value_range(validator, value):
+    try:
+        if validator == 'asn':
+            number = int(value)
+            return number, number
+        network = ipaddress.IPv6Network(str(value), strict=False)
+        return (int(network.network_address) >> IPV6_SHIFT,
+                int(network.broadcast_address) >> IPV6_SHIFT)
+    except ValueError:
+        return None
+
+
+def service_validators(service):
+    validators = {}
+    for rs in service.resource_services.all():
+        node_validators = validators.setdefault(
+            rs.node_id or "__NONODE__", {}
+        )
+        for template in rs.resource_templates.all():
+            for field, validator in template.fields.items():
+                node_validators.setdefault(field, validator)
+    return validators
+
+
+def add_asn_ipv6_usages(apps, schema_editor):
+    """ASNs and IPv6 prefixes were found in the template fields of every
+    order when allocating. Store the usages of live orders instead."""
+    ServiceOrder = apps.get_model('configuration', 'ServiceOrder')
+    ResourceUsage = apps.get_model('configuration', 'ResourceUsage')
+    validators = {}
+    usages = []
+    for order in ServiceOrder.objects.filter(
+            deleted=False, service__isnull=False
+    ).select_related('service').iterator():
+        if order.service_id not in validators:
+            validators[order.service_id] = service_validators(order.service)
+        service = validators[order.service_id]
+        for node, values in (order.template_fields or {}).items():
+            fields = {**service.get("__NONODE__", {}), **service.get(node, {})}
+            for field, value in (values or {}).items():
+                validator = fields.get(field)
+                if validator not in KINDS or value in (None, ''):
+                    continue
+                found = value_range(validator, value)
+                if found is None:
+                    continue
+                usages.append(ResourceUsage(
+                    order=order,
+                    node=node,
+                    kind=KINDS[validator],
+                    field=field,
+                    value=str(value),
+                    start=found[0],
+                    end=found[1],
+                ))
+    ResourceUsage.objects.bulk_create(usages, batch_size=500)
+
+
+def remove_asn_ipv6_usages(apps, schema_editor):
+    ResourceUsage = apps.get_model('configuration', 'ResourceUsage')
+    ResourceUsage.objects.filter(kind__in=KINDS.values()).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configuration', '0014_modified_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_asn_ipv6_usages, remove_asn_ipv6_usages),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from configuration.constants import DEFAULT_TAGS
+from configuration.mustache import content_hash, template_tags
 
 
 class Group(models.Model):
@@ -7,6 +10,7 @@ class Group(models.Model):
     username = models.CharField(max_length=255, null=True)
     password = models.CharField(max_length=255, null=True)
     enable_password = models.CharField(max_length=255, null=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -29,6 +33,7 @@ class Node(models.Model):
     comment = models.TextField(null=True)
     group = models.ForeignKey(Group, on_delete=models.CASCADE)
     site = models.CharField(max_length=255)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
 
 class ResourceTemplate(models.Model):
@@ -40,17 +45,81 @@ class ResourceTemplate(models.Model):
     down_contents = models.TextField()
     fields = JSONField(null=True)
     labels = JSONField(null=True)
+    content_hash = models.CharField(max_length=64, null=True)
+    tags = JSONField(null=True)
     deleted = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now=True)
-    modified = models.DateTimeField(auto_now=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
 
+    def refresh_tags(self):
+        """Parse the tags of the up and down contents if they changed
+        since they were last parsed. Returns True if they changed."""
+        digest = content_hash(self.up_contents + "\0" + self.down_contents)
+        if self.tags is not None and digest == self.content_hash:
+            return False
+
+        self.tags = template_tags(self.up_contents, self.down_contents)
+        self.content_hash = digest
+
+        return True
+
+    def get_tags(self):
+        """ The parsed tags, parsing them for rows saved without them """
+        if self.tags is None:
+            self.refresh_tags()
+            if self.pk is not None:
+                ResourceTemplate.objects.filter(pk=self.pk).update(
+                    tags=self.tags,
+                    content_hash=self.content_hash
+                )
+        return self.tags
+
+    def configurable_tags(self):
+        """ The tags of both directions that are not default tags """
+        tags = self.get_tags()
+        return {
+            tag for direction in ('up', 'down')
+            for tag in tags[direction]['all_tags']
+            if tag not in DEFAULT_TAGS
+        }
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self.refresh_tags() and update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {
+                'tags', 'content_hash'
+            }
+        super().save(*args, **kwargs)
+
+
+def keyed_defaults(defaults):
+    """Key a list of resource service defaults, each a dict with a field
+    key, by field as they are stored"""
+    if isinstance(defaults, dict):
+        return defaults
+    return {
+        default['field']: {
+            key: value for key, value in default.items() if key != 'field'
+        }
+        for default in defaults or []
+    }
+
+
+def defaults_list(defaults):
+    """ The stored defaults of a resource service as a list of dicts """
+    return [{'field': field, **value} for field, value in defaults.items()]
+
 
 class ResourceService(models.Model):
     """Resource Services collectiions of Templates optionally with node
-    and defaults"""
+    and defaults.
+
+    defaults maps a field to a dict of its default value, whether it is
+    configurable and whether it is allocated from a resource pool.
+    """
     name = models.CharField(max_length=255)
     resource_templates = models.ManyToManyField(ResourceTemplate)
     node = models.ForeignKey(
@@ -60,7 +129,11 @@ class ResourceService(models.Model):
     )
     defaults = JSONField()
     created = models.DateTimeField(auto_now=True)
-    modified = models.DateTimeField(auto_now=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        self.defaults = keyed_defaults(self.defaults)
+        super().save(*args, **kwargs)
 
 
 class Service(models.Model):
@@ -68,7 +141,7 @@ class Service(models.Model):
     name = models.CharField(max_length=255)
     resource_services = models.ManyToManyField(ResourceService)
     created = models.DateTimeField(auto_now=True)
-    modified = models.DateTimeField(auto_now=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -87,7 +160,127 @@ class ServiceOrder(models.Model):
     template_fields = JSONField()
     deleted = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now=True)
-    modified = models.DateTimeField(auto_now=True)
+    modified = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Serves the containment and key searches on template_fields
+            GinIndex(
+                fields=['template_fields'],
+                name='serviceorder_fields_gin',
+                condition=models.Q(deleted=False),
+            ),
+            models.Index(
+                fields=['service', 'id'],
+                name='serviceorder_live_service_idx',
+                condition=models.Q(deleted=False),
+            ),
+        ]
 
     def __str__(self):
         return self.reference
+
+
+class ResourceUsage(models.Model):
+    """A vlan, bundle, ASN, IPv4 or IPv6 range held by a service order
+    on a node, kept in sync with the order template fields to find
+    conflicts and used values with index lookups. IPv4 addresses and
+    prefixes are stored as the integer range of addresses they cover,
+    IPv6 prefixes as the range of the top 63 bits of their addresses."""
+    order = models.ForeignKey(
+        ServiceOrder,
+        on_delete=models.CASCADE,
+        related_name='resource_usages'
+    )
+    node = models.CharField(max_length=255)
+    kind = models.CharField(max_length=16)
+    field = models.CharField(max_length=255)
+    value = models.CharField(max_length=255)
+    start = models.BigIntegerField()
+    end = models.BigIntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['node', 'kind', 'start'],
+                name='resourceusage_lookup_idx',
+            ),
+        ]
+
+
+class ResourcePool(models.Model):
+    """Vlans, bundles or ASNs from first to last, or the subnets of
+    prefix_length in a prefix, that can be allocated to the orders on a
+    node or on all nodes of a site. Each bit of the bitmap marks one
+    value as allocated."""
+    VALIDATORS = (
+        ('vlan', 'VLAN'),
+        ('bundle', 'Bundle'),
+        ('asn', 'AS number'),
+        ('cidrv4', 'IPv4 prefix'),
+        ('cidrv6', 'IPv6 prefix'),
+    )
+
+    validator = models.CharField(max_length=16, choices=VALIDATORS)
+    node = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True
+    )
+    site = models.CharField(max_length=255, null=True, blank=True)
+    first = models.BigIntegerField(null=True, blank=True)
+    last = models.BigIntegerField(null=True, blank=True)
+    prefix = models.CharField(max_length=64, null=True, blank=True)
+    prefix_length = models.PositiveSmallIntegerField(null=True, blank=True)
+    bitmap = models.BinaryField(default=bytes)
+    modified = models.DateTimeField(auto_now=True)
+
+
+class ResourceAllocation(models.Model):
+    """ A value allocated from a pool to a field of a service order """
+    pool = models.ForeignKey(
+        ResourcePool,
+        on_delete=models.CASCADE,
+        related_name='allocations'
+    )
+    order = models.ForeignKey(
+        ServiceOrder,
+        on_delete=models.CASCADE,
+        related_name='allocations'
+    )
+    node = models.CharField(max_length=255)
+    field = models.CharField(max_length=255)
+    unit = models.BigIntegerField()
+
+
+class ConfigBlob(models.Model):
+    """ A rendered config text, compressed and stored once by its hash """
+    digest = models.CharField(max_length=64, primary_key=True)
+    data = models.BinaryField()
+    size = models.PositiveIntegerField()
+
+
+class ConfigSnapshot(models.Model):
+    """A config rendered for a service order. entries lists the node and
+    the digests of the up and down configs of each part, and digest is
+    the hash of the entries. The reference is kept so the history
+    outlives the order."""
+    order = models.ForeignKey(
+        ServiceOrder,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='snapshots'
+    )
+    reference = models.CharField(max_length=255)
+    digest = models.CharField(max_length=64)
+    entries = JSONField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['order', '-id'],
+                name='configsnapshot_order_idx',
+            ),
+        ]
@@ -1,12 +1,362 @@
-import pystache
+import hashlib
 import re
-from .constants import DEFAULT_TAGS, FORM_TAGS
+import threading
+from collections import OrderedDict
+from html import escape
+from .constants import DEFAULT_TAGS, FORM_TAGS, TEMPLATE_CACHE_SIZE
+from .metrics import timed
 
 
 class ViconfMustacheTagException(Exception):
     pass
 
 
+class ViconfMustacheSyntaxError(ViconfMustacheTagException):
+    pass
+
+
+def content_hash(text):
+    """ Return a stable hash of a template text """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+LIST_TAG_RE = re.compile(r'\{\{\s*#([^}]+\s*)\}\}')
+MERGE_TAG_RE = re.compile(
+    r'\{\{!\s*(maintemplate|subtemplates|subexclude)\s*\}\}'
+)
+
+DEFAULT_DELIMITERS = ('{{', '}}')
+
+# The tag grammar and the whitespace handling below follow pystache, so
+# templates render exactly as they did when pystache was the renderer.
+_TAG_RE_CACHE = {}
+_TAG_TEMPLATE = r"""
+    (?P<whitespace>[\ \t]*)
+    %(otag)s \s*
+    (?:
+      (?P<change>=) \s* (?P<delims>.+?)   \s* = |
+      (?P<raw>{)    \s* (?P<raw_name>.+?) \s* } |
+      (?P<tag>[!>&/#^]?)  \s* (?P<tag_key>[\s\S]+?)
+    )
+    \s* %(ctag)s
+"""
+
+_NOT_FOUND = object()
+
+
+def _tag_re(delimiters):
+    tag_re = _TAG_RE_CACHE.get(delimiters)
+    if tag_re is None:
+        tag_re = re.compile(_TAG_TEMPLATE % {
+            'otag': re.escape(delimiters[0]),
+            'ctag': re.escape(delimiters[1]),
+        }, re.VERBOSE)
+        _TAG_RE_CACHE[delimiters] = tag_re
+    return tag_re
+
+
+def parse(template, delimiters=DEFAULT_DELIMITERS):
+    """Parse a template into a list of nodes.
+
+    Nodes are tuples of ('text', text), ('escape', key), ('literal', key),
+    ('partial', key), ('section', key, nodes, raw, delimiters) and
+    ('inverted', key, nodes). Comments and delimiter changes leave no
+    node behind. Standalone section, comment and delimiter tags consume
+    their whole line.
+    """
+    tag_re = _tag_re(delimiters)
+    nodes = []
+    states = []
+    section_key = None
+    start_index = 0
+    length = len(template)
+
+    while True:
+        match = tag_re.search(template, start_index)
+        if match is None:
+            break
+
+        match_index = match.start()
+        end_index = match.end()
+        if match.group('change') is not None:
+            tag_type, tag_key = '=', match.group('delims')
+        elif match.group('raw') is not None:
+            tag_type, tag_key = '&', match.group('raw_name')
+        else:
+            tag_type, tag_key = match.group('tag'), match.group('tag_key')
+        leading_whitespace = match.group('whitespace')
+
+        began_line = (match_index == 0 or
+                      template[match_index - 1] in '\r\n')
+        ended_line = end_index == length or template[end_index] in '\r\n'
+        if began_line and ended_line and tag_type not in ('', '&'):
+            if end_index < length and template[end_index] == '\r':
+                end_index += 1
+            if end_index < length and template[end_index] == '\n':
+                end_index += 1
+        elif leading_whitespace:
+            match_index += len(leading_whitespace)
+
+        if start_index != match_index:
+            nodes.append(('text', template[start_index:match_index]))
+
+        start_index = end_index
+
+        if tag_type in ('#', '^'):
+            states.append((tag_type, end_index, section_key, nodes))
+            section_key, nodes = tag_key, []
+            continue
+
+        if tag_type == '/':
+            if tag_key != section_key:
+                raise ViconfMustacheSyntaxError(
+                    f"Section end tag mismatch: {tag_key} != {section_key}"
+                )
+            section_nodes = nodes
+            section_type, section_start, section_key, nodes = states.pop()
+            if section_type == '#':
+                nodes.append((
+                    'section',
+                    tag_key,
+                    section_nodes,
+                    template[section_start:match_index],
+                    delimiters
+                ))
+            else:
+                nodes.append(('inverted', tag_key, section_nodes))
+        elif tag_type == '=':
+            delimiters = tuple(tag_key.split())
+            tag_re = _tag_re(delimiters)
+        elif tag_type == '':
+            nodes.append(('escape', tag_key))
+        elif tag_type == '&':
+            nodes.append(('literal', tag_key))
+        elif tag_type == '>':
+            nodes.append(('partial', tag_key))
+
+    if states:
+        raise ViconfMustacheSyntaxError(f"Unclosed section {section_key}")
+
+    if start_index != length:
+        nodes.append(('text', template[start_index:]))
+
+    return nodes
+
+
+def _get_value(context, key):
+    if isinstance(context, dict):
+        if key in context:
+            return context[key]
+    elif type(context).__module__ != 'builtins':
+        try:
+            attr = getattr(context, key)
+        except AttributeError:
+            pass
+        else:
+            if callable(attr):
+                return attr()
+            return attr
+    return _NOT_FOUND
+
+
+def _resolver(key):
+    """ Build a function looking up a key on a context stack """
+    if key == '.':
+        def resolve(stack):
+            return stack[-1]
+        return resolve
+
+    first, *rest = key.split('.')
+
+    def resolve(stack):
+        for context in reversed(stack):
+            if type(context) is dict:
+                if first in context:
+                    value = context[first]
+                    break
+            else:
+                value = _get_value(context, first)
+                if value is not _NOT_FOUND:
+                    break
+        else:
+            return ''
+        for part in rest:
+            value = _get_value(value, part)
+            if value is _NOT_FOUND:
+                return ''
+        return value
+
+    return resolve
+
+
+def _render_value(value, stack, delimiters=DEFAULT_DELIMITERS):
+    """ Render the string returned by a lambda as a template """
+    if not isinstance(value, str):
+        value = str(value)
+    out = []
+    _run(_compile(parse(value, delimiters)), stack, out)
+    return ''.join(out)
+
+
+def _run(ops, stack, out):
+    for op in ops:
+        if op.__class__ is str:
+            out.append(op)
+        else:
+            op(stack, out)
+
+
+def _compile(nodes):
+    """Compile parsed nodes into a flat list of ops. An op is either a
+    string to output or a function taking the context stack and the
+    output list."""
+    ops = []
+    for node in nodes:
+        node_type = node[0]
+        if node_type == 'text':
+            if ops and ops[-1].__class__ is str:
+                ops[-1] += node[1]
+            else:
+                ops.append(node[1])
+        elif node_type in ('escape', 'literal'):
+            ops.append(_compile_interpolation(
+                node[1], node_type == 'escape'
+            ))
+        elif node_type == 'section':
+            ops.append(_compile_section(
+                _resolver(node[1]), _compile(node[2]), node[3], node[4]
+            ))
+        elif node_type == 'inverted':
+            ops.append(_compile_inverted(
+                _resolver(node[1]), _compile(node[2])
+            ))
+        # Partials are not supported and render as nothing
+    return ops
+
+
+def _compile_interpolation(key, escaped):
+    resolve = _resolver(key)
+    plain = key != '.' and '.' not in key
+
+    def interpolate(stack, out):
+        # Inline the common case of a plain key on top of the stack
+        context = stack[-1]
+        if plain and context.__class__ is dict and key in context:
+            value = context[key]
+        else:
+            value = resolve(stack)
+        if callable(value):
+            value = _render_value(value(), stack)
+        elif value.__class__ is not str:
+            value = str(value)
+        out.append(escape(value) if escaped else value)
+    return interpolate
+
+
+def _compile_section(resolve, ops, raw, delimiters):
+    def section(stack, out):
+        data = resolve(stack)
+        if not data:
+            return
+        if isinstance(data, (str, dict)):
+            data = [data]
+        else:
+            try:
+                data = iter(data)
+            except TypeError:
+                data = [data]
+        for item in data:
+            if callable(item):
+                out.append(_render_value(item(raw), stack, delimiters))
+                continue
+            stack.append(item)
+            _run(ops, stack, out)
+            stack.pop()
+    return section
+
+
+def _compile_inverted(resolve, ops):
+    def inverted(stack, out):
+        if not resolve(stack):
+            _run(ops, stack, out)
+    return inverted
+
+
+class CompiledTemplate(object):
+    """ A template compiled to ops along with the tags found in it """
+
+    def __init__(self, template):
+        nodes = parse(template)
+        self.ops = _compile(nodes)
+        self.keys = frozenset(
+            node[1] for node in nodes
+            if node[0] in ('escape', 'literal', 'section', 'inverted')
+        )
+        # This is a bit of a dirty monkey patch, and should probably
+        # be rewritten in to a full parser.
+        self.list_tags = tuple(LIST_TAG_RE.findall(template))
+
+    def render(self, params):
+        out = []
+        _run(self.ops, [params], out)
+        return ''.join(out)
+
+
+class ViconfTemplateCache(object):
+    """Size bounded LRU cache of compiled templates, keyed by the hash
+    of the template text."""
+
+    def __init__(self, maxsize=TEMPLATE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, template):
+        key = content_hash(template)
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        # Parse outside the lock, a duplicate parse is harmless
+        with timed('parse'):
+            compiled = CompiledTemplate(template)
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return compiled
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+template_cache = ViconfTemplateCache()
+
+
 class ViconfMustache(object):
 
     def __init__(self, template):
@@ -14,22 +364,18 @@ class ViconfMustache(object):
             self.template = self.merge_templates(template)
         else:
             self.template = template
+        self._compiled = None
+
+    @property
+    def compiled(self):
+        if self._compiled is None:
+            self._compiled = template_cache.get(self.template)
+        return self._compiled
 
     def parse_keys(self):
-        # fragile, relies on pystache internals
-        parsed_template = pystache.parse(self.template)
-        keys = []
-        parse_tree = parsed_template._parse_tree
-        keyed_classes = (pystache.parser._EscapeNode,
-                         pystache.parser._LiteralNode,
-                         pystache.parser._InvertedNode,
-                         pystache.parser._SectionNode)
-        for token in parse_tree:
-            if isinstance(token, keyed_classes):
-                keys.append(token.key)
         # return list of unique items
         # (json does not like sets)
-        return list(set(keys))
+        return list(self.compiled.keys)
 
     def get_configurable_tags(self):
         tags = self.parse_keys()
@@ -40,10 +386,7 @@ class ViconfMustache(object):
         return tags
 
     def list_tags(self):
-        # This is a bit of a dirty monkey patch, and should probably
-        # be rewritten in to a full parser.
-        tags = re.compile(r'\{\{\s*#([^}]+\s*)\}\}')
-        return tags.findall(self.template)
+        return list(self.compiled.list_tags)
 
     def parse_template_tags(self):
         result = {
@@ -75,7 +418,9 @@ class ViconfMustache(object):
         for param, value in service_params.items():
             params[param] = value
 
-        return pystache.render(self.template, params)
+        compiled = self.compiled
+        with timed('render'):
+            return compiled.render(params)
 
     def merge_templates(self, texts):
         """It is possible to set a {{! maintemplate }} comment on top of one template
@@ -89,44 +434,52 @@ class ViconfMustache(object):
 
         """
         main_template = None
+        subtemplates_match = None
+        templates = []
         subexcluded = []
-        for index, template in enumerate(texts):
-            maintag = re.search(r'\{\{!\s*maintemplate\s*\}\}', template)
-            subtemplatetag = re.search(r'\{\{!\s*subtemplates\s*\}\}', template)
-            if maintag is not None and subtemplatetag is not None:
-                main_template = texts.pop(index)
-                break
-
-        for index, template in enumerate(texts):
-            subexcludetag = re.search(r'\{\{!\s*subexclude\s*\}\}', template)
-            if subexcludetag is not None:
-                subexcluded.append(texts.pop(index))
-
-        content = ""
-
         for template in texts:
-            content += template
-            content += "\n"
+            tags = {}
+            for match in MERGE_TAG_RE.finditer(template):
+                tags.setdefault(match.group(1), match)
+            if (main_template is None and 'maintemplate' in tags and
+                    'subtemplates' in tags):
+                main_template = template
+                subtemplates_match = tags['subtemplates']
+            elif 'subexclude' in tags:
+                subexcluded.append(template)
+            else:
+                templates.append(template)
 
         if main_template is None:
             # If there is no main template, add the subexcluded
             # templates back to the content
-            for template in subexcluded:
-                content += template
-                content += "\n"
+            return "".join(
+                template + "\n" for template in templates + subexcluded
+            )
 
-        else:
-            content_a = content.split('\n')
-            main_template_a = main_template.split('\n')
-            position = None
-            for index, line in enumerate(main_template_a):
-                subtemplatetag = re.search(r'\{\{!\s*subtemplates\s*\}\}', line)
-                if subtemplatetag is not None:
-                    position = index
-                    break
+        # Insert the templates before the line holding the first
+        # subtemplates tag of the main template
+        start = main_template.rfind("\n", 0, subtemplates_match.start()) + 1
+        parts = [main_template[:start]]
+        parts.extend(template + "\n" for template in templates)
+        parts.append("\n")
+        parts.append(main_template[start:])
+        parts.extend("\n" + template for template in subexcluded)
 
-            main_template_a[position:position] = content_a
+        return "".join(parts)
 
-            content = "\n".join(main_template_a + subexcluded)
 
-        return content
+def template_tags(up_contents, down_contents):
+    """ The parsed tags of both directions of a template, as json """
+    tags = {}
+    for direction, contents in (('up', up_contents),
+                                ('down', down_contents)):
+        parsed = ViconfMustache(contents).parse_template_tags()
+        tags[direction] = {
+            'all_tags': sorted(parsed['all_tags']),
+            'user_tags': sorted(parsed['user_tags']),
+            'form_tags': sorted(parsed['form_tags']),
+            'list_tags': parsed['list_tags'],
+        }
+
+    return tags
@@ -0,0 +1,29 @@
+""" Pagination for the list views """
+
+from rest_framework.pagination import CursorPagination
+
+
+class ViconfCursorPagination(CursorPagination):
+    """Keyset pagination, used when the client asks for it with either
+    ?page_size= or ?cursor=, so existing clients still get full lists.
+
+    The view may set cursor_ordering_fields to the fields that can be
+    used with ?ordering=, the first one being the default.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering_param = 'ordering'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (self.cursor_query_param not in request.query_params and
+                self.page_size_query_param not in request.query_params):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        fields = getattr(view, 'cursor_ordering_fields', ('id', 'modified'))
+        ordering = request.query_params.get(self.ordering_param)
+        if ordering and ordering.lstrip('-') in fields:
+            return (ordering,)
+        return (fields[0],)
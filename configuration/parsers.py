@@ -0,0 +1,26 @@
+""" Request parsers """
+
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """ Parses newline delimited JSON into a list """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        items = []
+        try:
+            for line in stream:
+                line = line.decode(encoding).strip()
+                if line:
+                    items.append(json.loads(line))
+        except ValueError as exc:
+            raise ParseError(f"NDJSON parse error - {exc}")
+
+        return items
@@ -1,11 +1,32 @@
+from django.db import transaction
 from rest_framework import serializers
 from configuration.models import (
+    ConfigSnapshot,
+    ResourceAllocation,
+    ResourcePool,
     ResourceTemplate,
     ResourceService,
     Service,
     ServiceOrder,
+    defaults_list,
+    keyed_defaults,
 )
-from configuration.mustache import ViconfMustache
+from configuration.allocation import (
+    ViconfAllocationError,
+    allocate_order_fields,
+    allocated_count,
+    check_pool,
+    pool_size,
+)
+from configuration.conflicts import (
+    find_conflicts,
+    lock_nodes,
+    order_hostnames,
+    order_usages,
+)
+from configuration.helpers import generate_service_validators, prefetch_services
+from configuration.mustache import ViconfMustacheSyntaxError, template_cache
+from configuration.snapshots import snapshot_config
 
 
 class ResourceTemplateSerializer(serializers.Serializer):
@@ -21,26 +42,34 @@ class ResourceTemplateSerializer(serializers.Serializer):
     created = serializers.DateTimeField(read_only=True)
     modified = serializers.DateTimeField(read_only=True)
 
-    def create(self, validated_data):
-        up_template = ViconfMustache(template=validated_data['up_contents'])
-        down_template = ViconfMustache(template=validated_data['down_contents'])
-        tags = set()
+    def validate_template(self, value):
+        try:
+            template_cache.get(value)
+        except ViconfMustacheSyntaxError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
+    def validate_up_contents(self, value):
+        return self.validate_template(value)
 
-        for tag in up_template.get_configurable_tags():
-            tags.add(tag)
-        for tag in down_template.get_configurable_tags():
-            tags.add(tag)
+    def validate_down_contents(self, value):
+        return self.validate_template(value)
+
+    def create(self, validated_data):
+        instance = ResourceTemplate(**validated_data)
+        instance.refresh_tags()
 
         fields = {}
         labels = {}
-        for tag in tags:
+        for tag in instance.configurable_tags():
             fields[tag] = "none"
             labels[tag] = tag.capitalize()
 
-        validated_data['fields'] = fields
-        validated_data['labels'] = labels
+        instance.fields = fields
+        instance.labels = labels
+        instance.save()
 
-        return ResourceTemplate.objects.create(**validated_data)
+        return instance
 
     def update(self, instance, validated_data):
         instance.name = validated_data.get('name', instance.name)
@@ -57,38 +86,36 @@ class ResourceTemplateSerializer(serializers.Serializer):
             'down_contents',
             instance.down_contents
         )
-        up_template = ViconfMustache(
-            template=validated_data.get('up_contents', instance.up_contents)
-        )
-        down_template = ViconfMustache(
-            template=validated_data.get('down_contents', instance.down_contents)
-        )
 
         instance.deleted = validated_data.get('deleted', instance.deleted)
-        tags = set()
 
-        for tag in up_template.get_configurable_tags():
-            tags.add(tag)
-        for tag in down_template.get_configurable_tags():
-            tags.add(tag)
+        # Only reconcile the fields if the contents changed. Rows stored
+        # before their contents were checked may not parse.
+        try:
+            changed = instance.refresh_tags()
+        except ViconfMustacheSyntaxError as e:
+            errors = {}
+            for field in ('up_contents', 'down_contents'):
+                try:
+                    self.validate_template(getattr(instance, field))
+                except serializers.ValidationError as error:
+                    errors[field] = error.detail
+            raise serializers.ValidationError(
+                errors or {'up_contents': [str(e)]}
+            )
+        if changed:
+            tags = instance.configurable_tags()
+            template_fields = set(instance.fields.keys())
 
-        template_fields = sorted(set(instance.fields.keys()))
-
-        if sorted(tags) != template_fields:
             for tag in tags:
                 if tag not in template_fields:
                     instance.fields[tag] = "none"
                     instance.labels[tag] = tag.capitalize()
 
-        # Remove old tags no longer in the template
-        remove_tags = []
-        for field in instance.fields.keys():
-            if field not in tags:
-                remove_tags.append(field)
-
-        for tag in remove_tags:
-            instance.fields.pop(tag)
-            instance.labels.pop(tag)
+            # Remove old tags no longer in the template
+            for tag in template_fields - tags:
+                instance.fields.pop(tag)
+                instance.labels.pop(tag)
 
         instance.save()
 
@@ -106,11 +133,34 @@ class ResourceTagDefineSerializer(serializers.Serializer):
     resource_fieldset = ResourceFieldsetSerializer(many=True)
 
 
+class ResourceTagBatchItemSerializer(serializers.Serializer):
+    resource_template_id = serializers.IntegerField()
+    resource_fieldset = ResourceFieldsetSerializer(many=True)
+
+
+class ResourceTagBatchSerializer(serializers.Serializer):
+    templates = ResourceTagBatchItemSerializer(many=True)
+
+
+class RSDefaultsListSerializer(serializers.ListSerializer):
+    """ Defaults are stored keyed by field and sent as a list """
+
+    def to_internal_value(self, data):
+        return keyed_defaults(super().to_internal_value(data))
+
+    def to_representation(self, data):
+        return super().to_representation(defaults_list(data))
+
+
 class RSDefaultsSerializer(serializers.Serializer):
     field = serializers.CharField()
     default = serializers.CharField(allow_null=True, allow_blank=True)
     configurable = serializers.BooleanField(allow_null=False)
     global_field = serializers.BooleanField(default=False)
+    allocate = serializers.BooleanField(default=False)
+
+    class Meta:
+        list_serializer_class = RSDefaultsListSerializer
 
 
 class ResourceServiceSerializer(serializers.ModelSerializer):
@@ -188,8 +238,147 @@ class ServiceOrderSerializer(serializers.ModelSerializer):
             'service_name',
         ]
 
+    def check_conflicts(self, service, template_fields):
+        """Refuse resources already used by other orders on a node. The
+        nodes stay locked until the transaction of create or update
+        ends, so concurrent orders on a node are checked one at a time."""
+        conflicts = find_conflicts(
+            order_usages(template_fields, generate_service_validators(service)),
+            exclude_order=self.instance
+        )
+        if conflicts:
+            raise serializers.ValidationError({'template_fields': conflicts})
+
+    def lock_service(self, service, template_fields):
+        """ Prefetch the service and lock the nodes an order touches """
+        service = prefetch_services(Service.objects.filter(pk=service.pk)).get()
+        lock_nodes(order_hostnames(service, template_fields))
+        return service
+
+    def create(self, validated_data):
+        """ Fill the fields marked for allocation from the resource pools """
+        service = validated_data.get('service')
+        with transaction.atomic():
+            allocations = []
+            if service is not None:
+                service = self.lock_service(
+                    service, validated_data['template_fields']
+                )
+                try:
+                    allocations = allocate_order_fields(
+                        service, validated_data['template_fields']
+                    )
+                except ViconfAllocationError as e:
+                    raise serializers.ValidationError(
+                        {'template_fields': [str(e)]}
+                    )
+                self.check_conflicts(service, validated_data['template_fields'])
+
+            service_order = super().create(validated_data)
+            for allocation in allocations:
+                allocation.order = service_order
+            ResourceAllocation.objects.bulk_create(allocations)
+
+        return service_order
+
+    def update(self, instance, validated_data):
+        service = validated_data.get('service', instance.service)
+        template_fields = validated_data.get(
+            'template_fields', instance.template_fields
+        )
+        with transaction.atomic():
+            if service is not None:
+                service = self.lock_service(service, template_fields)
+                self.check_conflicts(service, template_fields)
+
+            return super().update(instance, validated_data)
+
+
+class ResourcePoolSerializer(serializers.ModelSerializer):
+    size = serializers.SerializerMethodField()
+    allocated = serializers.SerializerMethodField()
+    modified = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = ResourcePool
+        fields = ['id', 'validator', 'node', 'site', 'first', 'last',
+                  'prefix', 'prefix_length', 'size', 'allocated', 'modified']
+
+    def get_size(self, obj):
+        return pool_size(obj)
+
+    def get_allocated(self, obj):
+        return allocated_count(obj)
+
+    def validate(self, attrs):
+        try:
+            check_pool(ResourcePool(**attrs))
+        except ViconfAllocationError as e:
+            raise serializers.ValidationError(str(e))
+
+        return attrs
+
+
+class ServiceOrderBulkSerializer(serializers.Serializer):
+    """ Validates one order of a bulk import without touching the db """
+    reference = serializers.CharField(max_length=255)
+    customer = serializers.CharField(
+        max_length=255, allow_null=True, required=False
+    )
+    location = serializers.CharField(
+        max_length=255, allow_null=True, required=False
+    )
+    service = serializers.IntegerField()
+    template_fields = serializers.DictField(
+        child=serializers.DictField()
+    )
+
 
 class ConfigurationSerializer(serializers.Serializer):
     node = serializers.CharField()
     service_up = serializers.CharField()
     service_down = serializers.CharField()
+
+
+class ServiceConfigBatchSerializer(serializers.Serializer):
+    orders = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False
+    )
+    service = serializers.IntegerField(required=False)
+    node = serializers.CharField(required=False)
+
+    def validate(self, data):
+        if not data:
+            raise serializers.ValidationError(
+                "One of orders, service or node is required"
+            )
+        return data
+
+
+class ServiceOrderConfigSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    reference = serializers.CharField()
+    config = ConfigurationSerializer(many=True, required=False)
+    error = serializers.CharField(required=False)
+
+
+class ConfigSnapshotSerializer(serializers.ModelSerializer):
+    nodes = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ConfigSnapshot
+        fields = ['id', 'order', 'reference', 'digest', 'nodes', 'created']
+
+    def get_nodes(self, obj):
+        return [node for node, _, _ in obj.entries]
+
+
+class ConfigSnapshotDetailSerializer(ConfigSnapshotSerializer):
+    config = serializers.SerializerMethodField()
+
+    class Meta(ConfigSnapshotSerializer.Meta):
+        fields = ConfigSnapshotSerializer.Meta.fields + ['config']
+
+    def get_config(self, obj):
+        return ConfigurationSerializer(snapshot_config(obj), many=True).data
@@ -0,0 +1,66 @@
+""" Signal handlers keeping cached data in sync with the models """
+
+from django.db.models.signals import m2m_changed, pre_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from configuration.allocation import release_order_allocations
+from configuration.conflicts import sync_order_usages
+from configuration.models import (
+    ResourceService,
+    Service,
+    ServiceOrder,
+)
+
+
+@receiver(post_save, sender=ServiceOrder)
+def service_order_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        sync_order_usages(instance)
+        if instance.deleted:
+            release_order_allocations(instance)
+
+
+@receiver(pre_delete, sender=ServiceOrder)
+def service_order_deleted(sender, instance, **kwargs):
+    release_order_allocations(instance)
+
+
+@receiver(m2m_changed, sender=Service.resource_services.through)
+def service_resources_changed(sender, instance, action, reverse, pk_set,
+                              **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    # Changing relations does not save the instances, so bump modified
+    # to keep ETags and cache keys computed from it accurate
+    if not reverse:
+        Service.objects.filter(pk=instance.pk).update(
+            modified=timezone.now()
+        )
+    elif pk_set is not None:
+        Service.objects.filter(pk__in=pk_set).update(
+            modified=timezone.now()
+        )
+    else:
+        Service.objects.filter(resource_services=instance.pk).update(
+            modified=timezone.now()
+        )
+
+
+@receiver(m2m_changed, sender=ResourceService.resource_templates.through)
+def resource_templates_changed(sender, instance, action, reverse, pk_set,
+                               **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        ResourceService.objects.filter(pk=instance.pk).update(
+            modified=timezone.now()
+        )
+    elif pk_set is not None:
+        ResourceService.objects.filter(pk__in=pk_set).update(
+            modified=timezone.now()
+        )
+    else:
+        ResourceService.objects.filter(resource_templates=instance.pk).update(
+            modified=timezone.now()
+        )
@@ -0,0 +1,181 @@
+"""Keep every config rendered for a service order
+
+Each rendered up and down config is stored once in a ConfigBlob,
+compressed with zlib and keyed by its sha256, so configs shared between
+orders, nodes or renders take no extra space. A ConfigSnapshot only
+lists the digests per node, and a render identical to the latest
+snapshot of its order adds nothing. Listing the history never
+decompresses, and diffs only decompress the configs that changed.
+"""
+
+import difflib
+import json
+import zlib
+
+from django.db.models import OuterRef, Subquery
+
+from configuration.models import ConfigBlob, ConfigSnapshot, ServiceOrder
+from configuration.mustache import content_hash
+
+
+def compress(text):
+    return zlib.compress(text.encode('utf-8'))
+
+
+def decompress(data):
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+
+def config_entries(config):
+    """ The node, up digest and down digest of each part of a config """
+    return [
+        [item['node'],
+         content_hash(item['service_up']),
+         content_hash(item['service_down'])]
+        for item in config
+    ]
+
+
+def store_blobs(texts):
+    """ Store the texts that aren't stored yet """
+    by_digest = {content_hash(text): text for text in texts}
+    existing = set(ConfigBlob.objects.filter(
+        digest__in=list(by_digest)
+    ).values_list('digest', flat=True))
+    ConfigBlob.objects.bulk_create(
+        [
+            ConfigBlob(
+                digest=digest,
+                data=compress(text),
+                size=len(text.encode('utf-8'))
+            )
+            for digest, text in by_digest.items() if digest not in existing
+        ],
+        ignore_conflicts=True
+    )
+
+
+def latest_digests(order_ids):
+    """ Map order id to the digest of its latest snapshot, if any """
+    latest = ConfigSnapshot.objects.filter(
+        order=OuterRef('pk')
+    ).order_by('-id').values('digest')[:1]
+    return dict(
+        ServiceOrder.objects.filter(pk__in=order_ids).annotate(
+            latest=Subquery(latest)
+        ).values_list('pk', 'latest')
+    )
+
+
+def record_snapshots(rendered):
+    """Record a snapshot for each (service order, config) pair, unless
+    the config is the same as the latest snapshot of the order. Returns
+    the new snapshots."""
+    rendered = list(rendered)
+    if not rendered:
+        return []
+
+    latest = latest_digests({order.pk for order, _ in rendered})
+    snapshots = []
+    texts = []
+    for service_order, config in rendered:
+        entries = config_entries(config)
+        digest = content_hash(json.dumps(entries))
+        if latest.get(service_order.pk) == digest:
+            continue
+        latest[service_order.pk] = digest
+        for item in config:
+            texts += [item['service_up'], item['service_down']]
+        snapshots.append(ConfigSnapshot(
+            order=service_order,
+            reference=service_order.reference,
+            digest=digest,
+            entries=entries,
+        ))
+
+    if snapshots:
+        # Blobs are content addressed, so any left behind by a failed
+        # snapshot insert are simply reused later
+        store_blobs(texts)
+        ConfigSnapshot.objects.bulk_create(snapshots)
+
+    return snapshots
+
+
+def load_blobs(digests):
+    """ Map digests to their decompressed texts """
+    return {
+        blob.digest: decompress(blob.data)
+        for blob in ConfigBlob.objects.filter(digest__in=list(set(digests)))
+    }
+
+
+def snapshot_config(snapshot):
+    """ The config of a snapshot, as generate_service_config returns it """
+    texts = load_blobs(
+        digest for _, up, down in snapshot.entries for digest in (up, down)
+    )
+    return [
+        {'node': node, 'service_up': texts[up], 'service_down': texts[down]}
+        for node, up, down in snapshot.entries
+    ]
+
+
+def diff_lines(old, new, old_name, new_name):
+    return list(difflib.unified_diff(
+        old.splitlines(),
+        new.splitlines(),
+        fromfile=old_name,
+        tofile=new_name,
+        lineterm=''
+    ))
+
+
+def keyed_entries(entries):
+    """Key the entries of a snapshot by node and by how many entries of
+    the same node came before, as resource services may share a node"""
+    keyed = {}
+    seen = {}
+    for node, up, down in entries:
+        keyed[(node, seen.get(node, 0))] = (up, down)
+        seen[node] = seen.get(node, 0) + 1
+    return keyed
+
+
+def diff_snapshots(old, new):
+    """Return the unified diffs of the up and down configs of every node
+    that differs between two snapshots. Configs with the same digest are
+    skipped without loading them."""
+    old_entries = keyed_entries(old.entries)
+    new_entries = keyed_entries(new.entries)
+    keys = list(new_entries)
+    keys += [key for key in old_entries if key not in new_entries]
+
+    changed = {}
+    for key in keys:
+        before = old_entries.get(key, (None, None))
+        after = new_entries.get(key, (None, None))
+        if before != after:
+            changed[key] = (before, after)
+
+    texts = load_blobs(
+        digest
+        for before, after in changed.values()
+        for digest in before + after if digest is not None
+    )
+    texts[None] = ""
+
+    diffs = []
+    for (node, _), (before, after) in changed.items():
+        diff = {'node': node}
+        for name, old_digest, new_digest in zip(
+                ('service_up', 'service_down'), before, after):
+            diff[name] = diff_lines(
+                texts[old_digest],
+                texts[new_digest],
+                f"{old.pk}/{node}/{name}",
+                f"{new.pk}/{node}/{name}"
+            )
+        diffs.append(diff)
+
+    return diffs
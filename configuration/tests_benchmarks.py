@@ -0,0 +1,41 @@
+""" Make sure the benchmark suite keeps running """
+
+from django.test import TestCase
+from configuration.benchmarks import run_benchmarks
+
+TINY_SIZES = {
+    'template_lines': [10],
+    'merge_templates': [2],
+    'resource_services': [1, 2],
+    'order_fields': [5],
+    'order_rows': [10],
+}
+
+
+class BenchmarkTests(TestCase):
+
+    def test_run_benchmarks(self):
+        results = run_benchmarks(TINY_SIZES, repeat=1)
+        names = {result['name'] for result in results}
+        self.assertEqual(names, {
+            'mustache_parse',
+            'mustache_compile',
+            'merge_templates',
+            'validate',
+            'validate_many',
+            'validate_many_rows',
+            'validate_rows',
+            'generate_service_schema',
+            'service_config_view',
+        })
+        for result in results:
+            self.assertEqual(result['runs'], 1)
+            self.assertIn('p95_ms', result)
+
+        views = {
+            result['params']['cache']: result for result in results
+            if result['name'] == 'service_config_view' and
+            result['params']['resource_services'] == 1
+        }
+        # A cold request renders, a warm one only reads the cache key
+        self.assertGreater(views['cold']['queries'], views['warm']['queries'])
@@ -0,0 +1,96 @@
+""" Test the request timing middleware and the metrics endpoint """
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from configuration.metrics import metrics, record, request_timings, timed
+from configuration.models import (
+    Node,
+    ResourceService,
+    ResourceTemplate,
+    Service,
+    ServiceOrder,
+)
+
+
+class TimedTests(SimpleTestCase):
+
+    def test_outside_request(self):
+        """ Timing outside a request is not recorded anywhere """
+        with timed('render'):
+            pass
+        self.assertIsNone(request_timings.get())
+
+    def test_accumulates(self):
+        timings = {}
+        token = request_timings.set(timings)
+        try:
+            with timed('render'):
+                pass
+            record('render', 0.5)
+        finally:
+            request_timings.reset(token)
+
+        self.assertEqual(timings['render'][0], 2)
+        self.assertGreaterEqual(timings['render'][1], 0.5)
+
+
+class ServerTimingTests(APITestCase):
+    fixtures = ['nodeandtemplate', 'user']
+
+    def setUp(self):
+        metrics.clear()
+        self.client.force_authenticate(user=User.objects.get(username='api'))
+        node = Node.objects.get()
+        rs = ResourceService.objects.create(node=node, defaults=[])
+        rs.resource_templates.add(ResourceTemplate.objects.get())
+        service = Service.objects.create(name="A service")
+        service.resource_services.add(rs)
+        self.order = ServiceOrder.objects.create(
+            reference="TEST-1",
+            service=service,
+            template_fields={
+                node.hostname: {"place": "World", "day": "Monday"}
+            }
+        )
+
+    def test_config_view_timing(self):
+        url = reverse(
+            "configuration:service_config_view", kwargs={"pk": self.order.id}
+        )
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        timing = response['Server-Timing']
+        for phase in ['db;', 'config;', 'render;', 'validate;', 'total;']:
+            self.assertIn(phase, timing)
+        self.assertIn('desc="9 queries"', timing)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        content = response.content.decode()
+        self.assertIn(
+            'viconf_requests_total{view="configuration:service_config_view",'
+            'method="GET",status="200"} 1',
+            content
+        )
+        self.assertIn(
+            'viconf_phase_duration_seconds_count{'
+            'view="configuration:service_config_view",phase="db"} 9',
+            content
+        )
+        self.assertIn('viconf_template_cache_hits_total', content)
+
+    def test_metrics_authentication(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        with self.settings(VICONF_METRICS_ALLOWED_IPS=['127.0.0.1']):
+            response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('viconf_template_cache_hits_total',
+                      response.content.decode())
@@ -0,0 +1,207 @@
+""" Test the mustache template handling """
+
+import random
+
+from django.test import SimpleTestCase
+from configuration.mustache import (
+    CompiledTemplate,
+    ViconfMustache,
+    ViconfMustacheSyntaxError,
+    ViconfTemplateCache,
+    template_cache,
+)
+
+
+def render(template, params):
+    return CompiledTemplate(template).render(params)
+
+
+class RendererTests(SimpleTestCase):
+
+    def test_variables(self):
+        self.assertEqual(render("a {{x}} b", {'x': 'y'}), "a y b")
+        self.assertEqual(render("a {{ missing }} b", {}), "a  b")
+        self.assertEqual(render("{{x}}", {'x': None}), "None")
+        self.assertEqual(render("{{x}}", {'x': 5}), "5")
+        self.assertEqual(render("{{x.y}}", {'x': {'y': 'z'}}), "z")
+
+    def test_escapes(self):
+        params = {'x': '<a href="b">&\''}
+        self.assertEqual(
+            render("{{x}}", params),
+            "&lt;a href=&quot;b&quot;&gt;&amp;&#x27;"
+        )
+        self.assertEqual(render("{{{x}}}", params), params['x'])
+        self.assertEqual(render("{{& x}}", params), params['x'])
+
+    def test_sections(self):
+        template = "{{#list}}[{{name}}]{{/list}}"
+        self.assertEqual(
+            render(template, {'list': [{'name': 'a'}, {'name': 'b'}]}),
+            "[a][b]"
+        )
+        self.assertEqual(render(template, {'list': [], 'name': 'x'}), "")
+        self.assertEqual(render(template, {'list': True, 'name': 'x'}), "[x]")
+        self.assertEqual(render(template, {'list': 'on', 'name': 'x'}), "[x]")
+        self.assertEqual(render("{{#l}}{{.}},{{/l}}", {'l': [1, 2]}), "1,2,")
+
+    def test_inverted_sections(self):
+        template = "{{^vlan}}untagged{{/vlan}}"
+        self.assertEqual(render(template, {}), "untagged")
+        self.assertEqual(render(template, {'vlan': ''}), "untagged")
+        self.assertEqual(render(template, {'vlan': '10'}), "")
+
+    def test_standalone_lines(self):
+        template = "a\n  {{! comment }}\n{{#x}}\n  b\n{{/x}}\nc\n"
+        self.assertEqual(render(template, {'x': True}), "a\n  b\nc\n")
+        self.assertEqual(render("a {{! c }} b", {}), "a  b")
+
+    def test_delimiters(self):
+        self.assertEqual(
+            render("{{=<% %>=}}<% x %> {{x}}", {'x': 'y'}),
+            "y {{x}}"
+        )
+
+    def test_keys(self):
+        template = "{{a}} {{{b}}} {{#c}}{{d}}{{/c}} {{^e}}{{/e}} {{! f }}"
+        self.assertEqual(
+            CompiledTemplate(template).keys,
+            {'a', 'b', 'c', 'e'}
+        )
+
+    def test_syntax_error(self):
+        with self.assertRaises(ViconfMustacheSyntaxError):
+            CompiledTemplate("{{#a}}")
+        with self.assertRaises(ViconfMustacheSyntaxError):
+            CompiledTemplate("{{#a}}{{/b}}")
+
+
+class TemplateCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        template_cache.clear()
+
+    def test_compile_hits_cache(self):
+        """ Rendering the same text twice only parses it once """
+        template = "Hello {{ place }}"
+        first = ViconfMustache(template).compile({'place': 'World'}, {})
+        second = ViconfMustache(template).compile({'place': 'Norway'}, {})
+
+        self.assertEqual(first, "Hello World")
+        self.assertEqual(second, "Hello Norway")
+        stats = template_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_keys_are_not_shared(self):
+        """ Callers may mutate the returned tag lists """
+        template = "{{ customer }} {{ place }}"
+        tags = ViconfMustache(template).get_configurable_tags()
+        self.assertEqual(tags, ['place'])
+        self.assertEqual(
+            sorted(ViconfMustache(template).parse_keys()),
+            ['customer', 'place']
+        )
+
+    def test_eviction(self):
+        cache = ViconfTemplateCache(maxsize=2)
+        first = cache.get("one {{ a }}")
+        cache.get("two {{ b }}")
+        # touch the first template so the second is least recently used
+        cache.get("one {{ a }}")
+        cache.get("three {{ c }}")
+
+        stats = cache.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertIs(cache.get("one {{ a }}"), first)
+        cache.get("two {{ b }}")
+        self.assertEqual(cache.stats()['misses'], 4)
+
+
+def reference_merge(texts):
+    """ The original merge_templates, without the list mutation """
+    texts = list(texts)
+    main_template = None
+    for index, template in enumerate(texts):
+        if "{{! maintemplate }}" in template and \
+                "{{! subtemplates }}" in template:
+            main_template = texts.pop(index)
+            break
+
+    subexcluded = [t for t in texts if "{{! subexclude }}" in t]
+    texts = [t for t in texts if "{{! subexclude }}" not in t]
+    content = ""
+    for template in texts:
+        content += template + "\n"
+
+    if main_template is None:
+        for template in subexcluded:
+            content += template + "\n"
+        return content
+
+    content_a = content.split('\n')
+    main_template_a = main_template.split('\n')
+    position = next(
+        index for index, line in enumerate(main_template_a)
+        if "{{! subtemplates }}" in line
+    )
+    main_template_a[position:position] = content_a
+    return "\n".join(main_template_a + subexcluded)
+
+
+class MergeTemplatesTests(SimpleTestCase):
+
+    TAGS = ["{{! maintemplate }}", "{{! subtemplates }}", "{{! subexclude }}"]
+
+    def random_template(self, rng):
+        lines = [f"line {rng.randint(0, 99)} {{{{ field{rng.randint(0, 5)} }}}}"
+                 for _ in range(rng.randint(0, 4))]
+        for tag in self.TAGS:
+            if rng.random() < 0.3:
+                lines.insert(rng.randint(0, len(lines)), tag)
+        if rng.random() < 0.2:
+            # A main template may hold more than one subtemplates tag
+            lines.insert(rng.randint(0, len(lines)), self.TAGS[1])
+        return "\n".join(lines)
+
+    def test_matches_reference(self):
+        rng = random.Random(14)
+        for _ in range(500):
+            texts = [self.random_template(rng)
+                     for _ in range(rng.randint(1, 8))]
+            original = list(texts)
+            self.assertEqual(
+                ViconfMustache(texts).template,
+                reference_merge(texts),
+                texts
+            )
+            self.assertEqual(texts, original)
+
+    def test_first_subtemplates_tag(self):
+        texts = [
+            "{{! maintemplate }}\n{{! subtemplates }}\nmid\n"
+            "{{! subtemplates }}\ntail",
+            "a",
+        ]
+        self.assertEqual(
+            ViconfMustache(texts).template,
+            "{{! maintemplate }}\na\n\n{{! subtemplates }}\nmid\n"
+            "{{! subtemplates }}\ntail"
+        )
+        self.assertEqual(ViconfMustache(texts).template, reference_merge(texts))
+
+    def test_adjacent_subexcludes(self):
+        texts = [
+            "{{! maintemplate }}\nhead\n{{! subtemplates }}\ntail",
+            "a",
+            "x\n{{! subexclude }}",
+            "y\n{{! subexclude }}",
+            "b",
+        ]
+        self.assertEqual(
+            ViconfMustache(texts).template,
+            "{{! maintemplate }}\nhead\na\nb\n\n{{! subtemplates }}\ntail"
+            "\nx\n{{! subexclude }}\ny\n{{! subexclude }}"
+        )
+        self.assertEqual(len(texts), 5)
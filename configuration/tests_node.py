@@ -64,3 +64,35 @@ class NodeTests(APITestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['hostname'], "hostname")
         self.assertEqual(response.data[0]['group_data']['username'], "user")
+    def test_node_list_conditional_get(self):
+        group = Group.objects.create(
+            name="test",
+            username="user"
+        )
+        node = Node.objects.create(
+            hostname="hostname",
+            group=group,
+            driver="none"
+        )
+        url = reverse("configuration:nodelist")
+        user = User.objects.get(username='api')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(url, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        detail_url = reverse(
+            "configuration:nodeview", kwargs={"hostname": node.hostname}
+        )
+        response = self.client.get(detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        group.username = "other"
+        group.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['group_data']['username'], "other")
@@ -1,13 +1,44 @@
+import io
+import json
+import tempfile
+from unittest import skipUnless
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APITestCase
+from configuration.conflicts import node_validators
+from configuration.serializers.resources import ServiceOrderSerializer
+from configuration.helpers import (
+    cached_service_config,
+    generate_service_config,
+    prefetch_service_orders,
+    render_service_orders,
+    template_key,
+    update_template_resource_services,
+)
 from configuration.models import (
+    ConfigBlob,
+    ConfigSnapshot,
+    ResourceAllocation,
+    ResourcePool,
     ResourceTemplate,
     ResourceService,
+    ResourceUsage,
     Node,
-    Service
+    Service,
+    ServiceOrder,
 )
 from django.contrib.auth.models import User
+from rest_framework_simplejwt.tokens import AccessToken
+from configuration.validators import ViconfValidationError
+from configuration.workers import (
+    render_node_jobs,
+    reset_render_process_executor,
+)
 
 
 class ServiceTests(APITestCase):
@@ -50,9 +81,16 @@ class ServiceTests(APITestCase):
             1
         )
         self.assertEqual(
-            ResourceService.objects.get().defaults[0]['default'],
+            ResourceService.objects.get().defaults['place']['default'],
             'World'
         )
+        self.assertEqual(response.data['defaults'][1], {
+            "field": "day",
+            "default": "Wednesday",
+            "configurable": True,
+            "global_field": False,
+            "allocate": False,
+        })
 
 
     def test_patch_rs(self):
@@ -78,10 +116,10 @@ class ServiceTests(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertFalse(
-            ResourceService.objects.get().defaults[0]['configurable']
+            ResourceService.objects.get().defaults['place']['configurable']
         )
         self.assertEqual(
-            ResourceService.objects.get().defaults[1]['default'], "Thursday"
+            ResourceService.objects.get().defaults['day']['default'], "Thursday"
         )
 
     def test_update_template_rs(self):
@@ -97,8 +135,49 @@ class ServiceTests(APITestCase):
         response = self.client.patch(url, { "up_contents": up_contents }, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         rs = ResourceService.objects.get()
-        default_fields = [ field['field'] for field in rs.defaults ]
-        self.assertIn('foo', default_fields)
+        self.assertIn('foo', rs.defaults)
+
+    @skipUnless(connection.vendor == 'postgresql',
+                "Merges the defaults in a single jsonb UPDATE")
+    def test_update_template_rs_postgresql(self):
+        template = ResourceTemplate.objects.get()
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[
+                {"field": "place", "default": "World", "configurable": False},
+                {"field": "gone", "default": "x", "configurable": True},
+            ]
+        )
+        rs.resource_templates.add(template)
+        unchanged = ResourceService.objects.create(
+            defaults=[
+                {"field": field, "default": None, "configurable": True}
+                for field in template.fields
+            ]
+        )
+        unchanged.resource_templates.add(template)
+        modified = ResourceService.objects.values_list(
+            'modified', flat=True
+        ).get(pk=unchanged.pk)
+
+        self.assertEqual(update_template_resource_services(template.id), 1)
+        defaults = ResourceService.objects.get(pk=rs.pk).defaults
+        self.assertEqual(set(defaults), set(template.fields))
+        self.assertEqual(
+            defaults['place'], {"default": "World", "configurable": False}
+        )
+        self.assertEqual(
+            defaults['day'], {"default": None, "configurable": True}
+        )
+        self.assertGreater(
+            ResourceService.objects.get(pk=rs.pk).modified, rs.modified
+        )
+        self.assertEqual(
+            ResourceService.objects.get(pk=unchanged.pk).modified, modified
+        )
+
+        # Reconciled services are not written again
+        self.assertEqual(update_template_resource_services(template.id), 0)
 
     def test_create_service(self):
         rs = ResourceService.objects.create(
@@ -385,3 +464,1145 @@ template3: Hello World
 Nothing more here.
 template4: Hello """
         self.assertEqual(config_response.data[0]['service_up'], expected)
+
+    def test_service_config_batch(self):
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[
+                {
+                    "field": "place",
+                    "default": "World",
+                    "configurable": False
+                },
+                {
+                    "field": "day",
+                    "default": "Wednesday",
+                    "configurable": True
+                }
+            ]
+        )
+        rs.resource_templates.add(ResourceTemplate.objects.get())
+
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+
+        orders = []
+        for day in ["Monday", "Tuesday", "Friday"]:
+            orders.append(ServiceOrder.objects.create(
+                reference=f"TEST-{day}",
+                service=ser,
+                template_fields={hostname: {"day": day, "place": "Oslo"}}
+            ))
+        invalid = ServiceOrder.objects.create(
+            reference="TEST-invalid",
+            service=ser,
+            template_fields={hostname: {"day": "Some day"}}
+        )
+
+        url = reverse("configuration:service_config_batch_view")
+        user = User.objects.get(username='api')
+        self.client.force_authenticate(user=user)
+
+        response = self.client.post(
+            url,
+            {"orders": [order.id for order in orders]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]['id'], orders[0].id)
+        self.assertIn("Today is Monday", response.data[0]['config'][0]['service_up'])
+        self.assertIn("Today is Friday", response.data[2]['config'][0]['service_up'])
+
+        response = self.client.post(url, {"node": hostname}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 4)
+        self.assertEqual(response.data[3]['id'], invalid.id)
+        self.assertEqual(response.data[3]['error'], "day is not a valid string")
+        self.assertNotIn('config', response.data[3])
+
+        response = self.client.post(url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_service_config_query_count(self):
+        """ Rendering costs the same number of queries for any service size """
+        node = Node.objects.get()
+        user = User.objects.get(username='api')
+        self.client.force_authenticate(user=user)
+
+        def create_order(size):
+            ser = Service.objects.create(name=f"Service {size}")
+            for index in range(size):
+                rs = ResourceService.objects.create(
+                    name=f"RS {index}",
+                    node=node if index % 2 else None,
+                    defaults=[]
+                )
+                for _ in range(size):
+                    rs.resource_templates.add(
+                        ResourceTemplate.objects.create(
+                            name="template",
+                            up_contents="Hello {{ place }}",
+                            down_contents="Goodbye {{ place }}",
+                            fields={"place": "string"},
+                            labels={"place": "Place"}
+                        )
+                    )
+                ser.resource_services.add(rs)
+
+            return ServiceOrder.objects.create(
+                reference=f"TEST-{size}",
+                service=ser,
+                template_fields={node.hostname: {"place": "World"}}
+            )
+
+        small = create_order(2)
+        large = create_order(6)
+
+        for order in [small, large]:
+            url = reverse(
+                "configuration:service_config_view", kwargs={"pk": order.id}
+            )
+            # The cache key, the node of node-less resource services,
+            # the five queries rendering, then the latest snapshot, the
+            # stored blobs, the blob insert and the snapshot insert
+            with self.assertNumQueries(11):
+                response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn("Hello World", response.data[0]['service_up'])
+
+            with self.assertNumQueries(2):
+                cached = self.client.get(url, format='json')
+            self.assertEqual(cached.data, response.data)
+
+    def test_node_config_stream(self):
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[]
+        )
+        rs.resource_templates.add(ResourceTemplate.objects.get())
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+
+        for day in ["Monday", "Tuesday"]:
+            ServiceOrder.objects.create(
+                reference=f"TEST-{day}",
+                service=ser,
+                template_fields={hostname: {"day": day, "place": "Oslo"}}
+            )
+        ServiceOrder.objects.create(
+            reference="TEST-deleted",
+            service=ser,
+            deleted=True,
+            template_fields={hostname: {"day": "Friday", "place": "Oslo"}}
+        )
+
+        url = reverse(
+            "configuration:node_config_stream", kwargs={"hostname": hostname}
+        )
+        user = User.objects.get(username='api')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        first = json.loads(lines[0])
+        self.assertEqual(first['reference'], "TEST-Monday")
+        self.assertEqual(first['node'], hostname)
+        self.assertIn("Today is Monday", first['service_up'])
+
+    def test_validate_orders_command(self):
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[]
+        )
+        rs.resource_templates.add(ResourceTemplate.objects.get())
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+
+        orders = [
+            {"reference": "GOOD", "service": ser.id,
+             "template_fields": {hostname: {"day": "Monday", "place": "Oslo"}}},
+            {"reference": "BAD", "service": ser.id,
+             "template_fields": {hostname: {"day": "Some day", "place": "Oslo"}}},
+            {"reference": "NOSERVICE", "service": 0, "template_fields": {}},
+            {"reference": "MISSING", "service": ser.id,
+             "template_fields": {hostname: {"day": "Monday"}}},
+            {"reference": "NONODE", "service": ser.id, "template_fields": {}},
+        ]
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as orderfile:
+            json.dump(orders, orderfile)
+            orderfile.flush()
+            out = io.StringIO()
+            with self.assertRaises(CommandError):
+                call_command(
+                    'validate_orders', orderfile.name, '--json', stdout=out
+                )
+
+        report = json.loads(out.getvalue())
+        self.assertEqual([row['reference'] for row in report],
+                         ["BAD", "NOSERVICE", "MISSING", "NONODE"])
+        self.assertEqual(report[0]['errors'], ["day is not a valid string"])
+        self.assertEqual(report[2]['errors'], ["place is required"])
+        self.assertEqual(report[3]['errors'],
+                         ["day is required", "place is required"])
+
+        # A single NDJSON line is one order, not a list
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson') as orderfile:
+            orderfile.write(json.dumps(orders[0]) + "\n")
+            orderfile.flush()
+            out = io.StringIO()
+            call_command('validate_orders', orderfile.name, stdout=out)
+        self.assertIn("1 orders valid", out.getvalue())
+
+    def test_service_order_bulk(self):
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[]
+        )
+        rs.resource_templates.add(ResourceTemplate.objects.get())
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+
+        orders = [
+            {"reference": f"TEST-{index}", "service": ser.id,
+             "template_fields": {hostname: {"day": "Monday", "place": "Oslo"}}}
+            for index in range(10)
+        ]
+        orders[3]["template_fields"][hostname]["day"] = "Some day"
+        orders[5]["template_fields"] = {"other.node": {}}
+        del orders[7]["reference"]
+
+        url = reverse("configuration:service_order_bulk")
+        user = User.objects.get(username='api')
+        self.client.force_authenticate(user=user)
+        response = self.client.post(url, orders, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 7)
+        self.assertEqual(response.data['failed'], 3)
+        self.assertEqual(ServiceOrder.objects.count(), 7)
+        results = response.data['results']
+        self.assertEqual(
+            results[3]['errors'],
+            {"template_fields": ["day is not a valid string"]}
+        )
+        self.assertEqual(
+            results[5]['errors'],
+            {"template_fields": [
+                "Unknown node other.node",
+                "day is required",
+                "place is required",
+            ]}
+        )
+        self.assertIn('reference', results[7]['errors'])
+
+        ndjson = "\n".join(json.dumps(order) for order in orders[:2])
+        response = self.client.post(
+            url, ndjson, content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(ServiceOrder.objects.count(), 9)
+
+    def test_service_schema_cache(self):
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[
+                {
+                    "field": "day",
+                    "default": "Wednesday",
+                    "configurable": True
+                }
+            ]
+        )
+        rs.resource_templates.add(ResourceTemplate.objects.get())
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+
+        url = reverse(
+            'configuration:service_schema_view', kwargs={"pk": ser.id}
+        )
+        user = User.objects.get(username='api')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # Only the cache key query
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json')
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        rs.defaults['day']['default'] = 'Friday'
+        rs.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(
+            response.data['template_fields'][hostname]['day']['default'],
+            'Friday'
+        )
+
+        template = ResourceTemplate.objects.get()
+        template.labels['day'] = 'Weekday'
+        template.save()
+        response = self.client.get(url, format='json')
+        self.assertEqual(
+            response.data['template_fields'][hostname]['day']['label'],
+            'Weekday'
+        )
+
+        # Writes from other processes send no signals here
+        ResourceService.objects.filter(pk=rs.pk).update(
+            defaults={"day": {"default": "Sunday", "configurable": True}},
+            modified=timezone.now()
+        )
+        response = self.client.get(url, format='json')
+        self.assertEqual(
+            response.data['template_fields'][hostname]['day']['default'],
+            'Sunday'
+        )
+
+        response = self.client.get(reverse(
+            'configuration:service_schema_view', kwargs={"pk": ser.id + 1}
+        ))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_service_list_conditional_get(self):
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[]
+        )
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+
+        url = reverse("configuration:service_list")
+        user = User.objects.get(username='api')
+        self.client.force_authenticate(user=user)
+        response = self.client.get(url, format='json')
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Templates of no listed service leave the ETag alone
+        template = ResourceTemplate.objects.get()
+        template.save()
+        ResourceService.objects.create(defaults=[])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Nested resource templates are part of the service output
+        rs.resource_templates.add(template)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            len(response.data[0]['resource_service_list'][0]
+                ['resource_template_list']),
+            1
+        )
+
+    def test_service_order_list_pagination(self):
+        ser = Service.objects.create(name="A service")
+        for index in range(5):
+            ServiceOrder.objects.create(
+                reference=f"TEST-{index}",
+                service=ser,
+                template_fields={}
+            )
+
+        url = reverse("configuration:service_order_list")
+        user = User.objects.get(username='api')
+        self.client.force_authenticate(user=user)
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(len(response.data), 5)
+
+        response = self.client.get(url, {"page_size": 2}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        references = [order['reference'] for order in response.data['results']]
+        self.assertEqual(references, ["TEST-0", "TEST-1"])
+
+        while response.data['next']:
+            response = self.client.get(response.data['next'], format='json')
+            references += [
+                order['reference'] for order in response.data['results']
+            ]
+        self.assertEqual(references, [f"TEST-{index}" for index in range(5)])
+
+        response = self.client.get(
+            url, {"page_size": 2, "ordering": "-id"}, format='json'
+        )
+        self.assertEqual(response.data['results'][0]['reference'], "TEST-4")
+
+    def test_service_list_sparse_fields(self):
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[]
+        )
+        rs.resource_templates.add(ResourceTemplate.objects.get())
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+
+        url = reverse("configuration:service_list")
+        user = User.objects.get(username='api')
+        self.client.force_authenticate(user=user)
+        # The etag aggregates and the services, without the prefetches
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                url, {"fields": "id,name"}, format='json'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(dict(response.data[0]), {"id": ser.id, "name": "A service"})
+
+        with self.assertNumQueries(6):
+            response = self.client.get(url, format='json')
+        self.assertEqual(
+            response.data[0]['resource_service_list'][0]['resource_templates'],
+            [ResourceTemplate.objects.get().id]
+        )
+
+    def test_async_views(self):
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[
+                {
+                    "field": "day",
+                    "default": "Wednesday",
+                    "configurable": True
+                }
+            ]
+        )
+        rs.resource_templates.add(ResourceTemplate.objects.get())
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+        order = ServiceOrder.objects.create(
+            reference="TEST-async",
+            service=ser,
+            template_fields={hostname: {"place": "World"}}
+        )
+        url = reverse(
+            "configuration:service_config_async_view", kwargs={"pk": order.id}
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        user = User.objects.get(username='api')
+        token = AccessToken.for_user(user)
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+        response = self.client.get(url, **auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(user=user)
+        sync = self.client.get(reverse(
+            "configuration:service_config_view", kwargs={"pk": order.id}
+        ), format='json')
+        self.assertEqual(response.json(), sync.json())
+
+        response = self.client.get(reverse(
+            "configuration:service_config_async_view", kwargs={"pk": 0}
+        ), **auth)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        url = reverse(
+            "configuration:service_schema_async_view", kwargs={"pk": ser.id}
+        )
+        response = self.client.get(url, **auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json()['template_fields'][hostname]['day']['default'],
+            'Wednesday'
+        )
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response['ETag'], **auth
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_parallel_render(self):
+        template = ResourceTemplate.objects.get()
+        ser = Service.objects.create(name="A service")
+        template_fields = {}
+        for index in range(4):
+            node = Node.objects.create(
+                hostname=f"node{index}",
+                group=Node.objects.get(hostname="test.node").group,
+                driver="none",
+                site=""
+            )
+            rs = ResourceService.objects.create(node=node, defaults=[])
+            rs.resource_templates.add(template)
+            ser.resource_services.add(rs)
+            template_fields[node.hostname] = {"place": f"Oslo{index}"}
+        # The same node twice, the last resource service wins
+        rs = ResourceService.objects.create(node=node, defaults=[])
+        rs.resource_templates.add(template)
+        ser.resource_services.add(rs)
+
+        order = ServiceOrder.objects.create(
+            reference="TEST-parallel",
+            service=ser,
+            template_fields={
+                hostname: dict(fields, day=day)
+                for (hostname, fields), day in zip(
+                    template_fields.items(),
+                    ["Monday", "Tuesday", "Wednesday", "Thursday"]
+                )
+            }
+        )
+        order = prefetch_service_orders(ServiceOrder.objects.all()).get(
+            pk=order.pk
+        )
+
+        self.addCleanup(reset_render_process_executor)
+        with self.settings(VICONF_RENDER_PROCESSES=0):
+            sequential = generate_service_config(order)
+        with self.settings(VICONF_RENDER_PROCESSES=2,
+                           VICONF_PARALLEL_RENDER_THRESHOLD=1):
+            parallel = generate_service_config(order)
+
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(
+            [config['node'] for config in parallel],
+            ["node0", "node1", "node2", "node3"]
+        )
+        self.assertIn("Today is Tuesday", parallel[1]['service_up'])
+
+        # Jobs carry their template texts, merged templates are reused
+        key = template_key(template)
+        job = ((key,), [template.fields], {"place": "Oslo", "day": "Friday"})
+        service_params = {"reference": "x"}
+        texts = {key: (template.up_contents, template.down_contents)}
+        results = render_node_jobs([job], service_params, texts)
+        self.assertIn("Today is Friday", results[0][0])
+        self.assertEqual(
+            render_node_jobs([job, job], service_params, texts),
+            results * 2
+        )
+
+        # Fields are validated in the workers
+        template.fields = {"place": "vlan"}
+        template.save()
+        order = prefetch_service_orders(ServiceOrder.objects.all()).get(
+            pk=order.pk
+        )
+        with self.settings(VICONF_RENDER_PROCESSES=2,
+                           VICONF_PARALLEL_RENDER_THRESHOLD=1):
+            with self.assertRaises(ViconfValidationError):
+                generate_service_config(order)
+
+    def test_service_config_cache(self):
+        """ Edits of anything an order renders from change its config """
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[]
+        )
+        template = ResourceTemplate.objects.get()
+        rs.resource_templates.add(template)
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        node = Node.objects.get()
+        order = ServiceOrder.objects.create(
+            reference="TEST-cache",
+            service=ser,
+            template_fields={node.hostname: {"place": "Oslo", "day": "Monday"}}
+        )
+        url = reverse(
+            "configuration:service_config_view", kwargs={"pk": order.id}
+        )
+        self.client.force_authenticate(user=User.objects.get(username='api'))
+
+        def service_up():
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response.data[0]['service_up']
+
+        self.assertIn("Hello Oslo", service_up())
+        with self.assertNumQueries(1):
+            self.assertIn("Hello Oslo", service_up())
+
+        order.template_fields[node.hostname]['place'] = "Bergen"
+        order.save()
+        self.assertIn("Hello Bergen", service_up())
+
+        template.up_contents = "Goodbye {{ place }}"
+        template.save()
+        self.assertIn("Goodbye Bergen", service_up())
+
+        node.ipv4 = "10.0.0.1"
+        node.save()
+        template.up_contents = "{{ place }} {{ node_ipv4 }}"
+        template.save()
+        self.assertIn("Bergen 10.0.0.1", service_up())
+        node.ipv4 = "10.0.0.2"
+        node.save()
+        self.assertIn("Bergen 10.0.0.2", service_up())
+
+        other = ResourceTemplate.objects.create(
+            name="other",
+            up_contents="Extra {{ place }}",
+            down_contents="",
+            fields={"place": "string"},
+            labels={"place": "Place"},
+        )
+        rs.resource_templates.add(other)
+        self.assertIn("Extra Bergen", service_up())
+
+    def test_order_search(self):
+        ser = Service.objects.create(name="A service")
+        hostname = Node.objects.get().hostname
+        Node.objects.create(
+            hostname="other.node",
+            group=Node.objects.get().group,
+            driver="none",
+            site=""
+        )
+        orders = [
+            ServiceOrder.objects.create(
+                reference="TEST-0",
+                service=ser,
+                template_fields={hostname: {"vlan": "310", "cidr": "10.1.2.0/30"}}
+            ),
+            ServiceOrder.objects.create(
+                reference="TEST-1",
+                service=ser,
+                template_fields={"other.node": {"vlan": 310}}
+            ),
+            ServiceOrder.objects.create(
+                reference="TEST-2",
+                service=ser,
+                template_fields={hostname: {"vlan": "311"}}
+            ),
+            ServiceOrder.objects.create(
+                reference="TEST-3",
+                service=ser,
+                template_fields={"unknown.node": {"vlan": "310"}}
+            ),
+            ServiceOrder.objects.create(
+                reference="TEST-deleted",
+                service=ser,
+                deleted=True,
+                template_fields={hostname: {"vlan": "310"}}
+            ),
+        ]
+        url = reverse("configuration:service_order_search")
+        self.client.force_authenticate(user=User.objects.get(username='api'))
+
+        def references(**params):
+            response = self.client.get(url, params, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return [order['reference'] for order in response.data]
+
+        self.assertEqual(
+            references(node=hostname, field="vlan", value="310"), ["TEST-0"]
+        )
+        self.assertEqual(
+            references(field="vlan", value="310"),
+            ["TEST-0", "TEST-1", "TEST-3"]
+        )
+        self.assertEqual(
+            references(field="cidr", value="10.1.2.0/30"), ["TEST-0"]
+        )
+        self.assertEqual(references(node=hostname), ["TEST-0", "TEST-2"])
+        self.assertEqual(references(node="none.node"), [])
+
+        response = self.client.get(url, {"field": "vlan"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            url, {"node": hostname, "page_size": 1}, format='json'
+        )
+        self.assertEqual(response.data['results'][0]['id'], orders[0].id)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_order_conflicts(self):
+        template = ResourceTemplate.objects.create(
+            name="vlan",
+            up_contents="vlan {{ vlan }} {{ prefix }}",
+            down_contents="no vlan {{ vlan }}",
+            fields={"vlan": "vlan", "prefix": "cidrv4"},
+            labels={"vlan": "Vlan", "prefix": "Prefix"},
+        )
+        rs = ResourceService.objects.create(defaults=[])
+        rs.resource_templates.add(template)
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+        Node.objects.create(
+            hostname="other.node",
+            group=Node.objects.get().group,
+            driver="none",
+            site=""
+        )
+        self.client.force_authenticate(user=User.objects.get(username='api'))
+        url = reverse("configuration:service_order_list")
+
+        def create(reference, node, vlan, prefix):
+            return self.client.post(url, {
+                "reference": reference,
+                "service": ser.id,
+                "template_fields": {
+                    node: {"vlan": vlan, "prefix": prefix}
+                },
+            }, format='json')
+
+        response = create("TEST-0", hostname, "310", "10.0.0.0/30")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = create("TEST-1", "other.node", "310", "10.0.0.0/30")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = create("TEST-2", hostname, "310", "10.0.0.4/30")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['template_fields'], [
+            "vlan 310 on test.node overlaps vlan 310 of order TEST-0"
+        ])
+        response = create("TEST-2", hostname, "311", "10.0.0.0/24")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("overlaps prefix 10.0.0.0/30", response.data['template_fields'][0])
+        response = create("TEST-2", hostname, "311", "10.0.0.1/32")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Updates are checked too, against every order but their own
+        order = ServiceOrder.objects.get(reference="TEST-1")
+        serializer = ServiceOrderSerializer(order, data={
+            "template_fields": {hostname: {"vlan": "310", "prefix": ""}}
+        }, partial=True)
+        self.assertTrue(serializer.is_valid())
+        with self.assertRaises(ValidationError):
+            serializer.save()
+        serializer = ServiceOrderSerializer(order, data={
+            "template_fields": {
+                "other.node": {"vlan": "310", "prefix": "10.0.0.0/30"}
+            }
+        }, partial=True)
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+
+        # Fields of resource services without a node apply to every node
+        self.assertEqual(
+            node_validators(
+                {"__NONODE__": {"vlan": "vlan"}, hostname: {"ip": "ipv4"}},
+                hostname
+            ),
+            {"vlan": "vlan", "ip": "ipv4"}
+        )
+
+        bulk_url = reverse("configuration:service_order_bulk")
+        orders = [
+            {
+                "reference": f"BULK-{index}",
+                "service": ser.id,
+                "template_fields": {hostname: {"vlan": vlan, "prefix": prefix}},
+            }
+            for index, (vlan, prefix) in enumerate([
+                ("320", "10.1.0.0/30"),
+                ("320", "10.1.0.4/30"),
+                ("321", "10.0.0.2/32"),
+                ("322", "10.1.0.8/30"),
+            ])
+        ]
+        response = self.client.post(bulk_url, orders, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        results = response.data['results']
+        self.assertIn("of order 0 in this batch", results[1]['errors']['template_fields'][0])
+        self.assertIn("of order TEST-0", results[2]['errors']['template_fields'][0])
+
+        # Orders saved directly skip validation, the audit reports them
+        ServiceOrder.objects.create(
+            reference="DIRECT",
+            service=ser,
+            template_fields={hostname: {"vlan": "322", "prefix": "10.2.0.0/30"}}
+        )
+        response = self.client.get(
+            reverse("configuration:service_order_conflicts"), format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['kind'], 'vlan')
+        self.assertEqual(
+            [order['reference'] for order in response.data[0]['orders']],
+            ["BULK-3", "DIRECT"]
+        )
+
+        ResourceUsage.objects.all().delete()
+        call_command('rebuild_resource_usage', stdout=io.StringIO())
+        self.assertEqual(ResourceUsage.objects.count(), 10)
+        self.assertEqual(
+            len(self.client.get(
+                reverse("configuration:service_order_conflicts")
+            ).data),
+            1
+        )
+
+    def test_allocation(self):
+        template = ResourceTemplate.objects.create(
+            name="vlan",
+            up_contents="vlan {{ vlan }} {{ prefix }}",
+            down_contents="no vlan {{ vlan }}",
+            fields={"vlan": "vlan", "prefix": "cidrv4"},
+            labels={"vlan": "Vlan", "prefix": "Prefix"},
+        )
+        rs = ResourceService.objects.create(defaults=[
+            {"field": "vlan", "default": "", "configurable": True,
+             "allocate": True},
+            {"field": "prefix", "default": "", "configurable": True,
+             "allocate": True},
+        ])
+        rs.resource_templates.add(template)
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+        self.client.force_authenticate(user=User.objects.get(username='api'))
+
+        pools_url = reverse("configuration:resource_pool_list")
+        response = self.client.post(pools_url, {
+            "validator": "vlan", "node": hostname, "first": 0, "last": 10,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(pools_url, {
+            "validator": "vlan", "node": hostname, "first": 100, "last": 102,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['size'], 3)
+        response = self.client.post(pools_url, {
+            "validator": "cidrv4", "site": "lab", "prefix": "10.0.0.0/29",
+            "prefix_length": 28,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        ResourcePool.objects.create(
+            validator="cidrv4", site="", prefix="10.0.0.0/29",
+            prefix_length=30
+        )
+
+        url = reverse("configuration:service_order_list")
+
+        def create(reference, values):
+            return self.client.post(url, {
+                "reference": reference,
+                "service": ser.id,
+                "template_fields": {hostname: values},
+            }, format='json')
+
+        response = create("TEST-0", {"vlan": "100", "prefix": "10.9.0.0/30"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = create("TEST-1", {})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            response.data['template_fields'][hostname],
+            {"vlan": "101", "prefix": "10.0.0.0/30"}
+        )
+        first = response.data['id']
+
+        response = self.client.post(
+            reverse("configuration:service_order_bulk"),
+            [
+                # Taken by TEST-0, so its vlan is given back to the pool
+                {
+                    "reference": "BULK-TAKEN",
+                    "service": ser.id,
+                    "template_fields": {
+                        hostname: {"vlan": "102", "prefix": "10.9.0.0/30"}
+                    },
+                }
+            ] + [
+                {
+                    "reference": f"BULK-{index}",
+                    "service": ser.id,
+                    "template_fields": {hostname: {}},
+                }
+                for index in range(2)
+            ],
+            format='json'
+        )
+        self.assertEqual(response.data['created'], 1)
+        results = response.data['results']
+        self.assertIn("overlaps", results[0]['errors']['template_fields'][0])
+        self.assertEqual(
+            ServiceOrder.objects.get(reference="BULK-0").template_fields,
+            {hostname: {"vlan": "102", "prefix": "10.0.0.4/30"}}
+        )
+        self.assertIn(
+            "No free vlan", results[2]['errors']['template_fields'][0]
+        )
+        self.assertEqual(ResourceAllocation.objects.count(), 4)
+
+        response = self.client.delete(
+            reverse("configuration:service_order_view", kwargs={'pk': first})
+        )
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(ResourceAllocation.objects.count(), 2)
+        response = create("TEST-2", {})
+        self.assertEqual(
+            response.data['template_fields'][hostname],
+            {"vlan": "101", "prefix": "10.0.0.0/30"}
+        )
+
+    def test_allocation_untracked(self):
+        """ ASNs and IPv6 prefixes given by hand are skipped as well """
+        template = ResourceTemplate.objects.create(
+            name="peer",
+            up_contents="peer {{ asn }} {{ prefix6 }}",
+            down_contents="no peer {{ asn }}",
+            fields={"asn": "asn", "prefix6": "cidrv6"},
+            labels={"asn": "ASN", "prefix6": "Prefix"},
+        )
+        rs = ResourceService.objects.create(defaults=[
+            {"field": "asn", "default": "", "configurable": True,
+             "allocate": True},
+            {"field": "prefix6", "default": "", "configurable": True,
+             "allocate": True},
+        ])
+        rs.resource_templates.add(template)
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+        ResourcePool.objects.create(
+            validator="asn", node_id=hostname, first=65000, last=65003
+        )
+        ResourcePool.objects.create(
+            validator="cidrv6", node_id=hostname,
+            prefix="2001:db8::100/125", prefix_length=127
+        )
+        self.client.force_authenticate(user=User.objects.get(username='api'))
+
+        response = self.client.post(
+            reverse("configuration:service_order_list"),
+            {
+                "reference": "TEST-0",
+                "service": ser.id,
+                "template_fields": {hostname: {
+                    "asn": "65000", "prefix6": "2001:db8::100/127"
+                }},
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.post(
+            reverse("configuration:service_order_bulk"),
+            [
+                {
+                    "reference": "BULK-0",
+                    "service": ser.id,
+                    "template_fields": {hostname: {}},
+                },
+                {
+                    "reference": "BULK-1",
+                    "service": ser.id,
+                    "template_fields": {hostname: {
+                        "asn": "65001", "prefix6": "2001:db8::102/127"
+                    }},
+                },
+            ],
+            format='json'
+        )
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            ServiceOrder.objects.get(reference="BULK-0").template_fields,
+            {hostname: {"asn": "65002", "prefix6": "2001:db8::104/127"}}
+        )
+        self.assertEqual(
+            ResourceUsage.objects.filter(kind__in=['asn', 'ipv6']).count(), 6
+        )
+
+        # Orders may share an ASN, stored or not it is no conflict
+        response = self.client.post(
+            reverse("configuration:service_order_list"),
+            {
+                "reference": "TEST-1",
+                "service": ser.id,
+                "template_fields": {hostname: {"asn": "65000"}},
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            response.data['template_fields'][hostname]['prefix6'],
+            "2001:db8::106/127"
+        )
+        response = self.client.get(
+            reverse("configuration:service_order_conflicts")
+        )
+        self.assertEqual(response.data, [])
+
+    def test_config_snapshots(self):
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[]
+        )
+        rs.resource_templates.add(ResourceTemplate.objects.get())
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+        orders = [
+            ServiceOrder.objects.create(
+                reference=f"TEST-{index}",
+                service=ser,
+                template_fields={hostname: {"place": "Oslo", "day": "Monday"}}
+            )
+            for index in range(2)
+        ]
+        order = orders[0]
+        self.client.force_authenticate(user=User.objects.get(username='api'))
+        url = reverse(
+            "configuration:service_config_view", kwargs={"pk": order.id}
+        )
+        self.client.get(url, format='json')
+        self.client.post(
+            reverse("configuration:service_config_batch_view"),
+            {"orders": [orders[1].id]},
+            format='json'
+        )
+        self.assertEqual(ConfigSnapshot.objects.count(), 2)
+        # Both orders render the same texts
+        self.assertEqual(ConfigBlob.objects.count(), 2)
+
+        # Configs are only cached along with their snapshots, so a
+        # stream closed before the end of a chunk renders them again
+        order.save()
+        orders[1].save()
+        service_orders = list(prefetch_service_orders(
+            ServiceOrder.objects.filter(pk__in=[order.id, orders[1].id])
+        ))
+        stream = render_service_orders(service_orders)
+        next(stream)
+        stream.close()
+        rendered = []
+        cached_service_config(service_orders[0], rendered=rendered)
+        self.assertEqual(len(rendered), 1)
+
+        # A new render with the same output adds nothing
+        order.save()
+        self.client.get(url, format='json')
+        self.assertEqual(ConfigSnapshot.objects.count(), 2)
+
+        order.template_fields[hostname]['place'] = "Bergen"
+        order.save()
+        self.client.get(url, format='json')
+        self.assertEqual(ConfigBlob.objects.count(), 4)
+
+        response = self.client.get(reverse(
+            "configuration:service_config_history", kwargs={"pk": order.id}
+        ))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        new, old = response.data
+        self.assertEqual(new['nodes'], [hostname])
+
+        response = self.client.get(reverse(
+            "configuration:config_snapshot_view", kwargs={"pk": old['id']}
+        ))
+        self.assertIn("Hello Oslo", response.data['config'][0]['service_up'])
+
+        response = self.client.get(reverse(
+            "configuration:config_snapshot_diff",
+            kwargs={"pk": old['id'], "other": new['id']}
+        ))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        diff = response.data['nodes'][0]
+        self.assertEqual(diff['node'], hostname)
+        self.assertIn("-We start by saying Hello Oslo.", diff['service_up'])
+        self.assertIn("+We start by saying Hello Bergen.", diff['service_up'])
+        self.assertIn("+Goodbye, Bergen", diff['service_down'])
+        self.assertNotIn("+Have a nice Monday", diff['service_down'])
+
+        response = self.client.get(reverse(
+            "configuration:config_snapshot_diff",
+            kwargs={"pk": new['id'], "other": new['id']}
+        ))
+        self.assertEqual(response.data['nodes'], [])
+
+        # The history outlives the order
+        order.delete()
+        snapshot = ConfigSnapshot.objects.get(pk=old['id'])
+        self.assertIsNone(snapshot.order)
+        self.assertEqual(snapshot.reference, "TEST-0")
+
+    def test_malformed_stored_template(self):
+        """ Templates saved before their syntax was checked don't 500 """
+        template = ResourceTemplate.objects.get()
+        ResourceTemplate.objects.filter(pk=template.pk).update(
+            up_contents="{{#place}} unclosed {{ day }}",
+            tags=None
+        )
+        rs = ResourceService.objects.create(
+            node=Node.objects.get(),
+            defaults=[]
+        )
+        rs.resource_templates.add(template)
+        ser = Service.objects.create(name="A service")
+        ser.resource_services.add(rs)
+        hostname = Node.objects.get().hostname
+        order = ServiceOrder.objects.create(
+            reference="TEST-malformed",
+            service=ser,
+            template_fields={hostname: {"day": "Monday", "place": "Oslo"}}
+        )
+        self.client.force_authenticate(user=User.objects.get(username='api'))
+
+        response = self.client.get(reverse(
+            "configuration:service_config_view", kwargs={"pk": order.id}
+        ))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            reverse("configuration:service_config_batch_view"),
+            {"orders": [order.id]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('error', response.data[0])
+
+        response = self.client.get(reverse(
+            "configuration:node_config_stream", kwargs={"hostname": hostname}
+        ))
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertIn('error', json.loads(lines[0]))
+
+        response = self.client.get(reverse(
+            "configuration:quicktemplate_view", kwargs={"pk": template.pk}
+        ))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.patch(
+            reverse(
+                "configuration:resource_template_view",
+                kwargs={"pk": template.pk}
+            ),
+            {"name": "renamed"},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.data), ['up_contents'])
+
+        # The error is reported under the direction that fails to parse
+        ResourceTemplate.objects.filter(pk=template.pk).update(
+            up_contents="{{ day }}",
+            down_contents="{{/place}}",
+            tags=None
+        )
+        response = self.client.patch(
+            reverse(
+                "configuration:resource_template_view",
+                kwargs={"pk": template.pk}
+            ),
+            {"name": "renamed"},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.data), ['down_contents'])
@@ -1,7 +1,8 @@
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
-from configuration.models import ResourceTemplate
+from configuration.models import ResourceService, ResourceTemplate
+from configuration.mustache import template_cache
 from django.contrib.auth.models import User
 
 
@@ -171,3 +172,168 @@ Something {{ variable }}"""
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('template', response.data)
         self.assertEqual('Here is a template.\nIt contains a Foo', response.data['template'])
+
+        ResourceTemplate.objects.update(fields={"variable": "none"})
+        response = self.client.post(url, {"fields": {}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            'Here is a template.\nIt contains a ', response.data['template']
+        )
+
+    def test_template_tags_persisted(self):
+        """ Tags are stored on save and only reparsed on content change """
+        self.test_update_fieldset()
+        template = ResourceTemplate.objects.get()
+        self.assertEqual(template.tags['up']['all_tags'], ['variable'])
+        self.assertIsNotNone(template.content_hash)
+        content_hash = template.content_hash
+
+        url = reverse("configuration:resource_template_view", kwargs={
+            "pk": template.id
+        })
+        response = self.client.patch(url, {"name": "renamed"}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        template = ResourceTemplate.objects.get()
+        self.assertEqual(template.content_hash, content_hash)
+        self.assertEqual(template.fields['variable'], 'string')
+
+        template_cache.clear()
+        quick_url = reverse("configuration:quicktemplate_view", kwargs={
+            "pk": template.id
+        })
+        response = self.client.get(quick_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(template_cache.stats()['misses'], 0)
+
+        response = self.client.patch(
+            url, {"up_contents": "{{ other }}"}, format='json'
+        )
+        template = ResourceTemplate.objects.get()
+        self.assertNotEqual(template.content_hash, content_hash)
+        self.assertEqual(template.tags['up']['all_tags'], ['other'])
+        self.assertEqual(sorted(template.fields.keys()), ['other', 'variable'])
+
+    def test_update_related_rs(self):
+        """ Resource service defaults follow the template fields """
+        self.test_update_template()
+        template = ResourceTemplate.objects.get()
+        rs = ResourceService.objects.create(
+            defaults=[
+                {"field": "var1", "default": "one", "configurable": False},
+                {"field": "gone", "default": "x", "configurable": True},
+            ]
+        )
+        rs.resource_templates.add(template)
+        other = ResourceService.objects.create(defaults=[])
+
+        url = reverse("configuration:resource_template_view", kwargs={
+            "pk": template.id
+        })
+        data = {"up_contents": "{{ var1 }} {{ var4 }}"}
+        response = self.client.patch(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rs.refresh_from_db()
+        self.assertEqual(rs.defaults, {
+            "var1": {"default": "one", "configurable": False},
+            "var4": {"default": None, "configurable": True},
+        })
+        other.refresh_from_db()
+        self.assertEqual(other.defaults, {})
+
+        data = {"up_contents": "{{ var5 }}"}
+        with self.settings(VICONF_JOBS_EAGER=True):
+            response = self.client.patch(
+                url + "?background=true", data, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = self.client.get(response['Location'])
+        self.assertEqual(job.status_code, status.HTTP_200_OK)
+        self.assertEqual(job.data['status'], 'done')
+        self.assertEqual(job.data['result'], 1)
+        rs.refresh_from_db()
+        self.assertEqual(
+            list(rs.defaults), ['var5']
+        )
+
+        missing = reverse("configuration:job_view", kwargs={"job_id": "x"})
+        self.assertEqual(
+            self.client.get(missing).status_code, status.HTTP_404_NOT_FOUND
+        )
+
+    def test_update_fieldset_validates_first(self):
+        """ An invalid field leaves the whole fieldset unchanged """
+        self.test_update_template()
+        template = ResourceTemplate.objects.get()
+        fieldset_url = reverse(
+            'configuration:resource_template_fieldset',
+            kwargs={"pk": template.id}
+        )
+        fieldset = {
+            "resource_fieldset": [
+                {"name": "var1", "validator": "vlan", "label": "Vlan"},
+                {"name": "var3", "validator": "nope", "label": "Var 3"},
+                {"name": "var9", "validator": "string", "label": "Var 9"},
+            ]
+        }
+        response = self.client.post(fieldset_url, fieldset, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, [
+            "var3 has unknown validator nope",
+            "var9 not in template",
+        ])
+        self.assertEqual(ResourceTemplate.objects.get().fields, template.fields)
+
+        # Fetch and write
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                fieldset_url,
+                {"resource_fieldset": fieldset["resource_fieldset"][:1]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ResourceTemplate.objects.get().fields['var1'], 'vlan')
+
+    def test_update_fieldset_batch(self):
+        self.test_update_template()
+        first = ResourceTemplate.objects.get()
+        second = ResourceTemplate.objects.create(
+            name="second",
+            up_contents="{{ other }}",
+            down_contents="",
+            fields={"other": "string"},
+            labels={"other": "Other"},
+        )
+        url = reverse('configuration:resource_template_fieldset_batch')
+        data = {
+            "templates": [
+                {
+                    "resource_template_id": first.id,
+                    "resource_fieldset": [
+                        {"name": "var1", "validator": "vlan", "label": "V"},
+                    ]
+                },
+                {
+                    "resource_template_id": second.id,
+                    "resource_fieldset": [
+                        {"name": "other", "validator": "asn", "label": "AS"},
+                    ]
+                },
+            ]
+        }
+        bad = {"templates": data["templates"] + [{
+            "resource_template_id": 0,
+            "resource_fieldset": [],
+        }]}
+        response = self.client.post(url, bad, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {"0": ["Unknown template 0"]})
+        self.assertEqual(ResourceTemplate.objects.get(pk=second.id).fields,
+                         {"other": "string"})
+
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(ResourceTemplate.objects.get(pk=first.id).fields,
+                         {"var1": "vlan", "var3": "none"})
+        second.refresh_from_db()
+        self.assertEqual(second.fields, {"other": "asn"})
+        self.assertEqual(second.labels, {"other": "AS"})
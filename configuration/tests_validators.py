@@ -0,0 +1,93 @@
+""" Test the validators """
+
+from django.test import SimpleTestCase
+from configuration.validators import ViconfValidators, ViconfValidationError
+
+
+class ValidatorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vival = ViconfValidators()
+
+    def test_validators_compiled(self):
+        self.assertEqual(
+            set(ViconfValidators.COMPILED.keys()),
+            set(ViconfValidators.VALIDATORS.keys())
+        )
+
+    def test_validate(self):
+        self.assertTrue(self.vival.validate('ipv4', '10.0.0.1'))
+        self.assertFalse(self.vival.validate('ipv4', '10.0.0.256'))
+        self.assertTrue(self.vival.validate('vlan', '100'))
+        self.assertTrue(self.vival.validate('vlan', 100))
+        self.assertFalse(self.vival.validate('vlan', '0'))
+        self.assertFalse(self.vival.validate('vlan', 'foo'))
+        self.assertFalse(self.vival.validate('string', None))
+        self.assertTrue(self.vival.validate('none', None))
+
+    def test_validate_column(self):
+        """ Whole columns agree with checking one value at a time """
+        columns = {
+            'ipv4': ['10.0.0.1', '10.0.0.256', '', '10.0.0.2', '10.0.0.1x',
+                     '10.0.0.3\n', None],
+            'string': ['foo', 'a b', '', 'bar'],
+            'cidrv6': ['2001:db8::/64', '2001:db8::', '::1/128'],
+            'vlan': ['100', 100, '0', '5000', 'foo', None, '4093'],
+            'none': [None, 'x'],
+        }
+        for validator, testers in columns.items():
+            compiled = ViconfValidators.COMPILED[validator]
+            for column in (testers, testers[:-1], testers[::-1], []):
+                self.assertEqual(
+                    compiled.validate_column(column),
+                    [compiled(tester) for tester in column]
+                )
+
+    def test_unknown_validator(self):
+        with self.assertRaises(ViconfValidationError):
+            self.vival.validate('foo', 'bar')
+
+    def test_validate_many(self):
+        fields = {
+            'vlan': 'vlan',
+            'address': 'ipv4',
+            'prefix': 'cidrv4',
+            'name': 'string',
+        }
+        values = {
+            'vlan': '5000',
+            'address': '10.0.0.1',
+            'prefix': '10.0.0.0',
+        }
+        errors = self.vival.validate_many(fields, values)
+
+        self.assertEqual(set(errors.keys()), {'vlan', 'prefix', 'name'})
+        self.assertEqual(errors['vlan'], "vlan is not a valid vlan")
+        self.assertEqual(
+            self.vival.validate_many(fields, {
+                'vlan': '10',
+                'address': '10.0.0.1',
+                'prefix': '10.0.0.0/30',
+                'name': 'foo',
+            }),
+            {}
+        )
+
+    def test_validate_rows(self):
+        fields = {'inner': 'vlan', 'outer': 'vlan', 'address': 'ipv4'}
+        rows = [
+            {'inner': '10', 'outer': '20', 'address': '10.0.0.1'},
+            {'inner': '5000', 'outer': '20'},
+            {'inner': '10', 'outer': 'x', 'address': 'foo'},
+        ]
+        report = self.vival.validate_rows(fields, rows)
+
+        self.assertEqual(list(report.keys()), [1, 2])
+        self.assertEqual(report[1], {'inner': "inner is not a valid vlan"})
+        self.assertEqual(set(report[2].keys()), {'outer', 'address'})
+
+        report = self.vival.validate_rows(fields, rows, required={'address'})
+        self.assertEqual(report[1], {
+            'inner': "inner is not a valid vlan",
+            'address': "address is required",
+        })
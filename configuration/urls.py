@@ -1,5 +1,13 @@
 from django.urls import path
-from configuration.views import node, services, user
+from configuration.views import (
+    asynchronous,
+    jobs,
+    node,
+    pools,
+    services,
+    snapshots,
+    user,
+)
 
 app_name = 'configuration'
 
@@ -29,6 +37,11 @@ urlpatterns = [
         node.NodeView.as_view(),
         name="nodeview",
     ),
+    path(
+        "nodes/<str:hostname>/config/stream/",
+        node.NodeConfigStreamView.as_view(),
+        name="node_config_stream",
+    ),
     path(
         "groups/",
         node.GroupList.as_view(),
@@ -54,6 +67,11 @@ urlpatterns = [
         services.ResourceTemplateFieldsetView.as_view(),
         name="resource_template_fieldset",
     ),
+    path(
+        "templates/fields/batch/",
+        services.ResourceTemplateFieldsetBatchView.as_view(),
+        name="resource_template_fieldset_batch",
+    ),
     path(
         "templates/<int:pk>/quick/",
         services.QuickTemplateView.as_view(),
@@ -84,11 +102,31 @@ urlpatterns = [
         services.ServiceSchemaView.as_view(),
         name="service_schema_view"
     ),
+    path(
+        "services/<int:pk>/schema/async/",
+        asynchronous.service_schema_view,
+        name="service_schema_async_view"
+    ),
     path(
         "orders/",
         services.ServiceOrderList.as_view(),
         name="service_order_list",
     ),
+    path(
+        "orders/search/",
+        services.ServiceOrderSearchView.as_view(),
+        name="service_order_search",
+    ),
+    path(
+        "orders/conflicts/",
+        services.ServiceOrderConflictView.as_view(),
+        name="service_order_conflicts",
+    ),
+    path(
+        "orders/bulk/",
+        services.ServiceOrderBulkView.as_view(),
+        name="service_order_bulk",
+    ),
     path(
         "orders/<int:pk>/",
         services.ServiceOrderView.as_view(),
@@ -99,5 +137,45 @@ urlpatterns = [
         services.ServiceConfigView.as_view(),
         name="service_config_view",
     ),
+    path(
+        "orders/<int:pk>/config/async/",
+        asynchronous.service_config_view,
+        name="service_config_async_view",
+    ),
+    path(
+        "orders/<int:pk>/config/history/",
+        snapshots.ServiceConfigHistoryView.as_view(),
+        name="service_config_history",
+    ),
+    path(
+        "config/snapshots/<int:pk>/",
+        snapshots.ConfigSnapshotView.as_view(),
+        name="config_snapshot_view",
+    ),
+    path(
+        "config/snapshots/<int:pk>/diff/<int:other>/",
+        snapshots.ConfigSnapshotDiffView.as_view(),
+        name="config_snapshot_diff",
+    ),
+    path(
+        "orders/config/batch/",
+        services.ServiceConfigBatchView.as_view(),
+        name="service_config_batch_view",
+    ),
+    path(
+        "pools/",
+        pools.ResourcePoolList.as_view(),
+        name="resource_pool_list",
+    ),
+    path(
+        "pools/<int:pk>/",
+        pools.ResourcePoolView.as_view(),
+        name="resource_pool_view",
+    ),
+    path(
+        "jobs/<str:job_id>/",
+        jobs.JobView.as_view(),
+        name="job_view",
+    ),
 
 ]
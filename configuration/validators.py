@@ -1,10 +1,112 @@
 import re
 
+from configuration.metrics import timed
+
 
 class ViconfValidationError(Exception):
     pass
 
 
+class NoValidator(object):
+    """ Accepts anything """
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.error = spec.get('error')
+
+    def __call__(self, tester):
+        return True
+
+    def validate_column(self, testers):
+        """ Validate a list of values, returning a list of booleans """
+        return [True] * len(testers)
+
+
+class RegexValidator(NoValidator):
+    """Matches a string against a regex compiled once
+
+    Columns are matched in one pass over the values joined by newlines,
+    which none of the patterns match. Each repetition of the column
+    pattern takes one whole line, so the match ends at the first invalid
+    value, which is checked on its own before matching on from the next.
+    """
+
+    def __init__(self, name, spec):
+        super().__init__(name, spec)
+        self.regex = re.compile(spec['regex'])
+        self.column = re.compile(
+            r'(?:(?:%s)[^\n]*\n)*' % spec['regex'], re.MULTILINE
+        )
+
+    def __call__(self, tester):
+        if not isinstance(tester, str):
+            return False
+        return self.regex.match(tester) is not None
+
+    def validate_column(self, testers):
+        if not all(isinstance(tester, str) and '\n' not in tester
+                   for tester in testers):
+            return [self(tester) for tester in testers]
+
+        text = "\n".join(testers) + "\n"
+        results = []
+        offset = 0
+        while len(results) < len(testers):
+            end = self.column.match(text, offset).end()
+            results += [True] * text.count("\n", offset, end)
+            offset = end
+            if len(results) < len(testers):
+                tester = testers[len(results)]
+                results.append(self(tester))
+                offset += len(tester) + 1
+
+        return results
+
+
+class RangeValidator(NoValidator):
+    """ Checks that an integer is within start (inclusive) and end """
+
+    def __init__(self, name, spec):
+        super().__init__(name, spec)
+        self.start = spec['start']
+        self.end = spec['end']
+
+    def __call__(self, tester):
+        try:
+            number = int(tester)
+        except (TypeError, ValueError):
+            return False
+
+        return self.start <= number < self.end
+
+    def validate_column(self, testers):
+        try:
+            numbers = list(map(int, testers))
+        except (TypeError, ValueError):
+            return [self(tester) for tester in testers]
+
+        if not numbers or (min(numbers) >= self.start and
+                           max(numbers) < self.end):
+            return [True] * len(numbers)
+        start, end = self.start, self.end
+        return [start <= number < end for number in numbers]
+
+
+VALIDATOR_TYPES = {
+    'novalidation': NoValidator,
+    'regex': RegexValidator,
+    'range': RangeValidator,
+}
+
+
+def compile_validators(validators):
+    """ Turn validator definitions into callables """
+    return {
+        name: VALIDATOR_TYPES[spec['type']](name, spec)
+        for name, spec in validators.items()
+    }
+
+
 class ViconfValidators(object):
     VALIDATORS = {
         'none': {'description': 'No validation',
@@ -73,29 +175,72 @@ class ViconfValidators(object):
                  'type': 'range'}
     }
 
+    COMPILED = compile_validators(VALIDATORS)
+
+    def get_validator(self, validator):
+        try:
+            return self.COMPILED[validator]
+        except KeyError:
+            raise ViconfValidationError(f"Unknown validator {validator}")
+
+    @timed('validate')
     def validate(self, validator, tester):
-        if validator not in self.VALIDATORS:
-            raise "Unknown validator"
-        validator = self.VALIDATORS[validator]
-        if validator['type'] == 'regex':
-            regex = re.compile(validator['regex'])
-            if regex.match(tester):
-                return True
-            else:
-                return False
-        elif validator['type'] == 'range':
-            try:
-                number = int(tester)
-            except ValueError:
-                return False
-
-            ran = range(validator['start'], validator['end'])
-            if number in ran:
-                return True
-            else:
-                return False
-        else:
-            return True
+        return self.get_validator(validator)(tester)
+
+    @timed('validate')
+    def validate_many(self, fields, values):
+        """Validate values against a dict of field to validator name.
+
+        Returns a dict of field to error message for every field that
+        fails, which is empty if all fields are valid.
+        """
+        errors = {}
+        for field, validator in fields.items():
+            if not self.get_validator(validator)(values.get(field)):
+                errors[field] = f"{field} is not a valid {validator}"
+
+        return errors
+
+    @timed('validate')
+    def validate_rows(self, fields, rows, required=()):
+        """Validate many rows of values against a dict of field to
+        validator name, checking the column of each field over all rows
+        at once.
+
+        Fields in required that a row lacks or leaves empty are reported
+        as missing, other fields missing from a row are not validated.
+        Returns a dict of row index to a dict of field to error message,
+        for failing rows only.
+        """
+        report = {}
+        missing = {}
+        for field in fields:
+            if field not in required:
+                continue
+            missing[field] = {
+                index for index, row in enumerate(rows)
+                if row.get(field) in (None, '')
+            }
+            for index in missing[field]:
+                report.setdefault(index, {})[field] = f"{field} is required"
+
+        for field, validator in fields.items():
+            compiled = self.get_validator(validator)
+            skipped = missing.get(field, ())
+            indexes = [
+                index for index, row in enumerate(rows)
+                if field in row and index not in skipped
+            ]
+            results = compiled.validate_column(
+                [rows[index][field] for index in indexes]
+            )
+            for index, valid in zip(indexes, results):
+                if not valid:
+                    report.setdefault(index, {})[field] = (
+                        f"{field} is not a valid {validator}"
+                    )
+
+        return dict(sorted(report.items()))
 
     def test(self, validator, tester):
         if self.validate(validator, tester):
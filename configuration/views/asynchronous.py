@@ -0,0 +1,168 @@
+"""Async variants of the config and schema views for ASGI servers
+
+DRF views are synchronous, so these are plain Django async views doing
+the JWT authentication themselves. Database access runs through
+sync_to_async and rendering in the bounded render thread pool, so the
+event loop is never blocked by either.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from configuration.constants import CONFIG_CACHE_TIMEOUT
+from configuration.helpers import (
+    cache_service_schema,
+    config_cache,
+    fetch_order_nodes,
+    generate_service_config,
+    get_cached_service_schema,
+    prefetch_service_orders,
+    prefetch_services,
+    query_service_order_config_key,
+    query_service_schema_key,
+)
+from configuration.metrics import timed, timed_queries
+from configuration.models import Service, ServiceOrder
+from configuration.mustache import ViconfMustacheTagException
+from configuration.serializers.resources import ConfigurationSerializer
+from configuration.snapshots import record_snapshots
+from configuration.validators import ViconfValidationError
+from configuration.workers import run_in_render_pool
+
+
+def error_response(detail, status):
+    """ An error response shaped like the DRF ones """
+    if not isinstance(detail, (dict, list)):
+        detail = {'detail': detail}
+    return JsonResponse(detail, status=status, safe=False)
+
+
+def authenticate(request):
+    """ Return the user of a valid JWT in the request, or None """
+    result = JWTAuthentication().authenticate(request)
+    return result[0] if result is not None else None
+
+
+def async_api_view(methods):
+    """Allow the given methods to JWT authenticated users, like the
+    DRF views with IsAuthenticated and JWTAuthentication"""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                response = error_response(
+                    f'Method "{request.method}" not allowed.', 405
+                )
+                response['Allow'] = ", ".join(methods)
+                return response
+
+            try:
+                user = await sync_to_async(authenticate)(request)
+            except AuthenticationFailed as e:
+                user = None
+                detail = e.detail
+            else:
+                detail = "Authentication credentials were not provided."
+            if user is None:
+                response = error_response(detail, 401)
+                response['WWW-Authenticate'] = (
+                    JWTAuthentication().authenticate_header(request)
+                )
+                return response
+
+            request.user = user
+            try:
+                return await view(request, *args, **kwargs)
+            except Http404:
+                return error_response("Not found.", 404)
+
+        return wrapper
+    return decorator
+
+
+def load_service_order(pk):
+    """Return the config cache key of a service order and either its
+    cached config or the prefetched order and its nodes"""
+    with timed_queries():
+        key = query_service_order_config_key(pk)
+        if key is not None:
+            data = config_cache().get(key)
+            if data is not None:
+                return key, data, None, None
+
+        service_order = get_object_or_404(
+            prefetch_service_orders(ServiceOrder.objects.all()),
+            pk=pk
+        )
+        return key, None, service_order, fetch_order_nodes([service_order])
+
+
+def render_service_order(service_order, nodes):
+    with timed('config'):
+        return generate_service_config(service_order, nodes=nodes)
+
+
+def store_service_config(key, service_order, data):
+    with timed_queries():
+        record_snapshots([(service_order, data)])
+    if key is not None:
+        config_cache().set(key, data, timeout=CONFIG_CACHE_TIMEOUT)
+
+
+@async_api_view(methods=('GET',))
+async def service_config_view(request, pk):
+    """ Fetch config for a service Order """
+    key, data, service_order, nodes = await sync_to_async(
+        load_service_order
+    )(pk)
+    if data is None:
+        try:
+            data = await run_in_render_pool(
+                render_service_order, service_order, nodes
+            )
+        except (ViconfValidationError, ViconfMustacheTagException) as e:
+            return error_response([str(e)], 400)
+        await sync_to_async(store_service_config)(key, service_order, data)
+
+    return JsonResponse(
+        ConfigurationSerializer(data, many=True).data, safe=False
+    )
+
+
+def load_cached_schema(pk):
+    """ Return the schema cache key of a service and its cached schema """
+    with timed_queries():
+        key = query_service_schema_key(pk)
+    if key is None:
+        raise Http404
+    return key, get_cached_service_schema(key)
+
+
+def load_service(pk):
+    with timed_queries():
+        return get_object_or_404(
+            prefetch_services(Service.objects.all()),
+            pk=pk
+        )
+
+
+@async_api_view(methods=('GET',))
+async def service_schema_view(request, pk):
+    """ Retrieve a schema for a service that matches a ServiceOrder view"""
+    key, cached = await sync_to_async(load_cached_schema)(pk)
+    if cached is None:
+        service = await sync_to_async(load_service)(pk)
+        cached = await run_in_render_pool(cache_service_schema, service, key)
+
+    etag = f'"{cached["etag"]}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(cached['schema'])
+    response['ETag'] = etag
+
+    return response
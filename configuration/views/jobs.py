@@ -0,0 +1,21 @@
+""" Status of background jobs """
+from django.http import Http404
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from configuration.jobs import get_job
+
+
+class JobView(APIView):
+    """ Retrieve the status of a background job """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request, job_id, format=None):
+        job = get_job(job_id)
+        if job is None:
+            raise Http404
+
+        return Response(job)
@@ -0,0 +1,34 @@
+""" Prometheus metrics served by the application itself """
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.permissions import BasePermission
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from configuration.constants import METRICS_ALLOWED_IPS
+from configuration.metrics import render_prometheus
+from configuration.mustache import template_cache
+
+
+class IsAuthenticatedOrAllowedIP(BasePermission):
+    """Allow authenticated users, and scrapers connecting from the
+    addresses in VICONF_METRICS_ALLOWED_IPS"""
+
+    def has_permission(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return True
+        allowed = getattr(
+            settings, 'VICONF_METRICS_ALLOWED_IPS', METRICS_ALLOWED_IPS
+        )
+        return request.META.get('REMOTE_ADDR') in allowed
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAuthenticatedOrAllowedIP]
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request, format=None):
+        return HttpResponse(
+            render_prometheus(template_cache.stats()),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
@@ -1,6 +1,11 @@
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework.response import Response
 from rest_framework import status
 
+from configuration.mustache import content_hash
+
 
 class SafeDestroyModelMixin:
     """ set deleted instead of deleting the object """
@@ -13,3 +18,118 @@ class SafeDestroyModelMixin:
     def perform_destroy(self, instance):
         instance.deleted = True
         instance.save()
+
+
+class ConditionalGetMixin:
+    """Send ETag and Last-Modified headers computed from the count and
+    latest modified timestamp of the rows, and answer conditional GETs
+    with 304 Not Modified before serializing anything.
+
+    etag_dependencies lists the models nested in the serialized output
+    as (model, lookup) pairs, lookup being the relation from the model to
+    the rows of the view. Only the rows related to the view are counted,
+    so changing them changes the ETag while unrelated edits don't. The
+    count is taken over the joined relation, so linking or unlinking rows
+    changes it as well.
+    """
+    etag_dependencies = []
+
+    def get_etag_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        if lookup_url_kwarg in self.kwargs:
+            queryset = queryset.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+            )
+        return queryset
+
+    def get_conditional_state(self):
+        """ Return the etag and last modified time, None if no rows """
+        queryset = self.get_etag_queryset()
+        querysets = [queryset]
+        querysets += [
+            model.objects.filter(**{
+                f'{lookup}__in': queryset.order_by().values('pk')
+            })
+            for model, lookup in self.etag_dependencies
+        ]
+
+        state = []
+        for queryset in querysets:
+            aggregate = queryset.order_by().aggregate(
+                count=Count('pk'),
+                modified=Max('modified')
+            )
+            state.append(aggregate)
+
+        if state[0]['count'] == 0:
+            return None, None
+
+        last_modified = max(
+            item['modified'] for item in state if item['modified'] is not None
+        )
+        etag = content_hash("|".join(
+            [self.request.get_full_path()] +
+            [f"{item['count']}:{item['modified']}" for item in state]
+        ))
+
+        return f'"{etag}"', last_modified.timestamp()
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_conditional_state()
+        if etag is None:
+            return super().get(request, *args, **kwargs)
+
+        response = get_conditional_response(
+            request,
+            etag=etag,
+            last_modified=int(last_modified)
+        )
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+
+class SparseFieldsetMixin:
+    """Only serialize the comma separated fields given in ?fields=
+
+    field_prefetches maps a serializer field to the lookups it needs
+    prefetched, which are only prefetched when the field is serialized.
+    """
+    field_prefetches = {}
+
+    def requested_fields(self):
+        """ The requested fields, or None to serialize all of them """
+        requested = self.request.query_params.get('fields')
+        if self.request.method != 'GET' or not requested:
+            return None
+        return set(requested.split(','))
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        wanted = self.requested_fields()
+        lookups = [
+            lookup
+            for field, field_lookups in self.field_prefetches.items()
+            if wanted is None or field in wanted
+            for lookup in field_lookups
+        ]
+        if lookups:
+            queryset = queryset.prefetch_related(*lookups)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        wanted = self.requested_fields()
+        if wanted is None:
+            return serializer
+
+        target = getattr(serializer, 'child', serializer)
+        for name in list(target.fields.keys()):
+            if name not in wanted:
+                target.fields.pop(name)
+
+        return serializer
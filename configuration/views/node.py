@@ -1,30 +1,90 @@
 """ This is views for the node/group model """
 
+import json
 
-from configuration.models import Node, Group
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from configuration.helpers import (
+    filter_orders_by_node,
+    prefetch_service_orders,
+    render_service_orders,
+)
+from configuration.models import Node, Group, ServiceOrder
 from configuration.serializers import NodeSerializer, GroupSerializer
 from rest_framework import generics
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from .mixins import ConditionalGetMixin, SparseFieldsetMixin
+from configuration.pagination import ViconfCursorPagination
 
 
-class NodeList(generics.ListCreateAPIView):
-    queryset = Node.objects.all()
+class NodeList(ConditionalGetMixin, SparseFieldsetMixin,
+               generics.ListCreateAPIView):
+    queryset = Node.objects.select_related('group').all()
     serializer_class = NodeSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    pagination_class = ViconfCursorPagination
+    cursor_ordering_fields = ('hostname', 'modified')
+    etag_dependencies = [(Group, 'node')]
     lookup_field = "hostname"
 
 
-class NodeView(generics.RetrieveUpdateDestroyAPIView):
+class NodeView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Node.objects.all()
     serializer_class = NodeSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    etag_dependencies = [(Group, 'node')]
     lookup_field = "hostname"
 
 
-class GroupList(generics.ListCreateAPIView):
+class NodeConfigStreamView(APIView):
+    """Stream the config of every active order touching a node as
+    newline delimited JSON"""
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    chunk_size = 100
+
+    def get(self, request, hostname, format=None):
+        node = get_object_or_404(Node, hostname=hostname)
+        order_ids = list(
+            filter_orders_by_node(
+                ServiceOrder.objects.filter(deleted=False),
+                node.hostname
+            ).order_by('id').values_list('id', flat=True)
+        )
+
+        return StreamingHttpResponse(
+            self.stream(node, order_ids),
+            content_type='application/x-ndjson'
+        )
+
+    def stream(self, node, order_ids):
+        templates = {}
+        for index in range(0, len(order_ids), self.chunk_size):
+            chunk = order_ids[index:index + self.chunk_size]
+            service_orders = list(prefetch_service_orders(
+                ServiceOrder.objects.filter(pk__in=chunk).order_by('id')
+            ))
+            for result in render_service_orders(service_orders, templates):
+                line = {
+                    "id": result["id"],
+                    "reference": result["reference"],
+                    "node": node.hostname,
+                }
+                if "error" in result:
+                    line["error"] = result["error"]
+                else:
+                    for config in result["config"]:
+                        if config["node"] == node.hostname:
+                            line["service_up"] = config["service_up"]
+                            line["service_down"] = config["service_down"]
+                yield json.dumps(line) + "\n"
+
+
+class GroupList(ConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = [IsAuthenticated]
@@ -32,7 +92,7 @@ class GroupList(generics.ListCreateAPIView):
     lookup_field = "name"
 
 
-class GroupView(generics.RetrieveUpdateDestroyAPIView):
+class GroupView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
     permission_classes = [IsAuthenticated]
@@ -0,0 +1,25 @@
+""" Resource pools the fields of new service orders are allocated from """
+from rest_framework import generics
+from rest_framework.permissions import IsAuthenticated
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from configuration.models import ResourcePool
+from configuration.pagination import ViconfCursorPagination
+from configuration.serializers.resources import ResourcePoolSerializer
+
+
+class ResourcePoolList(generics.ListCreateAPIView):
+    queryset = ResourcePool.objects.all()
+    serializer_class = ResourcePoolSerializer
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    pagination_class = ViconfCursorPagination
+
+
+class ResourcePoolView(generics.RetrieveDestroyAPIView):
+    """A pool can't be resized once values were allocated from it, so it
+    is only retrieved or deleted"""
+    queryset = ResourcePool.objects.all()
+    serializer_class = ResourcePoolSerializer
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
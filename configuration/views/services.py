@@ -4,36 +4,92 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework.exceptions import ValidationError
 from rest_framework import status
-
-from .mixins import SafeDestroyModelMixin
+from rest_framework.parsers import JSONParser
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+
+from .mixins import (
+    SafeDestroyModelMixin,
+    ConditionalGetMixin,
+    SparseFieldsetMixin,
+)
+from configuration.constants import (
+    BULK_UPDATE_BATCH_SIZE,
+    CONFIG_CACHE_TIMEOUT,
+)
+from configuration.allocation import (
+    ViconfAllocationError,
+    allocate_order_fields,
+)
+from configuration.conflicts import (
+    audit_conflicts,
+    describe,
+    find_batch_conflicts,
+    lock_nodes,
+    order_hostnames,
+    order_usages,
+    overlapping_usages,
+)
+from configuration.jobs import submit_job
+from configuration.metrics import timed
+from configuration.pagination import ViconfCursorPagination
+from configuration.parsers import NDJSONParser
+from configuration.snapshots import record_snapshots
 
 from configuration.helpers import (
     generate_service_schema,
-    generate_quicktemplate_schema
+    generate_quicktemplate_schema,
+    generate_service_config,
+    config_cache,
+    query_service_order_config_key,
+    prefetch_service_orders,
+    fetch_order_nodes,
+    filter_orders_by_node,
+    search_orders,
+    render_service_orders,
+    prefetch_services,
+    generate_required_fields,
+    generate_schema_validators,
+    generate_service_validators,
+    validate_order_fields,
+    get_cached_service_schema,
+    cache_service_schema,
+    query_service_schema_key,
+    update_template_resource_services,
+    apply_template_fieldset,
 )
 
 from configuration.validators import ViconfValidators, ViconfValidationError
 from configuration.models import (
-    Node,
     ResourceTemplate,
     ResourceService,
     Service,
     ServiceOrder,
+    ResourceAllocation,
+    ResourceUsage,
 )
 from configuration.serializers.resources import (
     ResourceTemplateSerializer,
     ResourceTagDefineSerializer,
+    ResourceTagBatchSerializer,
     ResourceServiceSerializer,
     ServiceSerializer,
     ServiceOrderSerializer,
-    ConfigurationSerializer
+    ConfigurationSerializer,
+    ServiceConfigBatchSerializer,
+    ServiceOrderConfigSerializer,
+    ServiceOrderBulkSerializer,
 )
 
 from configuration.mustache import (
     ViconfMustache,
+    ViconfMustacheTagException,
 )
 
 # from configuration.validators import ViconfValidators, ViconfValidationError
@@ -58,45 +114,52 @@ class RetrieveUpdateSafeDestroyAPIView(
         return self.destroy(request, *args, **kwargs)
 
 
-class ResourceTemplateList(generics.ListCreateAPIView):
+class ResourceTemplateList(ConditionalGetMixin, SparseFieldsetMixin,
+                           generics.ListCreateAPIView):
     queryset = ResourceTemplate.objects.filter(deleted=False).all()
     serializer_class = ResourceTemplateSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    pagination_class = ViconfCursorPagination
 
 
-class ResourceTemplateView(RetrieveUpdateSafeDestroyAPIView):
+class ResourceTemplateView(ConditionalGetMixin, RetrieveUpdateSafeDestroyAPIView):
     queryset = ResourceTemplate.objects.filter(deleted=False).all()
     serializer_class = ResourceTemplateSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
 
     def update_related_rs(self, instance):
-        template = instance
-        template_fields = list(template.fields.keys())
-        related = ResourceService.objects.filter(resource_templates__id=instance.id)
-        for rs in related:
-            defaults = [field for field in rs.defaults if field['field'] in template_fields]
-            default_fields = [field['field'] for field in defaults]
-            new_fields = [field for field in template_fields if field not in default_fields]
-            for field in new_fields:
-                defaults.append(
-                    {
-                        "field": field,
-                        "configurable": True,
-                        "default": None
-                    }
-                )
-
-            rs.defaults = defaults
-            rs.save()
+        """Reconcile the defaults of the resource services using the
+        template, in a background job if the background query parameter
+        is set"""
+        background = self.request.query_params.get('background', '')
+        if background.lower() in ('1', 'true', 'yes'):
+            return submit_job(
+                'update_related_rs',
+                update_template_resource_services,
+                instance.id
+            )
+
+        update_template_resource_services(instance.id)
+        return None
 
     def perform_update(self, serializer):
 
         instance = serializer.instance
         serializer.save()
-        self.update_related_rs(instance)
+        self.job = self.update_related_rs(instance)
+
+    def update(self, request, *args, **kwargs):
+        self.job = None
+        response = super().update(request, *args, **kwargs)
+        if self.job is not None:
+            response.status_code = status.HTTP_202_ACCEPTED
+            response['Location'] = reverse(
+                'configuration:job_view', kwargs={'job_id': self.job['id']}
+            )
 
+        return response
 
 
 class ResourceTemplateFieldsetView(APIView):
@@ -128,177 +191,413 @@ class ResourceTemplateFieldsetView(APIView):
 
     def post(self, request, pk, format=None):
         serializer = ResourceTagDefineSerializer(data=request.data)
-        if serializer.is_valid():
-            template = get_object_or_404(
-                ResourceTemplate,
-                pk=pk
-            )
-            for field in request.data['resource_fieldset']:
-                if field['name'] not in template.fields:
-                    raise ValidationError(
-                        f"{field['name']} not in template",
-                        code=400
-                    )
-                template.labels[field['name']] = field['label']
-                vival = ViconfValidators()
-                if field['validator'] not in vival.VALIDATORS.keys():
-                    raise ValidationError(
-                        (f"{field['name']} has unknown validator "
-                         f"{field['validator']}"),
-                        code=400
-                    )
-                template.fields[field['name']] = field['validator']
-                template.save()
+        serializer.is_valid(raise_exception=True)
+        template = get_object_or_404(ResourceTemplate, pk=pk)
+        errors = apply_template_fieldset(
+            template, serializer.validated_data['resource_fieldset']
+        )
+        if errors:
+            raise ValidationError(errors, code=400)
+        template.save(update_fields=['fields', 'labels', 'modified'])
 
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        return Response(serializer.error, status=status.HTTP_400_BAD_REQUEST)
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
     def put(self, *args, **kwargs):
         return self.post(*args, **kwargs)
 
 
-class ResourceServiceList(generics.ListCreateAPIView):
+class ResourceTemplateFieldsetBatchView(APIView):
+    """ Update the fieldsets of many templates at once """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+
+    def post(self, request, format=None):
+        serializer = ResourceTagBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        fieldsets = serializer.validated_data['templates']
+
+        template_ids = [item['resource_template_id'] for item in fieldsets]
+        templates = ResourceTemplate.objects.in_bulk(template_ids)
+        errors = {}
+        for item in fieldsets:
+            template_id = item['resource_template_id']
+            if template_id not in templates:
+                errors[template_id] = [f"Unknown template {template_id}"]
+                continue
+            template_errors = apply_template_fieldset(
+                templates[template_id], item['resource_fieldset']
+            )
+            if template_errors:
+                errors[template_id] = template_errors
+        if errors:
+            raise ValidationError(errors, code=400)
+
+        # bulk_update skips auto_now, which the cache keys depend on
+        now = timezone.now()
+        for template in templates.values():
+            template.modified = now
+        with transaction.atomic():
+            ResourceTemplate.objects.bulk_update(
+                list(templates.values()),
+                ['fields', 'labels', 'modified'],
+                batch_size=BULK_UPDATE_BATCH_SIZE
+            )
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class ResourceServiceList(ConditionalGetMixin, SparseFieldsetMixin,
+                          generics.ListCreateAPIView):
     queryset = ResourceService.objects.all()
+    field_prefetches = {
+        'resource_templates': ['resource_templates'],
+        'resource_template_list': ['resource_templates'],
+    }
     serializer_class = ResourceServiceSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    pagination_class = ViconfCursorPagination
+    etag_dependencies = [(ResourceTemplate, 'resourceservice')]
 
 
-class ResourceServiceView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ResourceService.objects.all()
+class ResourceServiceView(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = ResourceService.objects.prefetch_related(
+        'resource_templates'
+    ).all()
     serializer_class = ResourceServiceSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    etag_dependencies = [(ResourceTemplate, 'resourceservice')]
 
 
-class ServiceList(generics.ListCreateAPIView):
+class ServiceList(ConditionalGetMixin, SparseFieldsetMixin,
+                  generics.ListCreateAPIView):
     queryset = Service.objects.all()
+    field_prefetches = {
+        'resource_services': ['resource_services'],
+        'resource_service_list': ['resource_services__resource_templates'],
+    }
     serializer_class = ServiceSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    pagination_class = ViconfCursorPagination
+    etag_dependencies = [
+        (ResourceService, 'service'),
+        (ResourceTemplate, 'resourceservice__service'),
+    ]
 
 
-class ServiceView(generics.RetrieveDestroyAPIView):
-    queryset = Service.objects.all()
+class ServiceView(ConditionalGetMixin, generics.RetrieveDestroyAPIView):
+    queryset = Service.objects.prefetch_related(
+        'resource_services__resource_templates'
+    ).all()
     serializer_class = ServiceSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    etag_dependencies = [
+        (ResourceService, 'service'),
+        (ResourceTemplate, 'resourceservice__service'),
+    ]
 
 
-class ServiceOrderList(generics.ListCreateAPIView):
-    queryset = ServiceOrder.objects.filter(deleted=False).all()
+class ServiceOrderList(ConditionalGetMixin, SparseFieldsetMixin,
+                       generics.ListCreateAPIView):
+    queryset = ServiceOrder.objects.filter(
+        deleted=False
+    ).select_related('service').all()
     serializer_class = ServiceOrderSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    pagination_class = ViconfCursorPagination
+    etag_dependencies = [(Service, 'serviceorder')]
 
 
-class ServiceOrderView(generics.RetrieveDestroyAPIView):
-    queryset = ServiceOrder.objects.filter(deleted=False).all()
+class ServiceOrderSearchView(SparseFieldsetMixin, generics.ListAPIView):
+    """Find orders by node, by field value on any node, or by field
+    value on a node, with ?node=, ?field= and ?value="""
+    queryset = ServiceOrder.objects.filter(
+        deleted=False
+    ).select_related('service').order_by('id')
     serializer_class = ServiceOrderSerializer
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
+    pagination_class = ViconfCursorPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        node = params.get('node') or None
+        field = params.get('field') or None
+        value = params.get('value')
+        if node is None and field is None:
+            raise ValidationError("Search needs a node or a field", code=400)
+        if (field is None) != (value is None):
+            raise ValidationError(
+                "Search by field needs both field and value", code=400
+            )
 
+        return search_orders(
+            super().get_queryset(), node=node, field=field, value=value
+        )
 
-class ServiceConfigView(APIView):
-    """ Fetch config for a service Order """
+
+class ServiceOrderBulkView(APIView):
+    """Create many service orders from a JSON array or NDJSON upload
+
+    Every order is validated against the schema of its service and the
+    valid orders are inserted in batches. Invalid orders are reported
+    per item and not inserted.
+    """
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
-
-    def get(self, request, pk, format=None):
-        service_order = get_object_or_404(ServiceOrder, pk=pk)
-        service_params = {
-            "reference": service_order.reference,
-            "customer": service_order.customer,
-            "location": service_order.location,
-            "service": service_order.service.name
+    parser_classes = [JSONParser, NDJSONParser]
+    batch_size = 500
+
+    def post(self, request, format=None):
+        if not isinstance(request.data, list):
+            raise ValidationError("Expected a list of orders", code=400)
+
+        child = ServiceOrderBulkSerializer()
+        results = []
+        orders = []
+        for index, item in enumerate(request.data):
+            results.append({"index": index})
+            try:
+                orders.append((index, child.run_validation(item)))
+            except ValidationError as e:
+                results[index]["errors"] = e.detail
+
+        service_ids = {item['service'] for index, item in orders}
+        services = prefetch_services(
+            Service.objects.filter(pk__in=service_ids)
+        ).in_bulk()
+        report = validate_order_fields(
+            [item for index, item in orders],
+            {
+                pk: generate_schema_validators(generate_service_schema(service))
+                for pk, service in services.items()
+            },
+            {
+                pk: generate_required_fields(service)
+                for pk, service in services.items()
+            }
+        )
+
+        validators = {
+            pk: generate_service_validators(service)
+            for pk, service in services.items()
         }
+        usages = [
+            order_usages(item['template_fields'], validators[item['service']])
+            if position not in report else []
+            for position, (index, item) in enumerate(orders)
+        ]
+        for position, errors in find_batch_conflicts(usages).items():
+            report.setdefault(position, []).extend(errors)
+
+        valid = []
+        for position, (index, item) in enumerate(orders):
+            if position in report:
+                results[index]["errors"] = {"template_fields": report[position]}
+                continue
+            valid.append((index, usages[position], ServiceOrder(
+                reference=item['reference'],
+                customer=item.get('customer'),
+                location=item.get('location'),
+                service_id=item['service'],
+                template_fields=item['template_fields'],
+            )))
+
+        # Values given by hand in this request, which allocations skip.
+        # Those of orders turned down below are given back.
+        reserved = [usage for _, held, _ in valid for usage in held]
+        bulk = connection.features.can_return_rows_from_bulk_insert
+        created = 0
+        for start in range(0, len(valid), self.batch_size):
+            batch = []
+            with transaction.atomic():
+                candidates = valid[start:start + self.batch_size]
+                lock_nodes({
+                    hostname
+                    for _, _, order in candidates
+                    for hostname in order_hostnames(
+                        services[order.service_id], order.template_fields
+                    )
+                })
 
-        service = service_order.service
-        vival = ViconfValidators()
-
-        config = {}
-        for rs in service.resource_services.all():
-            defaults = rs.defaults
-            if rs.node is None:
-                # The rs doesn't enforce node, so we pick the first node
-                nodeobj = Node.objects.get(
-                    hostname=list(
-                        service_order.template_fields.keys()
-                    )[0]
-                )
-                node = nodeobj.hostname
-            else:
-                nodeobj = rs.node
-                node = rs.node.hostname
-
-            up_templates = []
-            down_templates = []
-            params = {}
-            for template in rs.resource_templates.all():
-                for field, validator in template.fields.items():
-                    try:
-                        params[field] = vival.test(
-                            validator,
-                            service_order.template_fields[node].get(
-                                field,
-                                next(
-                                    (x['default'] for x in defaults
-                                     if x['field'] == field),
-                                    None
-                                )
+                positions = {
+                    id(usage): position
+                    for position, (_, held, _) in enumerate(candidates)
+                    for usage in held
+                }
+                conflicts = {}
+                for usage, other in overlapping_usages(
+                        [usage for _, held, _ in candidates for usage in held]):
+                    conflicts.setdefault(positions[id(usage)], []).append(
+                        describe(usage, other)
+                    )
+
+                for position, (index, held, order) in enumerate(candidates):
+                    errors = conflicts.get(position)
+                    allocations = []
+                    if errors is None:
+                        try:
+                            allocations = allocate_order_fields(
+                                services[order.service_id],
+                                order.template_fields,
+                                reserved
                             )
+                        except ViconfAllocationError as e:
+                            errors = [str(e)]
+                    if errors is not None:
+                        results[index]["errors"] = {"template_fields": errors}
+                        dropped = {id(usage) for usage in held}
+                        reserved = [
+                            usage for usage in reserved
+                            if id(usage) not in dropped
+                        ]
+                        continue
+                    if allocations:
+                        held = order_usages(
+                            order.template_fields, validators[order.service_id]
                         )
-                    except ViconfValidationError:
-                        raise ValidationError(
-                            f"{field} is not a valid {validator}",
-                            code=400
-                        )
+                    batch.append((index, held, allocations, order))
 
-                up_templates.append(template.up_contents)
-                down_templates.append(template.down_contents)
+                if bulk:
+                    ServiceOrder.objects.bulk_create(
+                        [order for index, _, _, order in batch]
+                    )
+                    batch_usages = []
+                    for index, held, _, order in batch:
+                        for usage in held:
+                            usage.order = order
+                            batch_usages.append(usage)
+                    ResourceUsage.objects.bulk_create(batch_usages)
+                else:
+                    # Without primary keys from bulk inserts the usages
+                    # can't be linked, so save one by one
+                    for index, _, _, order in batch:
+                        order.save()
+
+                batch_allocations = []
+                for index, _, allocations, order in batch:
+                    for allocation in allocations:
+                        allocation.order = order
+                        batch_allocations.append(allocation)
+                ResourceAllocation.objects.bulk_create(batch_allocations)
+
+            for index, _, _, order in batch:
+                results[index]["id"] = order.pk
+            created += len(batch)
+
+        return Response(
+            {
+                "created": created,
+                "failed": len(results) - created,
+                "results": results,
+            },
+            status=status.HTTP_200_OK
+        )
+
+
+class ServiceOrderConflictView(APIView):
+    """ Report every vlan, bundle and IPv4 overlap between live orders """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
 
-            if node not in config:
-                config[node] = {"node": node}
+    def get(self, request, format=None):
+        return Response(audit_conflicts())
 
-            if "service_up" not in config[node]:
-                config[node]["service_up"] = ""
 
-            if "service_down" not in config[node]:
-                config[node]["service_down"] = ""
+class ServiceOrderView(ConditionalGetMixin, generics.RetrieveDestroyAPIView):
+    queryset = ServiceOrder.objects.filter(
+        deleted=False
+    ).select_related('service').all()
+    serializer_class = ServiceOrderSerializer
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    etag_dependencies = [(Service, 'serviceorder')]
 
-            params["node"] = node
-            params["node_ipv4"] = nodeobj.ipv4
-            params["node_ipv6"] = nodeobj.ipv6
 
-            up_template = ViconfMustache(up_templates)
-            down_template = ViconfMustache(down_templates)
-            config[node]["service_up"] = up_template.compile(
-                params=params,
-                service_params=service_params
-            )
-            config[node]["service_down"] = down_template.compile(
-                params=params,
-                service_params=service_params
+class ServiceConfigView(APIView):
+    """ Fetch config for a service Order """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
 
+    def get(self, request, pk, format=None):
+        # A cache hit costs the key query and the cache lookup
+        key = query_service_order_config_key(pk)
+        data = config_cache().get(key) if key is not None else None
+        if data is None:
+            service_order = get_object_or_404(
+                prefetch_service_orders(ServiceOrder.objects.all()),
+                pk=pk
             )
-
-        data = list(config.values())
+            nodes = fetch_order_nodes([service_order])
+            try:
+                with timed('config'):
+                    data = generate_service_config(service_order, nodes=nodes)
+            except (ViconfValidationError, ViconfMustacheTagException) as e:
+                raise ValidationError(str(e), code=400)
+            record_snapshots([(service_order, data)])
+            if key is not None:
+                config_cache().set(key, data, timeout=CONFIG_CACHE_TIMEOUT)
 
         serializer = ConfigurationSerializer(data, many=True)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+class ServiceConfigBatchView(APIView):
+    """ Fetch config for many service orders in one request """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+
+    def post(self, request, format=None):
+        serializer = ServiceConfigBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        query = serializer.validated_data
+
+        queryset = ServiceOrder.objects.filter(deleted=False)
+        if 'orders' in query:
+            queryset = queryset.filter(pk__in=query['orders'])
+        if 'service' in query:
+            queryset = queryset.filter(service=query['service'])
+        if 'node' in query:
+            queryset = filter_orders_by_node(queryset, query['node'])
+
+        service_orders = list(
+            prefetch_service_orders(queryset.order_by('id'))
+        )
+        data = list(render_service_orders(service_orders))
+
+        serializer = ServiceOrderConfigSerializer(data, many=True)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
 class ServiceSchemaView(APIView):
     """ Retrieve a schema for a service that matches a ServiceOrder view"""
     permission_classes = [IsAuthenticated]
     authentication_classes = [JWTAuthentication]
 
     def get(self, request, pk, format=None):
-        service = get_object_or_404(Service, pk=pk)
-        schema = generate_service_schema(service)
+        key = query_service_schema_key(pk)
+        if key is None:
+            raise Http404
+        cached = get_cached_service_schema(key)
+        if cached is None:
+            service = get_object_or_404(
+                prefetch_services(Service.objects.all()),
+                pk=pk
+            )
+            cached = cache_service_schema(service, key)
 
-        return Response(schema)
+        etag = f'"{cached["etag"]}"'
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(cached['schema'])
+        response['ETag'] = etag
+
+        return response
 
 
 class QuickTemplateView(APIView):
@@ -308,7 +607,10 @@ class QuickTemplateView(APIView):
 
     def get(self, request, pk, format=None):
         template = get_object_or_404(ResourceTemplate, pk=pk)
-        schema = generate_quicktemplate_schema(template)
+        try:
+            schema = generate_quicktemplate_schema(template)
+        except ViconfMustacheTagException as e:
+            raise ValidationError(str(e), code=400)
 
         return Response(schema)
 
@@ -322,20 +624,14 @@ class QuickTemplateView(APIView):
             )
         fields = request.data['fields']
 
-        params = {}
-        vival = ViconfValidators()
-
-        for field, validator in template.fields.items():
-            try:
-                params[field] = vival.test(
-                    validator,
-                    fields[field]
-                )
-            except ViconfValidationError:
-                raise ValidationError(
-                    f"{field} is not a valid {validator}",
-                    code=400
-                )
+        # Fields left out render empty rather than as "None"
+        params = {
+            field: '' if fields.get(field) is None else fields[field]
+            for field in template.fields
+        }
+        errors = ViconfValidators().validate_many(template.fields, params)
+        if errors:
+            raise ValidationError(list(errors.values()), code=400)
 
         up_template = ViconfMustache(template.up_contents)
         service_params = {}
@@ -343,6 +639,9 @@ class QuickTemplateView(APIView):
             if field not in params:
                 service_params[field] = value
 
-        data = {'template': up_template.compile(params, service_params)}
+        try:
+            data = {'template': up_template.compile(params, service_params)}
+        except ViconfMustacheTagException as e:
+            raise ValidationError(str(e), code=400)
 
         return Response(data)
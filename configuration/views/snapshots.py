@@ -0,0 +1,53 @@
+""" History of the configs rendered for service orders """
+from django.shortcuts import get_object_or_404
+from rest_framework import generics
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from configuration.models import ConfigSnapshot
+from configuration.pagination import ViconfCursorPagination
+from configuration.serializers.resources import (
+    ConfigSnapshotDetailSerializer,
+    ConfigSnapshotSerializer,
+)
+from configuration.snapshots import diff_snapshots
+
+
+class ServiceConfigHistoryView(generics.ListAPIView):
+    """ The snapshots of a service order, newest first """
+    serializer_class = ConfigSnapshotSerializer
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+    pagination_class = ViconfCursorPagination
+    cursor_ordering_fields = ('-id', 'id')
+
+    def get_queryset(self):
+        return ConfigSnapshot.objects.filter(
+            order=self.kwargs['pk']
+        ).order_by('-id')
+
+
+class ConfigSnapshotView(generics.RetrieveAPIView):
+    """ A snapshot with its config """
+    queryset = ConfigSnapshot.objects.all()
+    serializer_class = ConfigSnapshotDetailSerializer
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+
+
+class ConfigSnapshotDiffView(APIView):
+    """ Line diffs of the configs that changed between two snapshots """
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [JWTAuthentication]
+
+    def get(self, request, pk, other, format=None):
+        old = get_object_or_404(ConfigSnapshot, pk=pk)
+        new = get_object_or_404(ConfigSnapshot, pk=other)
+
+        return Response({
+            "from": old.pk,
+            "to": new.pk,
+            "nodes": diff_snapshots(old, new),
+        })
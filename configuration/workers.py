@@ -0,0 +1,165 @@
+""" Executors running template rendering off the request thread """
+
+import asyncio
+import contextvars
+import functools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+
+from .constants import (
+    JOB_THREADS,
+    PARALLEL_RENDER_THRESHOLD,
+    RENDER_PROCESSES,
+    RENDER_THREADS,
+    TEMPLATE_CACHE_SIZE,
+)
+from .mustache import ViconfMustache
+from .validators import ViconfValidationError, ViconfValidators
+
+_lock = threading.Lock()
+_thread_executor = None
+_process_executor = None
+_job_executor = None
+
+# The up and down texts of templates by content hash, and the merged
+# templates by their content hashes, kept by each render worker process
+_worker_texts = {}
+_worker_merged = {}
+
+
+def render_thread_executor():
+    """ The process wide thread pool for rendering, created on first use """
+    global _thread_executor
+    with _lock:
+        if _thread_executor is None:
+            _thread_executor = ThreadPoolExecutor(
+                max_workers=getattr(
+                    settings, 'VICONF_RENDER_THREADS', RENDER_THREADS
+                ),
+                thread_name_prefix='viconf-render'
+            )
+        return _thread_executor
+
+
+async def run_in_render_pool(func, *args):
+    """Run func in the render thread pool from async code, keeping the
+    context so request timings are still recorded"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        render_thread_executor(),
+        functools.partial(context.run, func, *args)
+    )
+
+
+def parallel_render_threshold():
+    return getattr(
+        settings, 'VICONF_PARALLEL_RENDER_THRESHOLD', PARALLEL_RENDER_THRESHOLD
+    )
+
+
+def render_processes():
+    """ The number of render worker processes, 0 if disabled """
+    processes = getattr(settings, 'VICONF_RENDER_PROCESSES', RENDER_PROCESSES)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    return processes
+
+
+def render_process_executor():
+    """The process wide process pool for rendering large services,
+    or None if it is disabled"""
+    global _process_executor
+    processes = render_processes()
+    if processes == 0:
+        return None
+
+    with _lock:
+        if _process_executor is None:
+            # Spawn rather than fork, the server may be running threads
+            _process_executor = ProcessPoolExecutor(
+                max_workers=processes,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _process_executor
+
+
+def reset_render_process_executor():
+    """ Drop the process pool, after it broke or when settings change """
+    global _process_executor
+    with _lock:
+        executor, _process_executor = _process_executor, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def job_executor():
+    """ The process wide thread pool for background jobs """
+    global _job_executor
+    with _lock:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(
+                max_workers=getattr(
+                    settings, 'VICONF_JOB_THREADS', JOB_THREADS
+                ),
+                thread_name_prefix='viconf-job'
+            )
+        return _job_executor
+
+
+def render_node(up_template, down_template, fields_list, params,
+                service_params):
+    """Validate the params of a node against the fields of each of its
+    templates, then render the merged up and down templates.
+
+    Raises ViconfValidationError if a field does not validate.
+    """
+    vival = ViconfValidators()
+    errors = {}
+    for fields in fields_list:
+        errors.update(vival.validate_many(fields, params))
+    if errors:
+        raise ViconfValidationError(", ".join(errors.values()))
+
+    return (
+        up_template.compile(params=dict(params), service_params=service_params),
+        down_template.compile(
+            params=dict(params), service_params=service_params
+        ),
+    )
+
+
+def worker_templates(keys):
+    """ The merged up and down templates of template keys in a worker """
+    merged = _worker_merged.get(keys)
+    if merged is None:
+        if len(_worker_merged) >= TEMPLATE_CACHE_SIZE:
+            _worker_merged.clear()
+        merged = _worker_merged[keys] = (
+            ViconfMustache([_worker_texts[key][0] for key in keys]),
+            ViconfMustache([_worker_texts[key][1] for key in keys]),
+        )
+    return merged
+
+
+def render_node_jobs(jobs, service_params, texts):
+    """Render (template keys, fields list, params) jobs in a render worker.
+
+    texts holds the (up, down) texts of every key of the jobs, as any
+    worker of the pool may run them. The merged templates stay cached by
+    their keys, so a worker parses a template combination only once.
+    """
+    if len(_worker_texts) + len(texts) > TEMPLATE_CACHE_SIZE:
+        _worker_texts.clear()
+        _worker_merged.clear()
+    _worker_texts.update(texts)
+
+    return [
+        render_node(*worker_templates(keys), fields_list, params,
+                    service_params)
+        for keys, fields_list, params in jobs
+    ]
@@ -48,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'configuration.middleware.ServerTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -138,3 +139,28 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
     ]
 }
+
+# Rendered service order configs are cached in the cache named by
+# VICONF_CONFIG_CACHE. It is process local by default; set
+# CONFIG_CACHE_BACKEND to the file based or database cache backend and
+# CONFIG_CACHE_LOCATION to its directory or table to share it.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'configs': {
+        'BACKEND': os.environ.get(
+            'CONFIG_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CONFIG_CACHE_LOCATION', 'viconf-configs'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+VICONF_CONFIG_CACHE = 'configs'
+
+# Addresses that may scrape /metrics without a token, space separated in
+# METRICS_ALLOWED_IPS. Other clients need a JWT like the API.
+VICONF_METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '').split()
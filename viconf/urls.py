@@ -20,6 +20,7 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
     TokenVerifyView,
 )
+from configuration.views.metrics import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -38,6 +39,7 @@ urlpatterns = [
         TokenVerifyView.as_view(),
         name='token_verify'
     ),
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path(
         "api/v1/",
         include("configuration.urls"),